@@ -1,17 +1,19 @@
 """ 
 This module contains functions for comparing two corpuses with each other,
 including:
-- running t-tests on token occurrences between the two corpuses
+- running t-tests (or chi-square, Fisher exact or log-likelihood tests)
+  on token occurrences between the two corpuses
 - filtering out tokens above some p-value threshold, and writing 
   to file the remaiing tokens
 """
 
 import gensim as gs
 import numpy as np
-import math
 import codecs
-from scipy.stats import ttest_ind
+import heapq
+from scipy.special import chdtrc, gammaln, stdtr, xlogy
 import logging
+import df_snapshot as snapshot
 
 MOD_LOGGER = logging.getLogger('text_processing.compare')
 
@@ -24,41 +26,94 @@ def get_token2df(gs_dict):
     """
     return {word: gs_dict.dfs[word_id] for (word_id, word) in gs_dict.items()}
 
-def merge_two_cores(gs_dict_1, gs_dict_2, join='outer'):
-    """ Takes two gensim Dictionary objects and merges them
-    into a single normal dictionary of
-    {token: [df in gs_dict_1, df in gs_dict_2]}
-    
+def get_token_df_arrays(core):
+    """ Takes a core (gensim Dictionary object, DfSnapshot, or a (tokens,
+    dfs) pair) and returns (tokens, dfs) as numpy arrays sorted by token
+
     Inputs:
-    - gs_dict_1, gs_dict_2 = gensim Dictionary objects
+    - core = gensim Dictionary object, df_snapshot.DfSnapshot (already
+      sorted, so used as is), or pair of sequences of tokens and their dfs
+    """
+    if isinstance(core, snapshot.DfSnapshot):
+        return core.tokens, core.dfs
+
+    if isinstance(core, gs.corpora.Dictionary):
+        token_ids = core.token2id.items()
+        tokens = [token for (token, _) in token_ids]
+        dfs = [core.dfs[token_id] for (_, token_id) in token_ids]
+    else:
+        tokens, dfs = core
+
+    tokens = np.array(tokens, dtype=object)
+    dfs = np.asarray(dfs, dtype=np.int64)
+    order = np.argsort(tokens, kind='mergesort')
+
+    return tokens[order], dfs[order]
+
+def merge_cores(cores, join='outer'):
+    """ Takes any number of cores and merges them on their sorted token
+    arrays into (tokens, dfs), where tokens is a sorted numpy array and
+    dfs is a (num tokens x num cores) int64 numpy array whose columns
+    are the dfs of those tokens in each core (0 if not in the core)
+
+    Inputs:
+    - cores = list of gensim Dictionary objects, DfSnapshots or (tokens,
+      dfs) pairs
     - join = how you want to join the tokens: 'inner' gives back only
-      tokens that are common between the two; 'outer' gives back all
-      tokens in both cores; 'left' joins on gs_dict_1; 'right' joins
-      on gs_dict_2
+      tokens that are in every core; 'outer' gives back all tokens in
+      any core; 'left' joins on the first core; 'right' joins on the last
     """
-    core_1 = get_token2df(gs_dict_1)
-    core_2 = get_token2df(gs_dict_2)
+    token_df_arrays = [get_token_df_arrays(core) for core in cores]
 
-    MOD_LOGGER.info('Received call to "merge_two_cores"')
+    MOD_LOGGER.info('Received call to "merge_cores"')
     MOD_LOGGER.info(
-        'Merging two cores of lengths %s and %s with %s join',
-        len(core_1), len(core_2), join)
+        'Merging %s cores of lengths %s with %s join', len(cores),
+        [len(tokens) for (tokens, _) in token_df_arrays], join)
+
+    all_tokens = [tokens for (tokens, _) in token_df_arrays]
 
     if join == 'outer':
-        tokens_set = set(core_1.keys() + core_2.keys())
+        tokens = np.unique(np.concatenate(all_tokens))
     elif join == 'inner':
-        tokens_set = set(token for token in core_1 if token in core_2)
+        tokens = all_tokens[0]
+        for core_tokens in all_tokens[1:]:
+            tokens = np.intersect1d(tokens, core_tokens, assume_unique=True)
     elif join == 'left':
-        tokens_set = set(core_1)
+        tokens = all_tokens[0]
     elif join == 'right':
-        tokens_set = set(core_2)
+        tokens = all_tokens[-1]
+    else:
+        raise ValueError("join must be 'inner', 'outer', 'left' or 'right'")
+
+    dfs = np.zeros((len(tokens), len(cores)), dtype=np.int64)
 
-    merged_core = {
-        token: [core_1.get(token, 0), core_2.get(token, 0)]
-        for token in tokens_set
-    }
+    for col, (core_tokens, core_dfs) in enumerate(token_df_arrays):
+        if len(core_tokens) == 0:
+            continue
 
-    return merged_core
+        positions = np.minimum(np.searchsorted(core_tokens, tokens),
+                               len(core_tokens) - 1)
+        is_in_core = core_tokens[positions] == tokens
+        dfs[is_in_core, col] = core_dfs[positions[is_in_core]]
+
+    return tokens, dfs
+
+def merge_two_cores(gs_dict_1, gs_dict_2, join='outer'):
+    """ Takes two gensim Dictionary objects and merges them
+    into a single normal dictionary of
+    {token: [df in gs_dict_1, df in gs_dict_2]}; use merge_cores to keep
+    the merged dfs as aligned arrays instead
+
+    Inputs:
+    - gs_dict_1, gs_dict_2 = gensim Dictionary objects
+    - join = how you want to join the tokens: 'inner' gives back only
+      tokens that are common between the two; 'outer' gives back all
+      tokens in both cores; 'left' joins on gs_dict_1; 'right' joins
+      on gs_dict_2
+    """
+    tokens, dfs = merge_cores([gs_dict_1, gs_dict_2], join)
+
+    return dict(zip(tokens.tolist(), dfs.tolist()))
 
 def make_binary_array(num_ones, total_length):
     """ Makes a vector (aka numpy array) of 1's and 0's, where vector is
@@ -75,67 +130,280 @@ def make_binary_array(num_ones, total_length):
         list(np.ones(num_ones)) +
         list(np.zeros(total_length - num_ones)))
 
+def df_multipliers(dfs_1, dfs_2, size_sample1, size_sample2):
+    """ Takes numpy arrays of dfs of each token in two samples and returns
+    a numpy array of how many times more often each token occurs on
+    sample1 than on sample2
+
+    Inputs:
+    - dfs_1, dfs_2 = numpy arrays of token doc freqs in sample 1 and 2
+    - size_sample1 = total num docs in sample 1
+    - size_sample2 = total num docs in sample 2
+    """
+    VAL_FOR_ZERO = 0.1 # val to add on to prevent division by 0 error
+
+    scope_sample1 = (np.asarray(dfs_1, dtype=float) + VAL_FOR_ZERO) / size_sample1
+    scope_sample2 = (np.asarray(dfs_2, dtype=float) + VAL_FOR_ZERO) / size_sample2
+
+    return scope_sample1 / scope_sample2
+
+def df_ttest_pvals(dfs_1, dfs_2, size_sample1, size_sample2):
+    """ Takes numpy arrays of dfs of each token in two samples and returns
+    a numpy array of pvals of the t-test (same as scipy's ttest_ind)
+    between each token's binary arrays (see make_binary_array) in the two
+    samples, worked out straight from the dfs; pval is NaN where
+    ttest_ind's would be (both binary arrays constant and equal)
+
+    Inputs:
+    - dfs_1, dfs_2 = numpy arrays of token doc freqs in sample 1 and 2
+    - size_sample1 = total num docs in sample 1
+    - size_sample2 = total num docs in sample 2
+    """
+    dfs_1 = np.asarray(dfs_1, dtype=float)
+    dfs_2 = np.asarray(dfs_2, dtype=float)
+    degrees_freedom = size_sample1 + size_sample2 - 2
+
+    # sum of squared deviations from the mean of a binary array with df 1's
+    # out of n is df * (n - df) / n
+    sum_squares = (dfs_1 * (size_sample1 - dfs_1) / size_sample1 +
+                   dfs_2 * (size_sample2 - dfs_2) / size_sample2)
+    pooled_var = sum_squares / degrees_freedom
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_stats = ((dfs_1 / size_sample1 - dfs_2 / size_sample2) /
+                   np.sqrt(pooled_var * (1.0 / size_sample1 +
+                                         1.0 / size_sample2)))
+
+    return 2 * stdtr(degrees_freedom, -np.abs(t_stats))
+
+def _two_by_two(dfs_1, dfs_2, size_sample1, size_sample2):
+    """ Returns the cells (a, b, c, d) of each token's 2x2 table of
+    [docs with token, docs without token] x [sample 1, sample 2], as
+    float numpy arrays
+    """
+    dfs_1 = np.asarray(dfs_1, dtype=float)
+    dfs_2 = np.asarray(dfs_2, dtype=float)
+
+    return dfs_1, size_sample1 - dfs_1, dfs_2, size_sample2 - dfs_2
+
+def df_chi2_pvals(dfs_1, dfs_2, size_sample1, size_sample2):
+    """ Takes numpy arrays of dfs of each token in two samples and returns
+    a numpy array of pvals of Pearson's chi-square test (no continuity
+    correction) on each token's 2x2 table; pval is NaN where the token is
+    on all or none of the docs in both samples
+
+    Inputs:
+    - dfs_1, dfs_2 = numpy arrays of token doc freqs in sample 1 and 2
+    - size_sample1 = total num docs in sample 1
+    - size_sample2 = total num docs in sample 2
+    """
+    a, b, c, d = _two_by_two(dfs_1, dfs_2, size_sample1, size_sample2)
+    total = float(size_sample1 + size_sample2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi2 = (total * (a * d - b * c) ** 2 /
+                (size_sample1 * size_sample2 * (a + c) * (b + d)))
+
+    return chdtrc(1, chi2)
+
+def df_loglik_pvals(dfs_1, dfs_2, size_sample1, size_sample2):
+    """ Takes numpy arrays of dfs of each token in two samples and returns
+    a numpy array of pvals of Dunning's log-likelihood (G2) test on each
+    token's 2x2 table
+
+    Inputs:
+    - dfs_1, dfs_2 = numpy arrays of token doc freqs in sample 1 and 2
+    - size_sample1 = total num docs in sample 1
+    - size_sample2 = total num docs in sample 2
+    """
+    a, b, c, d = _two_by_two(dfs_1, dfs_2, size_sample1, size_sample2)
+    total = float(size_sample1 + size_sample2)
+
+    # G2 = 2 * sum of O ln(O / E) over the 4 cells, where E = row total *
+    # col total / N; written as O ln O - O ln E so that empty cells add 0
+    g2 = 0
+    for observed, row_total, col_total in [(a, size_sample1, a + c),
+                                           (b, size_sample1, b + d),
+                                           (c, size_sample2, a + c),
+                                           (d, size_sample2, b + d)]:
+        g2 += (xlogy(observed, observed) -
+               xlogy(observed, row_total * col_total / total))
+
+    return chdtrc(1, np.maximum(2 * g2, 0))
+
+def df_fisher_pvals(dfs_1, dfs_2, size_sample1, size_sample2):
+    """ Takes numpy arrays of dfs of each token in two samples and returns
+    a numpy array of pvals of the two-sided Fisher exact test on each
+    token's 2x2 table
+
+    The log-factorial table is made once for the two sample sizes, and
+    tokens with the same total df share the same hypergeometric
+    distribution, so it is only worked out once per distinct total df
+
+    Inputs:
+    - dfs_1, dfs_2 = numpy arrays of token doc freqs in sample 1 and 2
+    - size_sample1 = total num docs in sample 1
+    - size_sample2 = total num docs in sample 2
+    """
+    RELATIVE_TOLERANCE = 1 + 1e-7 # tables this close to as likely count
+
+    dfs_1 = np.asarray(dfs_1).astype(np.int64)
+    totals = dfs_1 + np.asarray(dfs_2).astype(np.int64)
+    num_docs = size_sample1 + size_sample2
+
+    log_factorials = gammaln(np.arange(num_docs + 1) + 1.0)
+    pvals = np.empty(len(dfs_1))
+
+    order = np.argsort(totals, kind='mergesort')
+    sorted_totals = totals[order]
+    group_starts = np.flatnonzero(
+        np.concatenate(([True], sorted_totals[1:] != sorted_totals[:-1])))
+
+    for start, end in zip(group_starts, np.append(group_starts[1:],
+                                                  len(order))):
+        total = sorted_totals[start]
+        tokens = order[start:end]
+
+        # hypergeometric pmf of every possible df in sample 1, given total
+        min_df = max(0, total - size_sample2)
+        dfs = np.arange(min_df, min(size_sample1, total) + 1)
+        pmf = np.exp(
+            log_factorials[size_sample1] - log_factorials[dfs] -
+            log_factorials[size_sample1 - dfs] +
+            log_factorials[size_sample2] - log_factorials[total - dfs] -
+            log_factorials[size_sample2 - total + dfs] -
+            log_factorials[num_docs] + log_factorials[total] +
+            log_factorials[num_docs - total])
+
+        # pval = sum of pmf of all dfs no more likely than the observed one
+        sorted_pmf = np.sort(pmf)
+        cumulative_pmf = np.cumsum(sorted_pmf)
+        num_as_likely = np.searchsorted(
+            sorted_pmf, pmf[dfs_1[tokens] - min_df] * RELATIVE_TOLERANCE,
+            side='right')
+        pvals[tokens] = np.minimum(cumulative_pmf[num_as_likely - 1], 1.0)
+
+    return pvals
+
+# significance tests that can be run on dfs, by name; each takes
+# (dfs_1, dfs_2, size_sample1, size_sample2) and returns pvals
+SIG_TESTS = {
+    'ttest': df_ttest_pvals,
+    'chi2': df_chi2_pvals,
+    'fisher': df_fisher_pvals,
+    'loglik': df_loglik_pvals,
+}
+
+def df_test_arrays(dfs_1, dfs_2, size_sample1, size_sample2, test='ttest'):
+    """ Takes numpy arrays of dfs of each token in two samples and returns
+    numpy arrays of (multipliers, pvals) for every token in one pass
+    (see df_multipliers and SIG_TESTS)
+
+    Inputs:
+    - dfs_1, dfs_2 = numpy arrays of token doc freqs in sample 1 and 2
+    - size_sample1 = total num docs in sample 1
+    - size_sample2 = total num docs in sample 2
+    - test = name of significance test in SIG_TESTS ('ttest', 'chi2',
+      'fisher' or 'loglik')
+    """
+    if test not in SIG_TESTS:
+        raise ValueError('Unknown significance test %r, pick one of %s' %
+                         (test, sorted(SIG_TESTS)))
+
+    return (df_multipliers(dfs_1, dfs_2, size_sample1, size_sample2),
+            SIG_TESTS[test](dfs_1, dfs_2, size_sample1, size_sample2))
+
+def df_ttest_arrays(dfs_1, dfs_2, size_sample1, size_sample2):
+    """ Takes numpy arrays of dfs of each token in two samples and returns
+    numpy arrays of (multipliers, ttest pvals) for every token in one pass
+    (see df_multipliers and df_ttest_pvals)
+    """
+    return df_test_arrays(dfs_1, dfs_2, size_sample1, size_sample2, 'ttest')
+
+def merged_core_arrays(merged_core):
+    """ Returns (tokens, dfs_1, dfs_2) of a merged core given either as a
+    dictionary of {token: [df1, df2]} or as (tokens, dfs) from merge_cores
+    """
+    if isinstance(merged_core, dict):
+        tokens = list(merged_core)
+        dfs = np.array([merged_core[token] for token in tokens],
+                       dtype=np.int64).reshape(len(tokens), 2)
+    else:
+        tokens, dfs = merged_core
+
+    return tokens, dfs[:, 0], dfs[:, 1]
+
+def df_test_rows(merged_core, size_sample1, size_sample2, min_num=10,
+                 min_multiplier=0, pval_threshold=1, test='ttest'):
+    """ Same as df_ttest_pval_generator, but yields
+    (word, pval, df in sample 1, df in sample 2)
+    """
+    tokens, dfs_1, dfs_2 = merged_core_arrays(merged_core)
+
+    MOD_LOGGER.info(
+        'Conducting %s on %s tokens, ignoring tokens with df < %s and mult < %s',
+        test, len(tokens), min_num, min_multiplier)
+
+    multipliers, pvals = df_test_arrays(dfs_1, dfs_2, size_sample1,
+                                        size_sample2, test)
+
+    # NaN pvals compare as False, so are left out like before
+    with np.errstate(invalid='ignore'):
+        is_kept = (
+            ((dfs_1 + dfs_2) >= min_num) &
+            ~((dfs_1 == size_sample1) & (dfs_2 == size_sample2)) &
+            (multipliers >= min_multiplier) &
+            (pvals < pval_threshold))
+
+    for i in np.flatnonzero(is_kept):
+        yield (tokens[i], pvals[i], dfs_1[i], dfs_2[i])
+
 def df_ttest_pval_generator(merged_core, size_sample1, size_sample2,
-                            min_num=10, min_multiplier=0, pval_threshold=1):
+                            min_num=10, min_multiplier=0, pval_threshold=1,
+                            test='ttest'):
     """ Takes a dictionary of {word: [doc frequency in sample 1,
-    doc frequency in sample 2]} and conducts t-tests on dfs for each
-    word; is a generator yielding [word, ttest pvalue]
+    doc frequency in sample 2]} and conducts t-tests (or another test in
+    SIG_TESTS) on dfs for each word; is a generator yielding [word, pvalue]
 
     Inputs:
-    - merged_core = dictionary of words to word doc freqs in two samples
+    - merged_core = dictionary of words to word doc freqs in two samples,
+      or (tokens, dfs) from merge_cores of two cores
     - size_sample1 = total num docs in sample 1
     - size_sample2 = total num docs in sample 2
-	- min_num = threshold that word has to hit above on at least one sample
+    - min_num = threshold that word has to hit above on at least one sample
       in order to conduct ttest (eiter df1 or df2 must be >= min_num)
     - min_multiplier = min number of times token has to occur on sample1
       OVER sample2 in order to be considered (EX: 2 = occurs at least 2x
       more often on sample1 than on sample2)
     - pval_threshold = max pval allowed for [word, pval] to be yielded for
       a particular word
+    - test = name of significance test in SIG_TESTS; default is 'ttest'
     """
     MOD_LOGGER.info('Received call to "df_ttest_pval_generator"')
-    MOD_LOGGER.info(
-        'Conducting ttest on %s tokens, ignoring tokens with df < %s and mult < %s',
-        len(merged_core), min_num, min_multiplier)
-
-    VAL_FOR_ZERO = 0.1 # val to add on to prevent division by 0 error
-
-    for word in merged_core:
-        df_sample1 = merged_core[word][0]
-        df_sample2 = merged_core[word][1]
 
-        if (df_sample1 + df_sample2) < min_num:
-            continue
-        if (df_sample1 == size_sample1 and df_sample2 == size_sample2):
-            continue
-
-        scope_sample1 = ((float(merged_core[word][0]) + VAL_FOR_ZERO) /
-            size_sample1)
-        scope_sample2 = ((float(merged_core[word][1]) + VAL_FOR_ZERO) /
-            size_sample2)
-        multiplier = scope_sample1 / scope_sample2
-
-        if multiplier < min_multiplier:
-            continue
-        else:
-            df1_array = make_binary_array(merged_core[word][0],
-                size_sample1)
-            df2_array = make_binary_array(merged_core[word][1],
-                size_sample2)
-            _, pval = ttest_ind(df1_array, df2_array)
-
-            if not math.isnan(pval) and pval < pval_threshold:
-                yield [word, pval]
+    for (word, pval, _, _) in df_test_rows(
+        merged_core, size_sample1, size_sample2, min_num, min_multiplier,
+        pval_threshold, test):
+        yield [word, pval]
 
 def write_df_ttest_to_file(merged_core, size_sample1, size_sample2, 
                            file_name=None, min_num=10, min_multiplier=0, 
-                           pval_threshold=1, handle=None):
+                           pval_threshold=1, handle=None, test='ttest',
+                           top_k=None):
     """ Takes a dictionary of {word: [doc freq in sample 1, doc freq in sample
-    2]} and writes the results of conducting t-tests on dfs for each word to
-    txt file
+    2]} and writes the results of conducting t-tests (or another test in
+    SIG_TESTS) on dfs for each word to txt file
+
+    If top_k is given, only the top_k rows with the lowest pvals (as
+    written, ties going to the higher df in sample 1, then to the row
+    that comes first) are kept, in a heap of at most top_k rows, and are
+    written already sorted that way, which is the order
+    script_utils.sort_file(file_name, [1, 2], [False, True], col_sep=',',
+    transform=float) would put all the rows in
 
     Inputs:
-    - merged_core = dictionary of words to word doc freqs in two samples
+    - merged_core = dictionary of words to word doc freqs in two samples,
+      or (tokens, dfs) from merge_cores of two cores
     - size_sample1 = total num docs in sample 1
     - size_sample2 = total num docs in sample 2
     - file_name = name of file to be created
@@ -145,20 +413,29 @@ def write_df_ttest_to_file(merged_core, size_sample1, size_sample2,
       OVER sample2 in order to be considered (EX: 2 = occurs at least 2x
       more often on sample1 than on sample2)
     - handle = file-like object (like StringIO, for testing)
+    - test = name of significance test in SIG_TESTS ('ttest', 'chi2',
+      'fisher' or 'loglik'); default is 'ttest'
+    - top_k = max number of rows to write, sorted by pval (asc), df in
+      sample 1 (desc); default is None, all rows, unsorted
     """
     if handle is None:
         fo = open(file_name, 'w')
     else:
         fo = handle
 
-    MOD_LOGGER.info('Conducting df ttests and writing pvals to file...')
+    MOD_LOGGER.info('Conducting df %s and writing pvals to file...', test)
 
-    for [word, pval] in df_ttest_pval_generator(
-        merged_core, size_sample1, size_sample2, min_num, min_multiplier,
-        pval_threshold):
+    rows = df_test_rows(merged_core, size_sample1, size_sample2, min_num,
+                        min_multiplier, pval_threshold, test)
+    if top_k is not None:
+        # pvals are compared as written, like sorting the file would
+        rows = heapq.nsmallest(
+            top_k, rows, key=lambda row: (float('%.3f' % row[1]), -row[2]))
+        MOD_LOGGER.info('Kept top %s rows by pval', len(rows))
+
+    for (word, pval, df_1, df_2) in rows:
         fo.write('%(0)s,%(1).3f,%(2)i,%(3)i\n' % {
-            '0': word, '1': pval,
-            '2':merged_core[word][0], '3':merged_core[word][1]})
+            '0': word, '1': pval, '2': df_1, '3': df_2})
 
     if handle is None:
         fo.close()
@@ -8,13 +8,109 @@ including:
 """
 
 import gensim as gs
+import numpy as np
 import re
+import array
+import bisect
 import codecs
 import fileinput
+import io
+import json
+import os
 import logging
+import mmap
+import multiprocessing
+import shutil
+import cPickle
+import heapq
+import tempfile
+import zlib
 
 MOD_LOGGER = logging.getLogger('text_processing.corebody')
 
+# encodings in which an ascii char is always a single byte that can't be
+# part of another char, so lines can be split on raw bytes
+BYTE_SPLIT_ENCODINGS = frozenset(['ascii', 'utf-8', 'iso8859-1', 'cp1252'])
+
+# chars that make a delimiter a regex rather than a literal string
+REGEX_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+def get_subset_bounds(indices, min_index=0, max_index=None):
+    """Returns (start, end) positions such that indices[start:end] are the
+    indices that script_utils.get_list_subset would keep, found by binary
+    search, so the indices must be sorted (ascending)
+
+    Inputs:
+    - indices = sorted indices of the elements of a list (EX: [0, 3, 8])
+    - min_index = min cutoff point for getting the subset (if negative,
+      counts back from max_index, as in get_list_subset)
+    - max_index = max cutoff point for getting the subset
+    """
+    if not len(indices):
+        return 0, 0
+
+    if max_index is None:
+        max_index = indices[-1] + 1
+
+    if min_index < 0:
+        min_index = max(0, max_index + min_index)
+
+    start = bisect.bisect_left(indices, min_index, 0, len(indices))
+    end = bisect.bisect_left(indices, max_index, start, len(indices))
+
+    return start, end
+
+def _find_offset(offsets, sep, value):
+    """Returns the position in offsets (a string of sorted numbers separated
+    by sep) of the first number >= value, found by binary search on the
+    string itself, or len(offsets) if there is none
+    """
+    lo, hi = 0, len(offsets)
+
+    while lo < hi:
+        # the number around the middle of the part still searched
+        mid = (lo + hi) // 2
+        num_start = offsets.rfind(sep, lo, mid)
+        num_start = lo if num_start == -1 else num_start + len(sep)
+        num_end = offsets.find(sep, num_start, hi)
+        if num_end == -1:
+            num_end = hi
+
+        if float(offsets[num_start:num_end]) < value:
+            lo = num_end + len(sep)
+        else:
+            hi = num_start
+
+    return hi
+
+def get_offset_bounds(offsets, sep, min_index=0, max_index=None):
+    """Same as get_subset_bounds, for offsets given as a string of sorted
+    numbers separated by sep (EX: '0|1.5|3.2'); the string is searched
+    as it is, so only a few of the offsets are converted to numbers and
+    it is never split
+    """
+    if not offsets.strip():
+        return 0, 0
+
+    if max_index is None:
+        last_sep = offsets.rfind(sep)
+        last_start = 0 if last_sep == -1 else last_sep + len(sep)
+        max_index = float(offsets[last_start:]) + 1
+
+    if min_index < 0:
+        min_index = max(0, max_index + min_index)
+
+    bounds = []
+    for value in (min_index, max_index):
+        position = _find_offset(offsets, sep, value)
+        if position >= len(offsets):
+            bounds.append(offsets.count(sep) + 1)
+        else:
+            bounds.append(offsets.count(sep, 0, position))
+    start, end = bounds
+
+    return start, max(start, end)
+
 class RawCorpus(object):
     """Generator object yielding lines from a file containing texts
     (texts are entries per row)
@@ -27,62 +123,795 @@ class RawCorpus(object):
     - word_sep = character that separates each word in the text text
       (default is '|')
     - encoding = what encoding the text file is in; default is utf-8
+    - byte_range = (start, end) byte offsets of the part of the file to
+      read, as made by get_byte_shards; default is None (whole file). The
+      header is only skipped by the range that starts at 0
+    - use_index = if True, the line offsets of the file are read from
+      (or, the first time, saved to) a sidecar index file next to it (see
+      get_line_offsets), which makes num_docs, get_text and get_shards
+      cheap instead of re-reading the file
+    - window = (min_index, max_index) of the words of each text to yield,
+      as in script_utils.get_list_subset (EX: (0, 200) for the first 200
+      words, (-200, None) for the last 200); default is None (all words).
+      The window is applied to each text as it is read, so no subset file
+      has to be written
+    - window_offsets = if True, the window is applied to the offsets in
+      the column after the texts (as in script_utils.create_subset_texts;
+      EX: (0, 60) for the words in the first 60 seconds) rather than to
+      the positions of the words; needs a delimiter other than word_sep
+
+    The file is read through mmap. Iterating yields [text id, list of
+    words] decoded to unicode; iter_byte_texts yields them as undecoded
+    byte strings, split on raw bytes, for counting tokens without
+    decoding every one of them
     """
     def __init__(self, file_name, delimiter='\t', word_sep='|',
-                 has_header=True, encoding='utf-8'):
+                 has_header=True, encoding='utf-8', byte_range=None,
+                 use_index=False, window=None, window_offsets=False):
 	self.file_name = file_name
 	self.encoding = encoding
 	self.delimiter = delimiter
 	self.word_sep = word_sep
 	self.has_header = has_header
-	self.num_docs = sum(1 for line in open(self.file_name)) - 1
+	self.byte_range = byte_range
+	self.window = window
+	self.window_offsets = window_offsets
+	if window_offsets and delimiter in (None, word_sep):
+	    raise ValueError('An offsets window needs an offsets column, '
+	                     'separated by a delimiter other than word_sep')
+	self.line_offsets = None
+	self._byte_seps = self._get_byte_separators()
+	if use_index:
+	    self.line_offsets = get_line_offsets(self.file_name)
+	self.num_docs = self._count_docs()
 	self.logger = logging.getLogger('text_processing.corebody.RawCorpus')
 	self.logger.info('Found %s texts in %s', self.num_docs, self.file_name)
 
-    def __iter__(self):
-        def _line_edit(string):
-            string = re.sub(r'(\n|\r)', '', string)
-            return string
-
-        with codecs.open(self.file_name, 'r', self.encoding) as fo:
-            if self.has_header:
-                next(fo)
-
-            for line in fo:
-                if self.delimiter is None:
-                    text_id = None
-                    text_words = _line_edit(line).split(self.word_sep)
-
-                else:
-                    if self.delimiter != self.word_sep:
-                        try:
-                            text_id, text_words = re.split(
-                                self.delimiter, _line_edit(line))
-                        except ValueError as e:
-                            print ("Error in splitting data: make sure "
-                                   "you've picked the correct column and "
-                                   "word separators")
-                            break
-
-                        text_words = text_words.split(self.word_sep)
+    def _count_docs(self):
+        """Counts the texts in the file (or in byte_range), using the line
+        offsets if there are any
+        """
+        if self.line_offsets is None:
+            if self.byte_range is None:
+                return sum(1 for line in open(self.file_name)) - 1
+            return sum(1 for line in self._iter_byte_lines())
+
+        line_starts = self.line_offsets[:-1]
+        if self.byte_range is None:
+            return len(line_starts) - 1
+
+        start, end = self.byte_range
+        num_lines = int(np.searchsorted(line_starts, end) -
+                        np.searchsorted(line_starts, start))
+        if self.has_header and start == 0 and num_lines:
+            num_lines -= 1
+
+        return num_lines
+
+    def _get_byte_separators(self):
+        """Returns (delimiter, word_sep) encoded like the file, or None if
+        lines can't be split on raw bytes (the delimiter is a regex, or
+        the encoding isn't one of BYTE_SPLIT_ENCODINGS)
+        """
+        if self.delimiter is not None and set(self.delimiter) & REGEX_CHARS:
+            return None
 
+        try:
+            if codecs.lookup(self.encoding).name not in BYTE_SPLIT_ENCODINGS:
+                return None
+            return tuple(sep if sep is None else
+                         unicode(sep).encode(self.encoding)
+                         for sep in (self.delimiter, self.word_sep))
+        except (LookupError, UnicodeError):
+            return None
+
+    def _iter_byte_lines(self):
+        """Yields the undecoded lines (without their newline) of the file
+        that start within byte_range, sliced from a memory map of the file
+        """
+        start, end = self.byte_range or (0, None)
+
+        with open(self.file_name, 'rb') as fo:
+            file_size = os.fstat(fo.fileno()).st_size
+            if end is None or end > file_size:
+                end = file_size
+            if start >= end:
+                return
+
+            mapped_file = mmap.mmap(fo.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                position = start
+                skip_line = self.has_header and start == 0
+
+                while position < end:
+                    line_end = mapped_file.find('\n', position)
+                    if line_end == -1:
+                        line_end = file_size
+
+                    if skip_line:
+                        skip_line = False
                     else:
-                        row = re.split(self.delimiter, _line_edit(line))
-                        text_id = row[0]
-                        text_words = row[1:]
+                        yield mapped_file[position:line_end]
+
+                    position = line_end + 1
+            finally:
+                mapped_file.close()
+
+    def _split_line(self, line, delimiter, word_sep):
+        """Splits a line (unicode, or bytes with byte separators) into
+        [text id, list of words]; raises ValueError if the line can't be
+        split on delimiter
+        """
+        line = line.replace('\r', '')
+
+        if delimiter is None:
+            if self.window is None:
+                return [None, line.split(word_sep)]
+            return [None, self._window_words(line, None, word_sep)]
+
+        if self._byte_seps is None:
+            row = re.split(delimiter, line)
+        else:
+            row = line.split(delimiter)
+
+        if delimiter != word_sep:
+            if self.window is None:
+                text_id, text_words = row
+                return [text_id, text_words.split(word_sep)]
+
+            if self.window_offsets:
+                text_id, text_words, text_offsets = row
+            else:
+                text_id, text_words = row
+                text_offsets = None
+            return [text_id, self._window_words(text_words, text_offsets,
+                                                word_sep)]
+
+        self.logger.debug('Yields: %s', {'id': row[0], 'words': row[1:]})
+
+        if self.window is None:
+            return [row[0], row[1:]]
+
+        start, end = get_subset_bounds(xrange(len(row) - 1), *self.window)
+        return [row[0], row[1 + start:1 + end]]
+
+    def _window_words(self, text_words, text_offsets, word_sep):
+        """Returns the words of a text that are within window, splitting
+        off no more of them than needed
+        """
+        min_index, max_index = self.window
+
+        num_words = None
+        if text_offsets is not None:
+            start, end = get_offset_bounds(text_offsets, word_sep,
+                                           min_index, max_index)
+        else:
+            num_words = text_words.count(word_sep) + 1
+            start, end = get_subset_bounds(xrange(num_words), min_index,
+                                           max_index)
+
+        if start == end:
+            return []
+        if start == 0:
+            return text_words.split(word_sep, end)[:end]
+
+        if num_words is None:
+            num_words = text_words.count(word_sep) + 1
+
+        # split from whichever end of the text is nearer the window
+        if end <= num_words - start:
+            return text_words.split(word_sep, end)[start:end]
+        return text_words.rsplit(word_sep, num_words - start)[-(
+            num_words - start):][:end - start]
+
+    def _split_decoded_line(self, byte_line):
+        return self._split_line(byte_line.decode(self.encoding),
+                                self.delimiter, self.word_sep)
+
+    def _split_byte_line(self, byte_line):
+        if self._byte_seps is None:
+            text_id, text = self._split_decoded_line(byte_line)
+            return [text_id if text_id is None else
+                    text_id.encode(self.encoding),
+                    [word.encode(self.encoding) for word in text]]
+
+        return self._split_line(byte_line, *self._byte_seps)
+
+    def _iter_texts(self, split_line):
+        for byte_line in self._iter_byte_lines():
+            try:
+                yield split_line(byte_line)
+            except ValueError as e:
+                print ("Error in splitting data: make sure "
+                       "you've picked the correct column and "
+                       "word separators")
+                break
+
+    def iter_byte_texts(self):
+        """Yields [text id, list of words] like iterating does, but as
+        byte strings in the file's encoding (decode them with
+        self.encoding); when possible, lines are split on raw bytes, so
+        nothing is decoded
+        """
+        return self._iter_texts(self._split_byte_line)
+
+    def get_text(self, doc_num):
+        """Returns [text id, list of words] for one text, found by its
+        number (0 is the first text after the header) without reading the
+        texts before it; the line offsets are loaded if use_index wasn't
+        given
+        """
+        if self.line_offsets is None:
+            self.line_offsets = get_line_offsets(self.file_name)
+
+        line_num = doc_num + (1 if self.has_header else 0)
+        if doc_num < 0 or line_num >= len(self.line_offsets) - 1:
+            raise IndexError('No text number %s in %s' %
+                             (doc_num, self.file_name))
+
+        with open(self.file_name, 'rb') as fo:
+            fo.seek(self.line_offsets[line_num])
+            byte_line = fo.read(self.line_offsets[line_num + 1] -
+                                self.line_offsets[line_num])
+
+        return self._split_decoded_line(byte_line.rstrip('\n'))
+
+    def get_shards(self, num_shards):
+        """Splits the file (or byte_range) into byte ranges for workers, as
+        get_byte_shards does (without seeking through the file if the line
+        offsets are known)
+        """
+        return get_byte_shards(self.file_name, num_shards, self.line_offsets,
+                               self.byte_range)
+
+    def __iter__(self):
+        return self._iter_texts(self._split_decoded_line)
+
+LINE_INDEX_SUFFIX = '.offsets.npy'
+
+def get_line_index_name(file_name):
+    """Returns the name of the sidecar file holding file_name's line
+    offsets
+    """
+    return file_name + LINE_INDEX_SUFFIX
+
+def _get_file_stamp(file_name):
+    """Returns (size, mtime in microseconds) of a file, used to tell if a
+    line index is out of date
+    """
+    file_stat = os.stat(file_name)
+
+    return file_stat.st_size, int(file_stat.st_mtime * 10**6)
+
+def build_line_index(file_name, chunk_bytes=2**24):
+    """Finds the byte offset of the start of every line in a file, reading
+    it in chunks, and saves them (after the file's size and mtime) to a
+    sidecar .npy file; returns the offsets, which end with the file size,
+    so line i is offsets[i]:offsets[i + 1]. If the sidecar file can't be
+    written, the offsets are still returned
+
+    Inputs:
+    - file_name = name of file containing texts
+    - chunk_bytes = number of bytes read at a time
+    """
+    MOD_LOGGER.info('Indexing lines of %s', file_name)
+
+    file_size, file_mtime = _get_file_stamp(file_name)
+    index_parts = [np.array([file_size, file_mtime, 0], dtype=np.int64)]
+    position = 0
+
+    with open(file_name, 'rb') as fo:
+        chunk = fo.read(chunk_bytes)
+        while chunk:
+            newlines = np.flatnonzero(
+                np.frombuffer(chunk, dtype=np.uint8) == ord('\n'))
+            index_parts.append(newlines.astype(np.int64) + (position + 1))
+            position += len(chunk)
+            chunk = fo.read(chunk_bytes)
+
+    line_index = np.concatenate(index_parts)
+
+    if line_index[-1] != file_size:
+        # last line has no newline at its end
+        line_index = np.append(line_index, file_size)
+
+    index_name = get_line_index_name(file_name)
+    tmp_name = index_name + '.tmp'
+    try:
+        with open(tmp_name, 'wb') as fo:
+            np.save(fo, line_index)
+        os.rename(tmp_name, index_name)
+        MOD_LOGGER.info('Saved line index to %s', index_name)
+    except (IOError, OSError) as e:
+        MOD_LOGGER.warning('Could not save line index to %s: %s',
+                           index_name, e)
+
+    return line_index[2:]
+
+def load_line_index(file_name):
+    """Returns the line offsets saved by build_line_index for a file
+    (memory-mapped), or None if there's no index or the file has changed
+    size or mtime since it was made
+    """
+    index_name = get_line_index_name(file_name)
+    if not os.path.exists(index_name):
+        return None
+
+    line_index = np.load(index_name, mmap_mode='r')
+    if tuple(line_index[:2]) != _get_file_stamp(file_name):
+        MOD_LOGGER.info('Line index %s is out of date', index_name)
+        return None
+
+    return line_index[2:]
+
+def get_line_offsets(file_name):
+    """Returns the line offsets of a file from its sidecar index, building
+    the index first if it's missing or out of date
+    """
+    line_offsets = load_line_index(file_name)
+    if line_offsets is None:
+        line_offsets = build_line_index(file_name)
+
+    return line_offsets
+
+def get_byte_shards(file_name, num_shards, line_offsets=None,
+                    byte_range=None):
+    """Splits a file into (start, end) byte ranges of roughly equal size,
+    each starting at the beginning of a line, so that every line belongs
+    to exactly one range (see RawCorpus byte_range)
+
+    Inputs:
+    - file_name = name of file containing texts
+    - num_shards = number of ranges wanted; fewer are returned if the
+      file has fewer lines than that
+    - line_offsets = line offsets of the file, as returned by
+      get_line_offsets; if given, line starts are looked up in them
+      instead of seeking through the file
+    - byte_range = (start, end) byte offsets of the part of the file to
+      split, start being the beginning of a line; default is None (whole
+      file)
+    """
+    range_start, range_end = byte_range or (0, os.path.getsize(file_name))
+    boundaries = [range_start]
+
+    if line_offsets is not None:
+        line_starts = line_offsets[:-1]
+        for i in range(1, num_shards):
+            approx_start = (range_start +
+                            (range_end - range_start) * i // num_shards)
+            line_num = np.searchsorted(line_starts, approx_start)
+
+            if (line_num < len(line_starts) and
+                    boundaries[-1] < line_starts[line_num] < range_end):
+                boundaries.append(int(line_starts[line_num]))
+
+    else:
+        with open(file_name, 'rb') as fo:
+            for i in range(1, num_shards):
+                approx_start = (range_start +
+                                (range_end - range_start) * i // num_shards)
+                if approx_start <= boundaries[-1]:
+                    continue
+
+                # move to the start of the next line (or stay put if
+                # approx_start is already the start of a line)
+                fo.seek(approx_start - 1)
+                fo.readline()
+                line_start = fo.tell()
+
+                if boundaries[-1] < line_start < range_end:
+                    boundaries.append(line_start)
+
+    boundaries.append(range_end)
+
+    return zip(boundaries[:-1], boundaries[1:])
+
+COMPILED_SUFFIX = '_compiled'
+
+class CompiledCorpus(object):
+    """Reads a corpus compiled by compile_corpus: every line of the
+    original texts file as word ids in one flat int32 array, which is
+    memory-mapped rather than parsed, so it can be read again and again
+    (with any thresholds) for much less than the texts file. Yields the
+    same [text id, list of words] as the RawCorpus it was compiled from
+
+    Inputs:
+    - cache_dir = directory made by compile_corpus
+    - has_header = if True, the first line of the file is skipped, as in
+      RawCorpus
+    """
+    def __init__(self, cache_dir, has_header=True):
+        self.cache_dir = cache_dir
+        self.has_header = has_header
+
+        with io.open(os.path.join(cache_dir, 'meta.json'),
+                     encoding='utf-8') as fo:
+            self.meta = json.load(fo)
+
+        with io.open(os.path.join(cache_dir, 'vocab.txt'),
+                     encoding='utf-8', newline='\n') as fo:
+            self.vocab = fo.read().split(u'\n')[:-1]
+
+        if self.meta['has_ids']:
+            with io.open(os.path.join(cache_dir, 'text_ids.txt'),
+                         encoding='utf-8', newline='\n') as fo:
+                self.text_ids = fo.read().split(u'\n')[:-1]
+        else:
+            self.text_ids = None
+
+        self.tokens = np.load(os.path.join(cache_dir, 'tokens.npy'),
+                              mmap_mode='r')
+        self.doc_offsets = np.load(os.path.join(cache_dir,
+                                                'doc_offsets.npy'))
+
+        # same count as RawCorpus gives for the whole file
+        self.num_docs = self.meta['num_lines'] - 1
+
+        self.first_doc = 1 if has_header else 0
+        if not has_header and self.meta['bad_first_line']:
+            # RawCorpus stops at a first line it can't split
+            self.first_doc = len(self.doc_offsets) - 1
+
+    def iter_word_ids(self):
+        """Yields the int32 numpy array of word ids (indexes in vocab) of
+        each text
+        """
+        doc_offsets = self.doc_offsets
+        for doc in xrange(self.first_doc, len(doc_offsets) - 1):
+            yield self.tokens[doc_offsets[doc]:doc_offsets[doc + 1]]
+
+    def __iter__(self):
+        vocab = self.vocab
+        for doc, word_ids in enumerate(self.iter_word_ids(), self.first_doc):
+            text_id = None if self.text_ids is None else self.text_ids[doc]
+            yield [text_id, [vocab[word_id] for word_id in word_ids]]
+
+    def count_dfs(self, chunk_tokens=2**22, num_workers=1):
+        """Counts the document frequency of every word with numpy, about
+        chunk_tokens words at a time; returns the same as count_dfs. With
+        num_workers > 1, the texts are split into one run of texts (of
+        about as many words) per worker process, whose counts are added up
+
+        Inputs:
+        - chunk_tokens = number of words counted at a time
+        - num_workers = number of processes to count in
+        """
+        num_words = len(self.vocab)
+        doc_offsets = self.doc_offsets[self.first_doc:]
+
+        if num_workers > 1 and len(doc_offsets) > 2:
+            MOD_LOGGER.info('Counting compiled dfs in %s processes',
+                            num_workers)
+
+            # split where the texts pass each worker's share of the words
+            shard_docs = np.unique(np.concatenate((
+                [0], np.searchsorted(doc_offsets, np.linspace(
+                    doc_offsets[0], doc_offsets[-1], num_workers + 1)[1:-1]),
+                [len(doc_offsets) - 1])))
+            shards_args = [
+                (self.cache_dir, doc_offsets[start_doc:end_doc + 1],
+                 num_words, chunk_tokens)
+                for (start_doc, end_doc) in zip(shard_docs[:-1],
+                                                shard_docs[1:])]
+
+            pool = multiprocessing.Pool(min(num_workers, len(shards_args)))
+            try:
+                shard_counts = pool.map(_count_compiled_shard_dfs,
+                                        shards_args)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+
+            dfs = sum(shard_dfs for (shard_dfs, _) in shard_counts)
+            num_nnz = sum(shard_nnz for (_, shard_nnz) in shard_counts)
+        else:
+            dfs, num_nnz = _count_word_dfs(self.tokens, doc_offsets,
+                                           num_words, chunk_tokens)
+
+        token2df = dict((self.vocab[word_id], int(dfs[word_id]))
+                        for word_id in np.flatnonzero(dfs))
+
+        return (token2df, len(doc_offsets) - 1,
+                int(doc_offsets[-1] - doc_offsets[0]), num_nnz)
+
+def _count_word_dfs(tokens, doc_offsets, num_words, chunk_tokens):
+    """Counts the document frequency of every word id in the texts of a
+    compiled corpus that doc_offsets covers, about chunk_tokens words at a
+    time; returns (numpy array of the df of each word id, num_nnz)
+    """
+    dfs = np.zeros(num_words, dtype=np.int64)
+    num_nnz = 0
+
+    start_doc = 0
+    while start_doc < len(doc_offsets) - 1:
+        end_doc = max(start_doc + 1, np.searchsorted(
+            doc_offsets, doc_offsets[start_doc] + chunk_tokens,
+            side='right') - 1)
+        lengths = np.diff(doc_offsets[start_doc:end_doc + 1])
+        docs = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+        word_ids = tokens[doc_offsets[start_doc]:doc_offsets[end_doc]]
+
+        doc_words = np.unique(docs * num_words + word_ids)
+        num_nnz += len(doc_words)
+        dfs += np.bincount(doc_words % num_words, minlength=num_words)
+
+        start_doc = end_doc
+
+    return dfs, num_nnz
+
+def _count_compiled_shard_dfs(shard_args):
+    """Counts the document frequency of every word id in one run of texts
+    of a compiled corpus (runs in a worker process); returns what
+    _count_word_dfs does
+    """
+    cache_dir, doc_offsets, num_words, chunk_tokens = shard_args
+    tokens = np.load(os.path.join(cache_dir, 'tokens.npy'), mmap_mode='r')
+
+    return _count_word_dfs(tokens, doc_offsets, num_words, chunk_tokens)
+
+def get_compiled_name(file_name):
+    """Returns the name of the directory compile_corpus saves file_name's
+    compiled corpus in
+    """
+    return file_name[:-4] + COMPILED_SUFFIX
+
+def _get_compile_meta(file_name, delimiter, word_sep, encoding):
+    """Returns what a compiled corpus must have been made from to be used
+    in place of file_name
+    """
+    file_size, file_mtime = _get_file_stamp(file_name)
+
+    return {'file_size': file_size, 'file_mtime': file_mtime,
+            'delimiter': delimiter, 'word_sep': word_sep,
+            'encoding': codecs.lookup(encoding).name}
+
+def compile_corpus(file_name, delimiter='\t', word_sep='|', encoding='utf-8',
+                   cache_dir=None, chunk_tokens=2**22):
+    """Parses a texts file once into a compiled corpus, saved in cache_dir
+    (default is file_name + '_compiled', without the extension):
+      - vocab.txt = every distinct word, one per line (utf-8), in the
+        order first seen; a word's id is its line number
+      - tokens.npy = int32 word ids of all the texts, back to back
+      - doc_offsets.npy = int64 start of each text in tokens, plus the end
+      - text_ids.txt = id of each text, one per line (if there are ids)
+      - meta.json = size and mtime of file_name and how it was split
+    Every line is compiled, header included; see CompiledCorpus
+
+    Inputs:
+    - file_name = name of file containing texts
+    - delimiter, word_sep, encoding = as for RawCorpus
+    - cache_dir = directory to save the compiled corpus in
+    - chunk_tokens = number of word ids held in memory before being
+      written out
+    """
+    if cache_dir is None:
+        cache_dir = get_compiled_name(file_name)
+
+    MOD_LOGGER.info('Compiling %s to %s', file_name, cache_dir)
 
-                        self.logger.debug('Yields: %s',
-                                          {'id': text_id, 'words': text_words})
+    meta = _get_compile_meta(file_name, delimiter, word_sep, encoding)
+    raw_corp = RawCorpus(file_name, delimiter, word_sep, has_header=False,
+                         encoding=encoding)
 
-                yield [text_id, text_words]
+    tmp_dir = cache_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    word2id = {}
+    doc_lengths = array.array('i')
+    text_ids = []
+    bad_first_line = False
+    num_tokens = 0
+    chunk = array.array('i')
+
+    with open(os.path.join(tmp_dir, 'tokens.raw'), 'wb') as tokens_fo:
+        for line_num, byte_line in enumerate(raw_corp._iter_byte_lines()):
+            try:
+                text_id, text = raw_corp._split_byte_line(byte_line)
+            except ValueError:
+                if line_num > 0:
+                    # RawCorpus stops here whether or not there's a header
+                    MOD_LOGGER.warning('Stopped compiling at line %s, which '
+                                       "couldn't be split", line_num)
+                    break
+                bad_first_line = True
+                text_id, text = None, []
+
+            for word in text:
+                word_id = word2id.get(word)
+                if word_id is None:
+                    word_id = word2id[word] = len(word2id)
+                chunk.append(word_id)
+
+            doc_lengths.append(len(text))
+            text_ids.append(text_id)
+
+            if len(chunk) >= chunk_tokens:
+                num_tokens += len(chunk)
+                chunk.tofile(tokens_fo)
+                chunk = array.array('i')
+
+        num_tokens += len(chunk)
+        chunk.tofile(tokens_fo)
+
+    # the tokens are only counted once they're all written, so they're
+    # copied from the raw file into a .npy file of the right length
+    raw_tokens = os.path.join(tmp_dir, 'tokens.raw')
+    tokens = np.lib.format.open_memmap(os.path.join(tmp_dir, 'tokens.npy'),
+                                       mode='w+', dtype=np.int32,
+                                       shape=(num_tokens,))
+    if num_tokens:
+        tokens[:] = np.memmap(raw_tokens, dtype=np.int32, mode='r')
+    tokens.flush()
+    del tokens
+    os.remove(raw_tokens)
+
+    doc_offsets = np.zeros(len(doc_lengths) + 1, dtype=np.int64)
+    if doc_lengths:
+        doc_offsets[1:] = np.cumsum(np.frombuffer(doc_lengths, dtype=np.int32),
+                                    dtype=np.int64)
+    np.save(os.path.join(tmp_dir, 'doc_offsets.npy'), doc_offsets)
+
+    vocab = sorted(word2id, key=word2id.get)
+    with io.open(os.path.join(tmp_dir, 'vocab.txt'), 'w', encoding='utf-8',
+                 newline='\n') as fo:
+        fo.writelines(word.decode(encoding) + u'\n' for word in vocab)
+
+    meta['has_ids'] = any(text_id is not None for text_id in text_ids)
+    if meta['has_ids']:
+        with io.open(os.path.join(tmp_dir, 'text_ids.txt'), 'w',
+                     encoding='utf-8', newline='\n') as fo:
+            fo.writelines((u'' if text_id is None else
+                           text_id.decode(encoding)) + u'\n'
+                          for text_id in text_ids)
+
+    meta['num_lines'] = raw_corp.num_docs + 1
+    meta['bad_first_line'] = bad_first_line
+    with io.open(os.path.join(tmp_dir, 'meta.json'), 'wb') as fo:
+        json.dump(meta, fo)
+
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.rename(tmp_dir, cache_dir)
+
+    MOD_LOGGER.info('Compiled %s words (%s distinct) from %s lines',
+                    num_tokens, len(vocab), len(doc_lengths))
+
+    return cache_dir
+
+def get_compiled_corpus(file_name, delimiter='\t', word_sep='|',
+                        has_header=True, encoding='utf-8', cache_dir=None):
+    """Returns a CompiledCorpus for a texts file, compiling it first if it
+    has never been compiled, or has changed (size or mtime), or was
+    compiled with other separators or encoding
+
+    Inputs:
+    - file_name = name of file containing texts
+    - delimiter, word_sep, has_header, encoding = as for RawCorpus
+    - cache_dir = directory of the compiled corpus (see compile_corpus)
+    """
+    if cache_dir is None:
+        cache_dir = get_compiled_name(file_name)
+
+    meta_file = os.path.join(cache_dir, 'meta.json')
+    if os.path.exists(meta_file):
+        with io.open(meta_file, encoding='utf-8') as fo:
+            meta = json.load(fo)
+        wanted_meta = _get_compile_meta(file_name, delimiter, word_sep,
+                                        encoding)
+        if all(meta.get(key) == value
+               for (key, value) in wanted_meta.iteritems()):
+            MOD_LOGGER.info('Using compiled corpus %s', cache_dir)
+            return CompiledCorpus(cache_dir, has_header)
+
+    compile_corpus(file_name, delimiter, word_sep, encoding, cache_dir)
+
+    return CompiledCorpus(cache_dir, has_header)
+
+def count_dfs(raw_corp):
+    """Counts the document frequency of every token in a RawCorpus;
+    tokens are counted as undecoded byte strings, and only the distinct
+    ones are decoded at the end. Returns (token2df, num_docs, num_pos,
+    num_nnz), with unicode tokens
+
+    Inputs:
+    - raw_corp = RawCorpus object, which is corpus of all your texts (or
+      a CompiledCorpus, which counts its own dfs from its word ids)
+    """
+    if isinstance(raw_corp, CompiledCorpus):
+        return raw_corp.count_dfs()
+
+    token2df = {}
+    num_docs = num_pos = num_nnz = 0
+
+    for _, text in raw_corp.iter_byte_texts():
+        unique_tokens = set(text)
+        num_docs += 1
+        num_pos += len(text)
+        num_nnz += len(unique_tokens)
+
+        for token in unique_tokens:
+            token2df[token] = token2df.get(token, 0) + 1
+
+    token2df = dict((token.decode(raw_corp.encoding), df)
+                    for (token, df) in token2df.iteritems())
+
+    return token2df, num_docs, num_pos, num_nnz
+
+def _count_shard_dfs(corpus_args):
+    """Counts the document frequency of every token in one byte range of
+    a texts file (runs in a worker process); returns what count_dfs does
+    """
+    return count_dfs(RawCorpus(*corpus_args))
+
+def count_dfs_in_parallel(raw_corp, num_workers):
+    """Counts the document frequency of every token in a RawCorpus by
+    splitting its file into one byte range per worker process, and merges
+    the counts into a gensim Dictionary object equivalent to the one
+    gensim would build from raw_corp (tokens are kept as unicode, so
+    they are never re-encoded)
+
+    Inputs:
+    - raw_corp = RawCorpus object, which is corpus of all your texts
+    - num_workers = number of processes to count in
+    """
+    return make_dict_from_token2df(*count_shard_dfs(raw_corp, num_workers))
+
+def count_shard_dfs(raw_corp, num_workers):
+    """Does the counting of count_dfs_in_parallel (splitting raw_corp's
+    file, or its byte_range, into one byte range per worker process), but
+    returns what count_dfs does
+    """
+    MOD_LOGGER.info('Counting dfs in %s processes', num_workers)
+
+    shards_args = [
+        (raw_corp.file_name, raw_corp.delimiter, raw_corp.word_sep,
+         raw_corp.has_header, raw_corp.encoding, byte_range,
+         raw_corp.line_offsets is not None, raw_corp.window,
+         raw_corp.window_offsets)
+        for byte_range in raw_corp.get_shards(num_workers)]
+
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        shard_counts = pool.map(_count_shard_dfs, shards_args)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    token2df, num_docs, num_pos, num_nnz = shard_counts[0]
+    for (shard_token2df, shard_docs, shard_pos, shard_nnz) in shard_counts[1:]:
+        for token, df in shard_token2df.iteritems():
+            token2df[token] = token2df.get(token, 0) + df
+        num_docs += shard_docs
+        num_pos += shard_pos
+        num_nnz += shard_nnz
+
+    return token2df, num_docs, num_pos, num_nnz
+
+def make_dict_from_token2df(token2df, num_docs, num_pos=0, num_nnz=0):
+    """Makes a gensim Dictionary object out of a {token: doc freq} dict,
+    giving tokens ids in sorted order (see make_dict_from_dfs)
+    """
+    tokens = sorted(token2df)
+
+    return make_dict_from_dfs(tokens, [token2df[token] for token in tokens],
+                              num_docs, num_pos, num_nnz)
 
 def make_simple_core(raw_corp, min_bound=0, max_bound=1.0, tokens_limit=None,
-                     encoding='utf-8'):
+                     encoding='utf-8', num_workers=1):
     """Given a corpus generator object, makes a simple core body of
     single words by using filter methods from gensim Dictionary object
 
     Inputs:
-    - raw_corp = RawCorpus object, which is corpus of all your texts
+    - raw_corp = RawCorpus (or CompiledCorpus) object, which is corpus of
+      all your texts
     - min_bound = minimum number of docs (if int) or percentage of docs
       (if float) that must contain a word for it to be kept in core body;
       default is 0
@@ -91,18 +920,24 @@ def make_simple_core(raw_corp, min_bound=0, max_bound=1.0, tokens_limit=None,
       default is 1.0, aka 100%
     - tokens_limit = maximum number of tokens resulting core body should
       contain; default is None (no limit)
-    - encoding = encoding of text file raw_corp was built on
+    - encoding = no longer used; tokens are decoded with raw_corp's own
+      encoding
+    - num_workers = number of processes to count document frequencies in;
+      if > 1, raw_corp's file is split into one byte range per process
+      (a CompiledCorpus is split into runs of texts instead, see
+      CompiledCorpus.count_dfs)
     """
     MOD_LOGGER.info('Received call to "make_simple_core"')
 
-    # Encode unicode tokens in raw_corp back to byte strings - can't keep tokens in
-    # unicode format because gensim Dictionary object expects byte strings
-    corp_gen = (
-    	[token.encode(encoding)
-    	for token in x[1]]
-    	for x in raw_corp)
-
-    raw_dict = gs.corpora.Dictionary(corp_gen)
+    if num_workers > 1 and isinstance(raw_corp, RawCorpus):
+        raw_dict = count_dfs_in_parallel(raw_corp, num_workers)
+    elif num_workers > 1:
+        raw_dict = make_dict_from_token2df(
+            *raw_corp.count_dfs(num_workers=num_workers))
+    else:
+        # count undecoded tokens, then decode each distinct token once,
+        # rather than decoding every token and re-encoding it for gensim
+        raw_dict = make_dict_from_token2df(*count_dfs(raw_corp))
 
     if type(min_bound) is float:
     	min_bound = min_bound * raw_corp.num_docs
@@ -118,6 +953,233 @@ def make_simple_core(raw_corp, min_bound=0, max_bound=1.0, tokens_limit=None,
 
     return raw_dict
 
+def count_dfs_spilled(raw_corp, max_tokens, spill_dir, num_buckets=64):
+    """Counts the document frequency of every token in a RawCorpus, like
+    count_dfs, but holding counts for at most max_tokens distinct tokens
+    in memory: whenever that many are held, the partial counts are
+    appended to one of num_buckets files in spill_dir (picked by a hash
+    of the token), so each token's partial counts all end up in the same
+    bucket. Returns (list of bucket file names, num_docs, num_pos,
+    num_nnz); see merge_spilled_dfs
+
+    Inputs:
+    - raw_corp = RawCorpus object, which is corpus of all your texts
+    - max_tokens = max number of distinct tokens to hold counts for
+    - spill_dir = directory to write bucket files to
+    - num_buckets = number of bucket files
+    """
+    bucket_files = [os.path.join(spill_dir, 'bucket_%s.pkl' % i)
+                    for i in range(num_buckets)]
+    token2df = {}
+    num_docs = num_pos = num_nnz = num_spills = 0
+
+    for _, text in raw_corp.iter_byte_texts():
+        unique_tokens = set(text)
+        num_docs += 1
+        num_pos += len(text)
+        num_nnz += len(unique_tokens)
+
+        for token in unique_tokens:
+            token2df[token] = token2df.get(token, 0) + 1
+
+        if len(token2df) >= max_tokens:
+            _spill_token_dfs(token2df, bucket_files)
+            token2df = {}
+            num_spills += 1
+
+    _spill_token_dfs(token2df, bucket_files)
+
+    MOD_LOGGER.info('Spilled partial dfs to %s buckets %s times',
+                    num_buckets, num_spills + 1)
+
+    return bucket_files, num_docs, num_pos, num_nnz
+
+def _spill_token_dfs(token2df, bucket_files):
+    """Appends the (token, df) pairs of a dict to the bucket files, each to
+    the bucket picked by the crc32 of its (byte string) token
+    """
+    buckets = [[] for _ in bucket_files]
+    for token, df in token2df.iteritems():
+        buckets[zlib.crc32(token) % len(buckets)].append((token, df))
+
+    for bucket, bucket_file in zip(buckets, bucket_files):
+        if bucket:
+            with open(bucket_file, 'ab') as fo:
+                cPickle.dump(bucket, fo, cPickle.HIGHEST_PROTOCOL)
+
+def _load_bucket_dfs(bucket_file):
+    """Returns {token: df} of all the partial counts in a bucket file"""
+    token2df = {}
+    if not os.path.exists(bucket_file):
+        return token2df
+
+    with open(bucket_file, 'rb') as fo:
+        while True:
+            try:
+                token_dfs = cPickle.load(fo)
+            except EOFError:
+                break
+            for token, df in token_dfs:
+                token2df[token] = token2df.get(token, 0) + df
+
+    return token2df
+
+def _sort_bucket_dfs(bucket_file, encoding):
+    """Adds up the partial counts in a bucket file, and writes them sorted
+    by (decoded) token to a file next to it; returns the name of that file
+    """
+    token_dfs = sorted((token.decode(encoding), df) for (token, df)
+                       in _load_bucket_dfs(bucket_file).iteritems())
+
+    sorted_file = bucket_file[:-4] + '_sorted.txt'
+    write_token_dfs(token_dfs, sorted_file)
+
+    return sorted_file
+
+def iter_spilled_dfs(bucket_files, encoding):
+    """Returns an iterator of the (token, df) pairs of all tokens counted
+    by count_dfs_spilled, sorted by token, holding only one bucket's counts
+    in memory at a time
+    """
+    sorted_files = [_sort_bucket_dfs(bucket_file, encoding)
+                    for bucket_file in bucket_files]
+
+    # buckets hold disjoint tokens, so merging the sorted buckets gives
+    # all tokens in sorted order
+    return heapq.merge(*[_read_token_dfs(sorted_file)
+                         for sorted_file in sorted_files])
+
+def _read_token_dfs(file_name):
+    """Yields the (token, df) rows of a file written by write_token_dfs"""
+    with io.open(file_name, encoding='utf-8') as fo:
+        fo.readline()
+        for line in fo:
+            token, df = line[:-1].rsplit(u' ', 1)
+            yield token, int(df)
+
+def merge_spilled_dfs(bucket_files, num_docs, num_pos, num_nnz, encoding,
+                      alldfs_file, min_bound=0, max_bound=1.0,
+                      tokens_limit=None):
+    """Merges the bucket files of count_dfs_spilled one at a time: writes
+    the dfs of all tokens to alldfs_file (the same file write_dfs_to_file
+    would write from the full Dictionary), and returns a gensim Dictionary
+    object of just the tokens filter_extremes(min_bound, max_bound,
+    tokens_limit) would keep, so the full Dictionary is never made
+
+    Inputs:
+    - bucket_files, num_docs, num_pos, num_nnz = returned by
+      count_dfs_spilled
+    - encoding = encoding to decode tokens with
+    - alldfs_file = name of file to write dfs of all tokens to
+    - min_bound = min number of docs that must contain a token
+    - max_bound = max percentage of docs that can contain a token
+    - tokens_limit = max number of (most frequent) tokens to keep
+    """
+    no_above_abs = int(max_bound * num_docs)
+
+    # tokens within bounds, and with tokens_limit, only the best
+    # tokens_limit of them so far in a heap (worst on top): tokens come in
+    # sorted order, so a token tied on df with the worst one loses to it,
+    # as it would on the full Dictionary (see filter_dict_extremes)
+    kept_token_dfs = []
+
+    with io.open(alldfs_file, 'w', encoding='utf-8', buffering=2**20) as fo:
+        fo.write(u'token doc_freq\n')
+        for position, (token, df) in enumerate(
+                iter_spilled_dfs(bucket_files, encoding)):
+            fo.write(u'%s %i\n' % (token, df))
+
+            if not min_bound <= df <= no_above_abs:
+                continue
+            if tokens_limit is None:
+                kept_token_dfs.append((df, -position, token))
+            elif len(kept_token_dfs) < tokens_limit:
+                heapq.heappush(kept_token_dfs, (df, -position, token))
+            elif df > kept_token_dfs[0][0]:
+                heapq.heappushpop(kept_token_dfs, (df, -position, token))
+
+    kept_dict = make_dict_from_token2df(
+        dict((token, df) for (df, _, token) in kept_token_dfs), num_docs,
+        num_pos, num_nnz)
+
+    return filter_dict_extremes(kept_dict, min_bound, max_bound,
+                                tokens_limit)
+
+def select_extremes(dfs, num_docs, no_below=0, no_above=1.0, keep_n=None):
+    """Returns the (ascending) positions of the tokens in a numpy array of
+    document frequencies that gensim Dictionary's filter_extremes would
+    keep, so that df counts held outside of a Dictionary can be
+    thresholded the same way; tokens tied at the keep_n cutoff are kept
+    in order of position (gensim keeps them in dict order), so with
+    tokens sorted, the result doesn't depend on how they were counted
+
+    Inputs:
+    - dfs = numpy array of document frequencies, one per token
+    - num_docs = total number of docs the dfs were counted over
+    - no_below = min number of docs that must contain a token
+    - no_above = max percentage of docs that can contain a token
+    - keep_n = max number of (most frequent) tokens to keep; default is
+      None (no limit)
+    """
+    no_above_abs = int(no_above * num_docs)
+
+    good_positions = np.flatnonzero((dfs >= no_below) & (dfs <= no_above_abs))
+
+    if keep_n is not None:
+        by_df = np.argsort(-dfs[good_positions], kind='mergesort')
+        good_positions = np.sort(good_positions[by_df[:keep_n]])
+
+    return good_positions
+
+def filter_dict_extremes(gs_dict, no_below=0, no_above=1.0, keep_n=None):
+    """Returns a new gensim Dictionary object of the tokens of gs_dict that
+    select_extremes keeps, with ids in sorted token order; unlike
+    filter_extremes, ties at the keep_n cutoff are broken by token, so
+    core bodies counted in different ways (in memory, spilled, from df
+    snapshots) keep the same tokens
+
+    Inputs:
+    - gs_dict = gensim Dictionary object
+    - no_below = min number of docs that must contain a token
+    - no_above = max percentage of docs that can contain a token
+    - keep_n = max number of (most frequent) tokens to keep
+    """
+    tokens = sorted(gs_dict.token2id)
+    dfs = np.array([gs_dict.dfs[gs_dict.token2id[token]] for token in tokens],
+                   dtype=np.int64)
+    keep = select_extremes(dfs, gs_dict.num_docs, no_below, no_above, keep_n)
+
+    return make_dict_from_dfs([tokens[i] for i in keep], dfs[keep],
+                              gs_dict.num_docs, gs_dict.num_pos,
+                              gs_dict.num_nnz)
+
+def make_dict_from_dfs(tokens, dfs, num_docs, num_pos=0, num_nnz=0):
+    """Makes a gensim Dictionary object out of tokens and their document
+    frequencies that were counted without one; tokens are given ids in
+    the order they are listed
+
+    Inputs:
+    - tokens = list of tokens (byte strings are decoded as utf-8, like
+      gensim does)
+    - dfs = document frequency of each token
+    - num_docs = total number of docs the dfs were counted over
+    - num_pos = total number of tokens in those docs
+    - num_nnz = total number of (doc, unique token) pairs in those docs
+    """
+    gs_dict = gs.corpora.Dictionary()
+
+    for token_id, (token, df) in enumerate(zip(tokens, dfs)):
+        if not isinstance(token, unicode):
+            token = unicode(token, 'utf-8')
+        gs_dict.token2id[token] = token_id
+        gs_dict.dfs[token_id] = int(df)
+
+    gs_dict.num_docs = num_docs
+    gs_dict.num_pos = num_pos
+    gs_dict.num_nnz = num_nnz
+
+    return gs_dict
+
 def get_bad_ids_from_gs_dict(gs_dict, min_bound, max_bound):
     """Gets a list of bad ids (token ids that are below a min threshold,
     and above a max threshold)
@@ -162,19 +1224,66 @@ def add_header_to_file(file_name, header_space_sep):
     		print ' '.join(header)
     	print line,
 
+def write_token_dfs(token_dfs, file_name, header='token doc_freq',
+                    sort_by_df=False):
+    """Writes (token, document frequency) pairs to a txt file in the same
+    format as write_dfs_to_file (header, then one 'token doc_freq' row
+    per token), in a single buffered pass
+
+    Inputs:
+    - token_dfs = iterable of (unicode token, doc freq) pairs
+    - file_name = name of file to be created
+    - header = string that contains your header, separated by spaces
+    - sort_by_df = if True, rows are sorted by doc freq (descending), then
+      token; otherwise by token
+    """
+    if sort_by_df:
+        token_dfs = sorted(token_dfs,
+                           key=lambda token_df: (-token_df[1], token_df[0]))
+    else:
+        token_dfs = sorted(token_dfs)
+
+    with io.open(file_name, 'w', encoding='utf-8', buffering=2**20) as fo:
+        fo.write(u' '.join(header.split()) + u'\n')
+        fo.writelines(u'%s %i\n' % (token, df) for (token, df) in token_dfs)
+
 def write_dfs_to_file(corebody, file_name, ids_keep=None, ids_remove=None,
-                      header='token doc_freq'):
+                      header='token doc_freq', sort_by_df=False):
     """Saves tokens and their document frequencies to a txt file;
-    file has a header
+    file has a header. The core body itself is left as it is
+
+    Inputs:
+    - corebody = gensim Dictionary object
+    - file_name = name of file to be created
+    - ids_keep = if given, only tokens with these ids are written
+    - ids_remove = if given, tokens with these ids are not written
+    - header = string that contains your header, separated by spaces
+    - sort_by_df = if True, rows are sorted by doc freq (descending), then
+      token; otherwise by token
     """
-    corebody.filter_tokens(ids_remove, ids_keep)
-    corebody.save_as_text(file_name)
-    delete_first_col_from_file(file_name)
-    add_header_to_file(file_name, header)
+    token_ids = corebody.token2id.iteritems()
+
+    if ids_remove is not None:
+        ids_remove = set(ids_remove)
+        token_ids = ((token, token_id) for (token, token_id) in token_ids
+                     if token_id not in ids_remove)
+
+    if ids_keep is not None:
+        ids_keep = set(ids_keep)
+        token_ids = ((token, token_id) for (token, token_id) in token_ids
+                     if token_id in ids_keep)
+
+    write_token_dfs(
+        ((token, corebody.dfs.get(token_id, 0))
+         for (token, token_id) in token_ids),
+        file_name, header, sort_by_df)
 
 def create_corebody(text_file, new_filename=None, delimiter='\t',
                     word_sep='|', min_docnum=0, max_docnum=1.0,
-                    tokens_limit=None, encoding='utf-8'):
+                    tokens_limit=None, encoding='utf-8', num_workers=1,
+                    use_index=False, use_cache=False,
+                    max_tokens_in_memory=None, spill_dir=None, window=None,
+                    window_offsets=False):
     """Creates core body of language for text sample (all words
     in sample meeting a minimum document threshold, and their document
     frequencies) as gensim dict object. Also creates two txt files, a
@@ -190,23 +1299,57 @@ def create_corebody(text_file, new_filename=None, delimiter='\t',
     - max_docnum = max num docs for words to be included in core body
     - tokens_limit = max number of words to include in core body
     - encoding = encoding of text file
+    - num_workers = number of processes to count document frequencies in
+    - use_index = if True, keep a sidecar index of text_file's line
+      offsets (see RawCorpus), so later calls on the same file don't need
+      to count its lines again
+    - use_cache = if True, read the texts from text_file's compiled corpus
+      (see get_compiled_corpus), compiling it first if needed
+    - max_tokens_in_memory = if given, dfs are counted holding at most
+      this many distinct tokens in memory, spilling partial counts to disk
+      (see count_dfs_spilled), in a single process and from the text file
+      itself (use_cache and num_workers are ignored); the core body and
+      dfs file are the same
+    - spill_dir = directory to spill partial counts to (in a temporary
+      directory that is removed afterwards); default is text_file's
+      directory
+    - window = (min_index, max_index) of the words of each text to count
+      (see RawCorpus); a compiled corpus holds whole texts, so use_cache
+      is ignored if a window is given
+    - window_offsets = if True, window is a range of the offsets in the
+      column after the texts rather than of word positions (see
+      RawCorpus)
     """
     MOD_LOGGER.info('Received call to "create_corebody"')
+
+    if new_filename is None:
+    	alldfs_file = text_file[:-4] + '_dfs-all.txt'
+    else:
+    	alldfs_file = new_filename
+
+    if max_tokens_in_memory is not None:
+        return _create_spilled_corebody(
+            text_file, alldfs_file, delimiter, word_sep, min_docnum,
+            max_docnum, tokens_limit, encoding, use_index,
+            max_tokens_in_memory, spill_dir, window, window_offsets)
+
     MOD_LOGGER.info('Making text generator object...')
-    text_generator = RawCorpus(
-    	text_file, delimiter, word_sep, encoding=encoding)
+    if use_cache and window is None:
+        text_generator = get_compiled_corpus(
+            text_file, delimiter, word_sep, encoding=encoding)
+    else:
+        text_generator = RawCorpus(
+            text_file, delimiter, word_sep, encoding=encoding,
+            use_index=use_index, window=window,
+            window_offsets=window_offsets)
 
     MOD_LOGGER.info('Text generator created on %s', text_file)
 
     MOD_LOGGER.info('Creating core body of all tokens...')
-    text_corebody = make_simple_core(text_generator)
+    text_corebody = make_simple_core(text_generator,
+        num_workers=num_workers)
 
     # write file containing all token dfs
-    if new_filename is None:
-    	alldfs_file = text_file[:-4] + '_dfs-all.txt'
-    else:
-    	alldfs_file = new_filename
-
     write_dfs_to_file(text_corebody, alldfs_file)
 
     MOD_LOGGER.info('Wrote dfs of all tokens to %s', alldfs_file)
@@ -221,6 +1364,45 @@ def create_corebody(text_file, new_filename=None, delimiter='\t',
 
     MOD_LOGGER.info('Filtering core body using: %s',
     	{'min docs': min_docnum, 'max perc': max_bound})
-    text_corebody.filter_extremes(min_docnum, max_bound, tokens_limit)
+
+    return filter_dict_extremes(text_corebody, min_docnum, max_bound,
+                                tokens_limit)
+
+def _create_spilled_corebody(text_file, alldfs_file, delimiter, word_sep,
+                             min_docnum, max_docnum, tokens_limit, encoding,
+                             use_index, max_tokens_in_memory, spill_dir,
+                             window=None, window_offsets=False):
+    """Does the work of create_corebody with df counts spilled to disk (see
+    count_dfs_spilled and merge_spilled_dfs)
+    """
+    text_generator = RawCorpus(text_file, delimiter, word_sep,
+                               encoding=encoding, use_index=use_index,
+                               window=window, window_offsets=window_offsets)
+
+    if spill_dir is None:
+        spill_dir = os.path.dirname(os.path.abspath(text_file))
+    tmp_dir = tempfile.mkdtemp(prefix='spilled_dfs_', dir=spill_dir)
+
+    try:
+        MOD_LOGGER.info('Counting dfs with at most %s tokens in memory...',
+                        max_tokens_in_memory)
+        spilled = count_dfs_spilled(text_generator, max_tokens_in_memory,
+                                    tmp_dir)
+
+        if max_docnum == 0 or max_docnum == 1.0:
+            max_bound = 1.0
+        else:
+            max_bound = float(max_docnum) / text_generator.num_docs
+
+        MOD_LOGGER.info('Merging spilled dfs, filtering core body using: %s',
+                        {'min docs': min_docnum, 'max perc': max_bound})
+        text_corebody = merge_spilled_dfs(
+            *spilled, encoding=text_generator.encoding,
+            alldfs_file=alldfs_file, min_bound=min_docnum,
+            max_bound=max_bound, tokens_limit=tokens_limit)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    MOD_LOGGER.info('Wrote dfs of all tokens to %s', alldfs_file)
 
     return text_corebody
@@ -0,0 +1,346 @@
+""" This module contains a saved, mergeable form of the document
+frequencies of a body of texts (a df snapshot), so that core bodies can be
+kept up to date as new texts come in without counting every text again:
+  - a snapshot holds each token's df, plus the number of docs (and tokens)
+    they were counted over, and the files (and how much of each) counted
+  - snapshots of different texts can be merged by adding up their dfs
+  - texts appended to a file are counted on their own and merged into the
+    file's snapshot, so updating it costs as much as the new texts do
+  - snapshots are held in memory, so they aren't for texts with more
+    distinct tokens than fit in memory (see corebody.count_dfs_spilled)
+"""
+
+import numpy as np
+import io
+import json
+import logging
+import os
+import shutil
+import zlib
+import corebody as core
+
+MOD_LOGGER = logging.getLogger('text_processing.df_snapshot')
+
+SNAPSHOT_SUFFIX = '_dfs-snapshot'
+
+# bytes at each end of the counted part of a file that are checked to make
+# sure it hasn't changed
+CHECKSUM_BYTES = 2**16
+
+class DfSnapshot(object):
+    """Document frequencies of tokens in a body of texts, sorted by token;
+    can be given to compare_corpus.merge_cores in place of a core body
+
+    Inputs:
+    - tokens = numpy object array of unique unicode tokens, sorted
+    - dfs = numpy array of document frequency of each token
+    - num_docs = total number of docs the dfs were counted over
+    - num_pos = total number of tokens in those docs
+    - num_nnz = total number of (doc, unique token) pairs in those docs
+    - sources = dict of the files counted: {file name: {'size': bytes of
+      the file counted, 'checksum': see get_prefix_checksum, 'delimiter',
+      'word_sep', 'encoding': how it was read}}
+    """
+    def __init__(self, tokens, dfs, num_docs, num_pos=0, num_nnz=0,
+                 sources=None):
+        self.tokens = np.asarray(tokens, dtype=object)
+        self.dfs = np.asarray(dfs, dtype=np.int64)
+        self.num_docs = num_docs
+        self.num_pos = num_pos
+        self.num_nnz = num_nnz
+        self.sources = sources or {}
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def token_dfs(self):
+        """Returns list of (token, df) pairs, sorted by token"""
+        return zip(self.tokens.tolist(), self.dfs.tolist())
+
+    def merge(self, other):
+        """Returns a new DfSnapshot of the texts of this snapshot and
+        another one together (the two must be of different texts)
+        """
+        tokens = np.unique(np.concatenate((self.tokens, other.tokens)))
+        dfs = np.zeros(len(tokens), dtype=np.int64)
+        for snapshot in (self, other):
+            dfs[np.searchsorted(tokens, snapshot.tokens)] += snapshot.dfs
+
+        sources = dict(self.sources)
+        sources.update(other.sources)
+
+        return DfSnapshot(tokens, dfs, self.num_docs + other.num_docs,
+                          self.num_pos + other.num_pos,
+                          self.num_nnz + other.num_nnz, sources)
+
+    def filter_extremes(self, no_below=0, no_above=1.0, keep_n=None):
+        """Returns a new DfSnapshot with only the tokens that gensim
+        Dictionary's filter_extremes would keep (see
+        corebody.select_extremes)
+        """
+        keep = core.select_extremes(self.dfs, self.num_docs, no_below,
+                                    no_above, keep_n)
+
+        return DfSnapshot(self.tokens[keep], self.dfs[keep], self.num_docs,
+                          self.num_pos, self.num_nnz, self.sources)
+
+    def to_gensim_dict(self):
+        """Returns the tokens and their dfs as a gensim Dictionary object"""
+        return core.make_dict_from_dfs(self.tokens.tolist(), self.dfs,
+                                       self.num_docs, self.num_pos,
+                                       self.num_nnz)
+
+    def save(self, snapshot_dir):
+        """Saves the snapshot to snapshot_dir (replacing whatever is
+        there), as meta.json, tokens.txt and dfs.npy
+        """
+        tmp_dir = snapshot_dir + '.tmp'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        with io.open(os.path.join(tmp_dir, 'tokens.txt'), 'w',
+                     encoding='utf-8', newline='\n') as fo:
+            fo.writelines(token + u'\n' for token in self.tokens)
+        np.save(os.path.join(tmp_dir, 'dfs.npy'), self.dfs)
+
+        meta = {'num_docs': self.num_docs, 'num_pos': self.num_pos,
+                'num_nnz': self.num_nnz, 'sources': self.sources}
+        with io.open(os.path.join(tmp_dir, 'meta.json'), 'wb') as fo:
+            json.dump(meta, fo)
+
+        if os.path.exists(snapshot_dir):
+            shutil.rmtree(snapshot_dir)
+        os.rename(tmp_dir, snapshot_dir)
+
+def load_snapshot(snapshot_dir):
+    """Returns the DfSnapshot saved in snapshot_dir"""
+    with io.open(os.path.join(snapshot_dir, 'meta.json'),
+                 encoding='utf-8') as fo:
+        meta = json.load(fo)
+
+    with io.open(os.path.join(snapshot_dir, 'tokens.txt'),
+                 encoding='utf-8', newline='\n') as fo:
+        tokens = fo.read().split(u'\n')[:-1]
+
+    return DfSnapshot(tokens, np.load(os.path.join(snapshot_dir, 'dfs.npy')),
+                      meta['num_docs'], meta['num_pos'], meta['num_nnz'],
+                      meta['sources'])
+
+def make_snapshot(token2df, num_docs, num_pos=0, num_nnz=0, sources=None):
+    """Makes a DfSnapshot out of a {token: doc freq} dict (as returned by
+    corebody.count_dfs, along with num_docs, num_pos and num_nnz)
+    """
+    tokens = sorted(token2df)
+
+    return DfSnapshot(tokens, [token2df[token] for token in tokens],
+                      num_docs, num_pos, num_nnz, sources)
+
+def get_snapshot_name(file_name):
+    """Returns the name of the directory update_snapshot saves file_name's
+    snapshot in
+    """
+    return file_name[:-4] + SNAPSHOT_SUFFIX
+
+def get_prefix_checksum(file_name, size):
+    """Returns a checksum of the first size bytes of a file, taken over
+    the first and last CHECKSUM_BYTES of them (so it's cheap for big
+    files), or None if they don't end with a newline (texts appended to
+    them would run on from the last one)
+    """
+    with open(file_name, 'rb') as fo:
+        head = fo.read(min(size, CHECKSUM_BYTES))
+        tail_start = max(0, size - CHECKSUM_BYTES)
+        fo.seek(tail_start)
+        tail = fo.read(size - tail_start)
+
+    if len(tail) < size - tail_start or (size and not tail.endswith('\n')):
+        return None
+
+    return zlib.crc32(head + tail) & 0xffffffff
+
+def count_snapshot(text_file, delimiter='\t', word_sep='|',
+                   encoding='utf-8', byte_range=None, use_index=False,
+                   num_workers=1, use_cache=False):
+    """Counts the dfs of the texts in a file (or in byte_range of it) and
+    returns them as a DfSnapshot (with no sources), counted in memory the
+    same ways corebody.create_corebody can count them
+
+    Inputs:
+    - text_file = file containing texts (with a header)
+    - delimiter, word_sep, encoding = as for corebody.RawCorpus
+    - byte_range = (start, end) byte offsets of the part of the file to
+      count, as for corebody.RawCorpus; default is None (whole file)
+    - use_index = if True, keep a sidecar index of text_file's line
+      offsets (see corebody.RawCorpus)
+    - num_workers = number of processes to count dfs in
+    - use_cache = if True, count the whole file from its compiled corpus
+      (see corebody.get_compiled_corpus); a compiled corpus is of the
+      whole file, so this is ignored if byte_range is given
+    """
+    if use_cache and byte_range is None:
+        return make_snapshot(*core.get_compiled_corpus(
+            text_file, delimiter, word_sep, encoding=encoding).count_dfs(
+                num_workers=num_workers))
+
+    text_generator = core.RawCorpus(text_file, delimiter, word_sep,
+                                    encoding=encoding, byte_range=byte_range,
+                                    use_index=use_index)
+
+    if num_workers > 1:
+        return make_snapshot(*core.count_shard_dfs(text_generator,
+                                                   num_workers))
+    return make_snapshot(*core.count_dfs(text_generator))
+
+def update_snapshot(text_file, delimiter='\t', word_sep='|',
+                    encoding='utf-8', snapshot_dir=None, use_index=False,
+                    **count_kwargs):
+    """Brings the df snapshot of a texts file up to date and returns it:
+    if the file has grown since it was last counted, only the texts added
+    to its end are counted, and merged into the saved snapshot; otherwise
+    (no snapshot yet, the file got smaller or the part counted changed,
+    or it's read differently) all its texts are counted. Files are
+    expected to only ever be appended to, a whole line at a time; the part
+    counted is checked with get_prefix_checksum
+
+    Inputs:
+    - text_file = file containing texts (with a header)
+    - delimiter = char separating cols ('None' if only one col in data)
+    - word_sep = char separating words in text
+    - encoding = encoding of text file
+    - snapshot_dir = directory the snapshot is saved in; default is
+      get_snapshot_name(text_file)
+    - use_index = if True, keep a sidecar index of text_file's line
+      offsets (see corebody.RawCorpus)
+    - count_kwargs = num_workers and use_cache, for counting the texts
+      (see count_snapshot)
+    """
+    if snapshot_dir is None:
+        snapshot_dir = get_snapshot_name(text_file)
+
+    source_key = os.path.abspath(text_file)
+    file_size = os.path.getsize(text_file)
+    source = {'size': file_size, 'delimiter': delimiter,
+              'word_sep': word_sep, 'encoding': encoding}
+
+    snapshot = None
+    start = 0
+    if os.path.exists(snapshot_dir):
+        snapshot = load_snapshot(snapshot_dir)
+        counted = snapshot.sources.get(source_key)
+        if counted is not None and _is_prefix(text_file, counted, source):
+            start = counted['size']
+        else:
+            MOD_LOGGER.info('Snapshot %s is not of %s as it is now, so '
+                            'it is counted again', snapshot_dir, text_file)
+            snapshot = None
+
+    if snapshot is not None and start == file_size:
+        MOD_LOGGER.info('Snapshot %s is up to date', snapshot_dir)
+        return snapshot
+
+    MOD_LOGGER.info('Counting dfs of %s from byte %s...', text_file, start)
+    if start == 0:
+        byte_range = None
+    else:
+        byte_range = (start, file_size)
+    new_snapshot = count_snapshot(text_file, delimiter, word_sep, encoding,
+                                  byte_range, use_index and start == 0,
+                                  **count_kwargs)
+    source['checksum'] = get_prefix_checksum(text_file, file_size)
+    new_snapshot.sources = {source_key: source}
+
+    if snapshot is None:
+        snapshot = new_snapshot
+    else:
+        MOD_LOGGER.info('Merging %s new texts into snapshot %s',
+                        new_snapshot.num_docs, snapshot_dir)
+        snapshot = snapshot.merge(new_snapshot)
+
+    snapshot.save(snapshot_dir)
+
+    return snapshot
+
+def _is_prefix(text_file, counted, source):
+    """Returns True if the part of text_file described by counted (a
+    source of a snapshot) is still the start of the file, and it's read
+    the same way as source says
+    """
+    if counted['size'] > source['size'] or any(
+            counted.get(key) != source[key]
+            for key in ('delimiter', 'word_sep', 'encoding')):
+        return False
+
+    checksum = get_prefix_checksum(text_file, counted['size'])
+    if checksum is None and counted['size'] < source['size']:
+        return False
+
+    return counted.get('checksum', -1) == checksum
+
+def create_snapshot_corebody(text_file, new_filename=None, delimiter='\t',
+                             word_sep='|', min_docnum=0, max_docnum=1.0,
+                             tokens_limit=None, encoding='utf-8',
+                             use_index=False, snapshot_dir=None,
+                             max_tokens_in_memory=None, window=None,
+                             window_offsets=False, **count_kwargs):
+    """Does the work of corebody.create_corebody, but from text_file's df
+    snapshot (see update_snapshot), so only texts added since the last
+    call are counted: writes the dfs of all tokens to file (naming =
+    text_file + '_dfs-all.txt'), and returns the thresholded core body as
+    a DfSnapshot
+
+    The whole snapshot is held in memory, so for texts with too many
+    distinct tokens use corebody.create_corebody with max_tokens_in_memory
+    instead
+
+    Inputs:
+    - text_file = file containing texts
+    - new_filename = name of file to write dfs of all tokens to
+    - delimiter = char separating cols ('None' if only one col in data)
+    - word_sep = char separating words in text
+    - min_docnum = min num docs for words to be included in core body
+    - max_docnum = max num docs for words to be included in core body
+    - tokens_limit = max number of words to include in core body
+    - encoding = encoding of text file
+    - use_index = if True, keep a sidecar index of text_file's line
+      offsets (see corebody.RawCorpus)
+    - snapshot_dir = directory the snapshot is saved in; default is
+      get_snapshot_name(text_file)
+    - max_tokens_in_memory = must be None; raises ValueError otherwise,
+      as the snapshot can't keep to a memory budget
+    - window = must be None; raises ValueError otherwise, as a snapshot
+      is of whole texts (count windows with corebody.create_corebody)
+    - window_offsets = not used, as there's no window
+    - count_kwargs = num_workers and use_cache, for counting the texts
+      (see count_snapshot)
+    """
+    MOD_LOGGER.info('Received call to "create_snapshot_corebody"')
+
+    if max_tokens_in_memory is not None:
+        raise ValueError('Df snapshots are held in memory, so they can\'t '
+                         'be counted with max_tokens_in_memory')
+    if window is not None:
+        raise ValueError('Df snapshots are of whole texts, so they can\'t '
+                         'be counted over a window')
+
+    snapshot = update_snapshot(text_file, delimiter, word_sep, encoding,
+                               snapshot_dir, use_index, **count_kwargs)
+
+    if new_filename is None:
+        alldfs_file = text_file[:-4] + '_dfs-all.txt'
+    else:
+        alldfs_file = new_filename
+
+    core.write_token_dfs(snapshot.token_dfs(), alldfs_file)
+
+    MOD_LOGGER.info('Wrote dfs of all tokens to %s', alldfs_file)
+
+    if max_docnum == 0 or max_docnum == 1.0:
+        max_bound = 1.0
+    else:
+        max_bound = float(max_docnum) / snapshot.num_docs
+
+    MOD_LOGGER.info('Filtering core body using: %s',
+                    {'min docs': min_docnum, 'max perc': max_bound})
+
+    return snapshot.filter_extremes(min_docnum, max_bound, tokens_limit)
@@ -0,0 +1,223 @@
+""" This module contains a saved table of the merged dfs of two samples of
+texts (token, df in sample 1, df in sample 2, plus the size of each
+sample), for trying out thresholds without running the text processing
+scripts again:
+  - the multiplier and pval of every token are worked out once, when the
+    table is made
+  - the table is saved column by column as numpy arrays, along with the
+    order of its rows by pval and by total df, so loading it is quick
+  - a query ("tokens in at least X docs, with multiplier at least Y and
+    pval below Z, sorted by pval") only looks at the rows that can pass
+"""
+
+import numpy as np
+import io
+import json
+import logging
+import os
+import shutil
+import compare_corpus as compare
+
+MOD_LOGGER = logging.getLogger('text_processing.df_table')
+
+TABLE_SUFFIX = '_df-table'
+
+class DfTable(object):
+    """Merged dfs of two samples of texts, with the multiplier and pval of
+    each token and the orders of the rows used by query
+
+    Inputs:
+    - tokens = list of tokens (unicode)
+    - dfs = (num tokens x 2) numpy array of the df of each token in each
+      sample
+    - size_sample1 = total num docs in sample 1
+    - size_sample2 = total num docs in sample 2
+    - test = name of significance test in compare_corpus.SIG_TESTS
+    - columns = dict of the arrays worked out from the dfs, as saved by
+      save (worked out again if None)
+    """
+    def __init__(self, tokens, dfs, size_sample1, size_sample2, test='ttest',
+                 columns=None):
+        self.tokens = tokens
+        self.dfs = dfs
+        self.size_sample1 = size_sample1
+        self.size_sample2 = size_sample2
+        self.test = test
+
+        if columns is None:
+            columns = self._make_columns()
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def _make_columns(self):
+        dfs_1 = np.asarray(self.dfs[:, 0], dtype=np.int64)
+        dfs_2 = np.asarray(self.dfs[:, 1], dtype=np.int64)
+        multipliers, pvals = compare.df_test_arrays(
+            dfs_1, dfs_2, self.size_sample1, self.size_sample2, self.test)
+
+        # rows are ordered the same way sorting the file written by
+        # compare_corpus.write_df_ttest_to_file by (pval as written,
+        # df in sample 1 descending) does
+        written_pvals = np.array(['%.3f' % pval for pval in pvals],
+                                 dtype=float)
+        by_pval = np.lexsort((-dfs_1, written_pvals))
+        pval_ranks = np.empty(len(by_pval), dtype=np.int64)
+        pval_ranks[by_pval] = np.arange(len(by_pval))
+
+        totals = dfs_1 + dfs_2
+        by_total = np.argsort(totals, kind='mergesort')
+
+        return {'multipliers': multipliers, 'pvals': pvals,
+                'by_pval': by_pval, 'sorted_pvals': written_pvals[by_pval],
+                'pval_ranks': pval_ranks, 'by_total': by_total,
+                'sorted_totals': totals[by_total]}
+
+    def save(self, table_dir):
+        """Saves the table to table_dir (replacing whatever is there): a
+        .npy file per column, tokens.txt and meta.json
+        """
+        tmp_dir = table_dir + '.tmp'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        with io.open(os.path.join(tmp_dir, 'tokens.txt'), 'w',
+                     encoding='utf-8', newline='\n') as fo:
+            fo.writelines(token + u'\n' for token in self.tokens)
+
+        np.save(os.path.join(tmp_dir, 'dfs.npy'),
+                np.asarray(self.dfs, dtype=np.int64))
+        for name, column in self.columns.iteritems():
+            np.save(os.path.join(tmp_dir, name + '.npy'), column)
+
+        meta = {'size_sample1': self.size_sample1,
+                'size_sample2': self.size_sample2, 'test': self.test,
+                'columns': sorted(self.columns)}
+        with io.open(os.path.join(tmp_dir, 'meta.json'), 'wb') as fo:
+            json.dump(meta, fo)
+
+        if os.path.exists(table_dir):
+            shutil.rmtree(table_dir)
+        os.rename(tmp_dir, table_dir)
+
+        MOD_LOGGER.info('Saved df table of %s tokens to %s', len(self),
+                        table_dir)
+
+    def query(self, min_num=10, min_multiplier=0, pval_threshold=1,
+              max_num=None, max_rows=None):
+        """Returns a list of the (token, pval, df in sample 1, df in sample
+        2) rows that compare_corpus.df_test_rows would give with the same
+        thresholds, sorted by pval (as written to file, ascending), then
+        df in sample 1 (descending)
+
+        Only the rows that the pval or total df thresholds leave in (which
+        ever are fewer) are looked at, using the saved sorted orders
+
+        Inputs:
+        - min_num = min total df (df1 + df2) of tokens
+        - min_multiplier = min multiplier of tokens (see
+          compare_corpus.df_multipliers)
+        - pval_threshold = tokens must have pvals below this
+        - max_num = max total df of tokens (default is None, no max)
+        - max_rows = max number of rows to return (default is None, all)
+        """
+        columns = self.columns
+
+        # pvals below the threshold are written as at most threshold +
+        # 0.0005, so every row that can pass is before this position
+        pval_end = np.searchsorted(columns['sorted_pvals'],
+                                   pval_threshold + 0.0005, side='right')
+        total_start = np.searchsorted(columns['sorted_totals'], min_num)
+        total_end = len(self)
+        if max_num is not None:
+            total_end = np.searchsorted(columns['sorted_totals'], max_num,
+                                        side='right')
+
+        if pval_end <= total_end - total_start:
+            rows = np.asarray(columns['by_pval'][:pval_end])
+        else:
+            rows = np.asarray(columns['by_total'][total_start:total_end])
+            rows = rows[np.argsort(columns['pval_ranks'][rows])]
+
+        dfs_1 = np.asarray(self.dfs[rows, 0])
+        dfs_2 = np.asarray(self.dfs[rows, 1])
+        totals = dfs_1 + dfs_2
+
+        with np.errstate(invalid='ignore'):
+            is_kept = (
+                (totals >= min_num) &
+                ~((dfs_1 == self.size_sample1) &
+                  (dfs_2 == self.size_sample2)) &
+                (columns['multipliers'][rows] >= min_multiplier) &
+                (columns['pvals'][rows] < pval_threshold))
+        if max_num is not None:
+            is_kept &= totals <= max_num
+
+        kept = np.flatnonzero(is_kept)[:max_rows]
+        pvals = columns['pvals'][rows[kept]]
+
+        return [(self.tokens[row], pval, df_1, df_2)
+                for (row, pval, df_1, df_2)
+                in zip(rows[kept].tolist(), pvals.tolist(),
+                       dfs_1[kept].tolist(), dfs_2[kept].tolist())]
+
+    def write_query(self, file_name, *args, **kwargs):
+        """Writes the rows of query(*args, **kwargs) to file_name, in the
+        same format as compare_corpus.write_df_ttest_to_file; returns the
+        number of rows written
+        """
+        rows = self.query(*args, **kwargs)
+
+        with io.open(file_name, 'w', encoding='utf-8') as fo:
+            fo.writelines(u'%s,%.3f,%i,%i\n' % row for row in rows)
+
+        return len(rows)
+
+def make_df_table(merged_core, size_sample1, size_sample2, table_dir=None,
+                  test='ttest'):
+    """Makes a DfTable from merged dfs of two samples, and saves it to
+    table_dir if given
+
+    Inputs:
+    - merged_core = (tokens, dfs) from compare_corpus.merge_cores of two
+      cores, or dictionary of {token: [df1, df2]}
+    - size_sample1 = total num docs in sample 1
+    - size_sample2 = total num docs in sample 2
+    - table_dir = directory to save the table in
+    - test = name of significance test in compare_corpus.SIG_TESTS
+    """
+    tokens, dfs_1, dfs_2 = compare.merged_core_arrays(merged_core)
+
+    df_table = DfTable(list(tokens), np.column_stack((dfs_1, dfs_2)),
+                       size_sample1, size_sample2, test)
+    if table_dir is not None:
+        df_table.save(table_dir)
+
+    return df_table
+
+def load_df_table(table_dir):
+    """Returns the DfTable saved in table_dir; its columns are memory-mapped
+    rather than read
+    """
+    with io.open(os.path.join(table_dir, 'meta.json'),
+                 encoding='utf-8') as fo:
+        meta = json.load(fo)
+
+    with io.open(os.path.join(table_dir, 'tokens.txt'), encoding='utf-8',
+                 newline='\n') as fo:
+        tokens = fo.read().split(u'\n')[:-1]
+
+    def _load(name):
+        return np.load(os.path.join(table_dir, name + '.npy'), mmap_mode='r')
+
+    return DfTable(tokens, _load('dfs'), meta['size_sample1'],
+                   meta['size_sample2'], meta['test'],
+                   dict((name, _load(name)) for name in meta['columns']))
+
+def get_table_name(file_name):
+    """Returns the name of the directory to save the df table of the
+    results written to file_name in
+    """
+    return file_name[:-4] + TABLE_SUFFIX
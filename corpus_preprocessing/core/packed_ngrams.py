@@ -0,0 +1,729 @@
+""" This module contains functions for counting the document frequencies
+of uni-, bi-, and trigrams in a body of texts without writing out
+trigram'd versions of the texts:
+  - words are mapped to integer ids as they are read
+  - every uni-, bi-, and trigram is packed into a single int64
+  - dfs are counted with numpy over per-document unique n-grams, and
+    n-grams are only turned back into strings for output
+"""
+
+import numpy as np
+import codecs
+import itertools
+import logging
+import corebody as core
+import trigrams as tri
+
+MOD_LOGGER = logging.getLogger('text_processing.packed_ngrams')
+
+# n-gram kinds, stored in the top bits of a packed n-gram
+UNIGRAM = 0
+BIGRAM = 1
+TRIGRAM = 2
+
+# each word id gets 30 bits, so a packed n-gram is
+# [kind (2 bits)][word id 1 (30 bits)][word id 2 (30 bits)]
+ID_BITS = 30
+ID_MASK = (1 << ID_BITS) - 1
+KIND_SHIFT = 2 * ID_BITS
+
+def pack_ngrams(kind, ids_1, ids_2=None):
+    """ Packs n-grams of a single kind into an int64 numpy array
+
+    Inputs:
+    - kind = UNIGRAM, BIGRAM or TRIGRAM
+    - ids_1 = numpy array of word ids of the first word of each n-gram
+    - ids_2 = numpy array of word ids of the last word of each n-gram
+      (None for unigrams)
+    """
+    codes = (np.asarray(ids_1, dtype=np.int64) << ID_BITS)
+    codes |= np.int64(kind) << KIND_SHIFT
+
+    if ids_2 is not None:
+        codes |= np.asarray(ids_2, dtype=np.int64)
+
+    return codes
+
+def unpack_ngrams(codes):
+    """ Takes an int64 numpy array of packed n-grams and returns numpy arrays
+    of (kinds, ids of first words, ids of last words)
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+
+    return (codes >> KIND_SHIFT, (codes >> ID_BITS) & ID_MASK,
+            codes & ID_MASK)
+
+def make_ngram_codes(word_ids, positions):
+    """ Takes the word ids and word positions of the (cleaned) words of a
+    single text, and returns an int64 numpy array of all its packed uni-,
+    bi-, and trigrams (same n-grams as trigrams.make_trigrams)
+
+    Inputs:
+    - word_ids = numpy array of word ids
+    - positions = numpy array of the position of each word in the text
+    """
+    gaps_1 = positions[1:] - positions[:-1]
+    gaps_2 = positions[2:] - positions[:-2]
+
+    bigrams = gaps_1 == 1
+    trigrams_next = gaps_1 == 2
+    trigrams_skip = gaps_2 == 2
+
+    return np.concatenate([
+        pack_ngrams(UNIGRAM, word_ids),
+        pack_ngrams(BIGRAM, word_ids[:-1][bigrams], word_ids[1:][bigrams]),
+        pack_ngrams(TRIGRAM, word_ids[:-1][trigrams_next],
+                    word_ids[1:][trigrams_next]),
+        pack_ngrams(TRIGRAM, word_ids[:-2][trigrams_skip],
+                    word_ids[2:][trigrams_skip])])
+
+def sum_counts_by_code(codes, counts):
+    """ Takes an int64 numpy array of packed n-grams (may contain repeats)
+    and an array of counts for each, and returns (unique codes in ascending
+    order, summed counts for each code)
+    """
+    if len(codes) == 0:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+    order = np.argsort(codes, kind='mergesort')
+    codes = codes[order]
+    counts = counts[order]
+
+    starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+
+    return codes[starts], np.add.reduceat(counts, starts)
+
+class WordIds(object):
+    """Maps words to integer ids, in the order they are first seen; words
+    that are filtered out are all mapped to -1, so every word of every
+    text is looked up with a single dict access
+
+    Inputs:
+    - words_to_compare = list of words you either want to keep or remove
+      from texts (None keeps all words)
+    - method = "keep" or "remove" - indicates whether or not
+      words_to_compare is for keeping or removing
+    """
+    def __init__(self, words_to_compare=None, method='keep'):
+        self.words = []
+        self.word2id = {}
+        self.method = method
+
+        if words_to_compare is None:
+            self.words_lookup = None
+        else:
+            self.words_lookup = tri.make_words_lookup(words_to_compare)
+
+    def __len__(self):
+        return len(self.words)
+
+    def _add_word(self, word):
+        if self.words_lookup is None:
+            is_kept = True
+        elif self.method == 'remove':
+            is_kept = word not in self.words_lookup
+        else:
+            is_kept = word in self.words_lookup
+
+        if not is_kept:
+            word_id = -1
+        else:
+            word_id = len(self.words)
+            if word_id > ID_MASK:
+                raise ValueError('Too many distinct words to pack into '
+                                 'n-grams (max is %s)' % (ID_MASK + 1))
+            self.words.append(word)
+
+        self.word2id[word] = word_id
+
+        return word_id
+
+    def text_to_ids(self, text):
+        """Takes a list of words and returns numpy arrays of (word ids,
+        word positions) for the words that are kept
+        """
+        word2id = self.word2id
+        word_ids = np.array(
+            [word2id[word] if word in word2id else self._add_word(word)
+             for word in text],
+            dtype=np.int64)
+
+        return _kept_word_ids(word_ids)
+
+    def vocab_to_ids(self, vocab):
+        """Takes a list of distinct words (such as a CompiledCorpus vocab)
+        and returns a numpy array of the id of each word (-1 if filtered
+        out), so that texts of vocab indexes can be mapped with a single
+        numpy lookup
+        """
+        word2id = self.word2id
+
+        return np.array(
+            [word2id[word] if word in word2id else self._add_word(word)
+             for word in vocab],
+            dtype=np.int64)
+
+def _kept_word_ids(word_ids):
+    """Takes a numpy array of the word ids of a text (-1 for filtered out
+    words) and returns numpy arrays of (word ids, word positions) for the
+    words that are kept
+    """
+    positions = np.flatnonzero(word_ids >= 0)
+
+    return word_ids[positions], positions
+
+class NgramDfs(object):
+    """Document frequencies of packed n-grams
+
+    Inputs:
+    - codes = int64 numpy array of unique packed n-grams, ascending
+    - dfs = numpy array of document frequency of each n-gram
+    - words = list of words, indexed by the word ids used in codes
+    - num_docs = total number of docs the dfs were counted over
+    - num_pos = total number of n-grams in those docs
+    - max_error = most that any df may be undercounted by, and the most
+      docs any n-gram that was left out can be in (only nonzero for the
+      bounded counts of count_top_ngram_dfs)
+    """
+    def __init__(self, codes, dfs, words, num_docs, num_pos=0, max_error=0):
+        self.codes = codes
+        self.dfs = dfs
+        self.words = words
+        self.num_docs = num_docs
+        self.num_pos = num_pos
+        self.max_error = max_error
+
+    def __len__(self):
+        return len(self.codes)
+
+    def tokens(self, positions=None):
+        """Returns the n-grams (at the given positions, or all of them) as
+        strings, in the same format as trigrams.make_trigrams
+        """
+        codes = self.codes if positions is None else self.codes[positions]
+        kinds, ids_1, ids_2 = unpack_ngrams(codes)
+        words = self.words
+        seps = {BIGRAM: u' ', TRIGRAM: u' - '}
+
+        return [
+            words[id_1] if kind == UNIGRAM
+            else words[id_1] + seps[kind] + words[id_2]
+            for (kind, id_1, id_2) in zip(kinds.tolist(), ids_1.tolist(),
+                                           ids_2.tolist())]
+
+    def token_dfs(self, positions=None):
+        """Returns list of (n-gram string, df) pairs"""
+        dfs = self.dfs if positions is None else self.dfs[positions]
+        return zip(self.tokens(positions), dfs.tolist())
+
+    def filter_extremes(self, no_below=0, no_above=1.0, keep_n=None):
+        """Returns a new NgramDfs with only the n-grams that gensim
+        Dictionary's filter_extremes would keep (see
+        corebody.select_extremes)
+        """
+        keep = core.select_extremes(self.dfs, self.num_docs, no_below,
+                                    no_above, keep_n)
+
+        return NgramDfs(self.codes[keep], self.dfs[keep], self.words,
+                        self.num_docs, self.num_pos, self.max_error)
+
+    def restrict_to_words(self, words_to_keep):
+        """Returns a new NgramDfs with only the n-grams whose words are all
+        in words_to_keep; since n-grams are made from word positions in
+        the original texts, these are exactly the n-grams (and dfs) that
+        counting texts cleaned with words_to_keep would give, as long as
+        words_to_keep is a subset of the words these were counted with
+        """
+        words_lookup = tri.make_words_lookup(words_to_keep)
+        is_kept_word = np.array([word in words_lookup for word in self.words],
+                                dtype=bool)
+
+        kinds, ids_1, ids_2 = unpack_ngrams(self.codes)
+        keep = is_kept_word[ids_1] & ((kinds == UNIGRAM) | is_kept_word[ids_2])
+
+        return NgramDfs(self.codes[keep], self.dfs[keep], self.words,
+                        self.num_docs)
+
+    def to_gensim_dict(self):
+        """Returns the n-grams and their dfs as a gensim Dictionary object"""
+        return core.make_dict_from_dfs(
+            self.tokens(), self.dfs, self.num_docs, self.num_pos,
+            int(self.dfs.sum()))
+
+class DfSketch(object):
+    """Count-min sketch of the dfs of packed n-grams: depth rows of
+    2**bits counts, where each n-gram adds to one count per row (picked by
+    multiply-shift hashing), and its df is estimated as the smallest of
+    its counts, which is never less than its true df
+
+    Inputs:
+    - bits = log2 of the number of counts in each row
+    - depth = number of rows
+    - seed = seed for picking the hash function of each row
+    """
+    def __init__(self, bits=22, depth=4, seed=0):
+        self.shift = np.uint64(64 - bits)
+        # odd multipliers, one per row
+        self.multipliers = (np.random.RandomState(seed).randint(
+            0, 2**62, size=depth).astype(np.uint64) * np.uint64(2) +
+            np.uint64(1))
+        self.counts = np.zeros((depth, 2**bits), dtype=np.int32)
+
+    def _hash_rows(self, codes):
+        codes = np.asarray(codes, dtype=np.int64).astype(np.uint64)
+        return [((codes * multiplier) >> self.shift).astype(np.intp)
+                for multiplier in self.multipliers]
+
+    def add(self, codes):
+        """Adds 1 to the df of each n-gram in codes (an n-gram should be
+        listed once per doc it is in)
+        """
+        for row, cols in zip(self.counts, self._hash_rows(codes)):
+            row += np.bincount(cols, minlength=len(row)).astype(np.int32)
+
+    def estimate(self, codes):
+        """Returns a numpy array of the estimated df of each n-gram in
+        codes
+        """
+        estimates = None
+        for row, cols in zip(self.counts, self._hash_rows(codes)):
+            if estimates is None:
+                estimates = row[cols]
+            else:
+                estimates = np.minimum(estimates, row[cols])
+
+        return estimates
+
+    def select(self, batch, min_df):
+        """Takes a list of int64 numpy arrays of packed n-grams and returns
+        a single array of those that may be in at least min_df docs
+        """
+        codes = np.concatenate(batch)
+
+        return codes[self.estimate(codes) >= min_df]
+
+def count_ngram_dfs(raw_corp, words_to_compare=None, method='keep',
+                    batch_size=1000000):
+    """ Takes a corpus generator object, cleans each text the same way as
+    trigrams.create_trigrams_file, and counts the document frequency of
+    every uni-, bi-, and trigram in the cleaned texts
+
+    Inputs:
+    - raw_corp = RawCorpus object (or any iterable of [text_id, words]);
+      a CompiledCorpus is read as arrays of word ids, so its words are
+      only looked up once each
+    - words_to_compare = list of words that you either want to keep or
+      remove from texts (None keeps all words)
+    - method = "keep" or "remove" - indicates whether or not
+      words_to_compare is for keeping or removing
+    - batch_size = number of per-document unique n-grams to collect before
+      merging them into the running counts
+    """
+    MOD_LOGGER.info('Received call to "count_ngram_dfs"')
+
+    word_ids = WordIds(words_to_compare, method)
+
+    codes = np.zeros(0, dtype=np.int64)
+    dfs = np.zeros(0, dtype=np.int64)
+    num_docs = 0
+    num_pos = 0
+
+    batch = []
+    batch_length = 0
+
+    for text_ids in _iter_texts_ids(raw_corp, word_ids):
+        num_docs += 1
+
+        doc_codes = make_ngram_codes(*text_ids)
+        num_pos += len(doc_codes)
+
+        doc_codes = np.unique(doc_codes)
+        batch.append(doc_codes)
+        batch_length += len(doc_codes)
+
+        if batch_length >= batch_size:
+            codes, dfs = _merge_batch(codes, dfs, batch)
+            batch = []
+            batch_length = 0
+
+    codes, dfs = _merge_batch(codes, dfs, batch)
+
+    MOD_LOGGER.info('Counted %s distinct n-grams from %s words over %s texts',
+                    len(codes), len(word_ids), num_docs)
+
+    return NgramDfs(codes, dfs, word_ids.words, num_docs, num_pos)
+
+def count_top_ngram_dfs(raw_corp, table_size, words_to_compare=None,
+                        method='keep', verify_corp=None, batch_size=1000000):
+    """ Same as count_ngram_dfs, but for finding the n-grams in the most
+    docs while only ever keeping dfs for table_size n-grams (plus one
+    batch), however many distinct n-grams the texts have
+
+    N-grams are counted with the Misra-Gries algorithm (over per-document
+    unique n-grams, a batch at a time): whenever the table holds more than
+    table_size n-grams, the (table_size + 1)th biggest df is taken off
+    every df and n-grams left at 0 are dropped. Returns an NgramDfs of the
+    n-grams left in the table, whose max_error is the total taken off,
+    i.e. dfs are undercounted by at most max_error, and n-grams that were
+    dropped are in at most max_error docs (which is never more than the
+    number of (doc, unique n-gram) pairs / (table_size + 1))
+
+    Inputs:
+    - raw_corp = RawCorpus object (or any iterable of [text_id, words])
+    - table_size = max number of n-grams to keep dfs for
+    - words_to_compare = list of words that you either want to keep or
+      remove from texts (None keeps all words)
+    - method = "keep" or "remove" - indicates whether or not
+      words_to_compare is for keeping or removing
+    - verify_corp = if given, a corpus of the same texts as raw_corp (or
+      raw_corp itself, if it can be read twice) which is read again to
+      count the exact dfs of the n-grams left in the table
+    - batch_size = number of per-document unique n-grams to collect before
+      merging them into the table
+    """
+    MOD_LOGGER.info('Received call to "count_top_ngram_dfs"')
+
+    word_ids = WordIds(words_to_compare, method)
+
+    codes = np.zeros(0, dtype=np.int64)
+    dfs = np.zeros(0, dtype=np.int64)
+    max_error = 0
+    num_docs = 0
+    num_pos = 0
+
+    batch = []
+    batch_length = 0
+
+    for text_ids in _iter_texts_ids(raw_corp, word_ids):
+        num_docs += 1
+
+        doc_codes = make_ngram_codes(*text_ids)
+        num_pos += len(doc_codes)
+
+        doc_codes = np.unique(doc_codes)
+        batch.append(doc_codes)
+        batch_length += len(doc_codes)
+
+        if batch_length >= batch_size:
+            codes, dfs = _merge_batch(codes, dfs, batch)
+            codes, dfs, cut = _prune_table(codes, dfs, table_size)
+            max_error += cut
+            batch = []
+            batch_length = 0
+
+    codes, dfs = _merge_batch(codes, dfs, batch)
+    codes, dfs, cut = _prune_table(codes, dfs, table_size)
+    max_error += cut
+
+    MOD_LOGGER.info('Kept %s n-grams (dfs undercounted by at most %s) from '
+                    '%s words over %s texts', len(codes), max_error,
+                    len(word_ids), num_docs)
+
+    if verify_corp is not None:
+        MOD_LOGGER.info('Counting exact dfs of the n-grams kept...')
+        dfs = _count_listed_dfs(verify_corp, word_ids, codes, batch_size)
+
+    return NgramDfs(codes, dfs, word_ids.words, num_docs, num_pos, max_error)
+
+def count_sketched_ngram_dfs(raw_corp, min_df, recount_corp,
+                             words_to_compare=None, method='keep',
+                             sketch_bits=22, sketch_depth=4,
+                             batch_size=1000000):
+    """ Same as count_ngram_dfs, but only n-grams in at least min_df docs
+    are kept, and rarer n-grams never get counted exactly: the texts are
+    first read into a count-min sketch of n-gram dfs (sketch_depth rows of
+    2**sketch_bits counts, each n-gram adding 1 to one count per row), and
+    then read again to count the exact dfs of just the n-grams the sketch
+    puts in at least min_df docs; the sketch never underestimates a df, so
+    no n-gram in min_df docs or more is missed
+
+    Inputs:
+    - raw_corp = RawCorpus object (or any iterable of [text_id, words])
+    - min_df = min number of docs an n-gram must be in to be kept
+    - recount_corp = a corpus of the same texts as raw_corp (or raw_corp
+      itself, if it can be read twice) which is read again for the exact
+      counts
+    - words_to_compare = list of words that you either want to keep or
+      remove from texts (None keeps all words)
+    - method = "keep" or "remove" - indicates whether or not
+      words_to_compare is for keeping or removing
+    - sketch_bits, sketch_depth = size of the sketch (see DfSketch)
+    - batch_size = number of per-document unique n-grams to collect before
+      adding them to the sketch or counts
+    """
+    MOD_LOGGER.info('Received call to "count_sketched_ngram_dfs"')
+
+    word_ids = WordIds(words_to_compare, method)
+    sketch = DfSketch(sketch_bits, sketch_depth)
+
+    num_docs = 0
+    num_pos = 0
+
+    batch = []
+    batch_length = 0
+
+    for text_ids in _iter_texts_ids(raw_corp, word_ids):
+        num_docs += 1
+
+        doc_codes = make_ngram_codes(*text_ids)
+        num_pos += len(doc_codes)
+
+        doc_codes = np.unique(doc_codes)
+        batch.append(doc_codes)
+        batch_length += len(doc_codes)
+
+        if batch_length >= batch_size:
+            sketch.add(np.concatenate(batch))
+            batch = []
+            batch_length = 0
+
+    if batch:
+        sketch.add(np.concatenate(batch))
+
+    MOD_LOGGER.info('Sketched n-gram dfs of %s words over %s texts; counting '
+                    'exact dfs of n-grams that may be in %s docs...',
+                    len(word_ids), num_docs, min_df)
+
+    codes = np.zeros(0, dtype=np.int64)
+    dfs = np.zeros(0, dtype=np.int64)
+
+    batch = []
+    batch_length = 0
+
+    for text_ids in _iter_texts_ids(recount_corp, word_ids):
+        doc_codes = np.unique(make_ngram_codes(*text_ids))
+        batch.append(doc_codes)
+        batch_length += len(doc_codes)
+
+        if batch_length >= batch_size:
+            codes, dfs = _merge_batch(codes, dfs,
+                                      [sketch.select(batch, min_df)])
+            batch = []
+            batch_length = 0
+
+    if batch:
+        codes, dfs = _merge_batch(codes, dfs, [sketch.select(batch, min_df)])
+
+    keep = dfs >= min_df
+
+    MOD_LOGGER.info('Counted %s n-grams exactly, %s of them in at least %s '
+                    'docs', len(codes), keep.sum(), min_df)
+
+    return NgramDfs(codes[keep], dfs[keep], word_ids.words, num_docs,
+                    num_pos)
+
+def _iter_texts_ids(raw_corp, word_ids):
+    """Yields (word ids, word positions) of the words kept from each text
+    of a corpus (see WordIds.text_to_ids)
+    """
+    if isinstance(raw_corp, core.CompiledCorpus):
+        vocab_ids = word_ids.vocab_to_ids(raw_corp.vocab)
+        return (_kept_word_ids(vocab_ids[text])
+                for text in raw_corp.iter_word_ids())
+
+    return (word_ids.text_to_ids(text) for _, text in raw_corp)
+
+def _prune_table(codes, dfs, table_size):
+    """Cuts running (codes, dfs) counts down to at most table_size n-grams
+    by taking the (table_size + 1)th biggest df off every df, and returns
+    (codes, dfs, amount taken off)
+    """
+    if len(dfs) <= table_size:
+        return codes, dfs, 0
+
+    cut_pos = len(dfs) - table_size - 1
+    cut = np.partition(dfs, cut_pos)[cut_pos]
+    dfs = dfs - cut
+    keep = dfs > 0
+
+    return codes[keep], dfs[keep], int(cut)
+
+def _count_listed_dfs(raw_corp, word_ids, codes, batch_size):
+    """Counts the exact dfs of just the n-grams in codes (unique, ascending)
+    over the texts of a corpus, and returns them as a numpy array
+    """
+    dfs = np.zeros(len(codes), dtype=np.int64)
+
+    batch = []
+    batch_length = 0
+
+    for text_ids in _iter_texts_ids(raw_corp, word_ids):
+        doc_codes = np.unique(make_ngram_codes(*text_ids))
+        batch.append(doc_codes)
+        batch_length += len(doc_codes)
+
+        if batch_length >= batch_size:
+            dfs += _count_listed_batch(codes, batch)
+            batch = []
+            batch_length = 0
+
+    return dfs + _count_listed_batch(codes, batch)
+
+def _count_listed_batch(codes, batch):
+    """Returns how many of a batch of per-document unique n-gram arrays
+    each of the n-grams in codes (unique, ascending) is in
+    """
+    if not batch or len(codes) == 0:
+        return np.zeros(len(codes), dtype=np.int64)
+
+    batch_codes = np.concatenate(batch)
+    positions = np.minimum(np.searchsorted(codes, batch_codes),
+                           len(codes) - 1)
+    positions = positions[codes[positions] == batch_codes]
+
+    return np.bincount(positions, minlength=len(codes))
+
+def _merge_batch(codes, dfs, batch):
+    """Adds a batch of per-document unique n-gram arrays to running
+    (codes, dfs) counts
+    """
+    if not batch:
+        return codes, dfs
+
+    batch_codes = np.concatenate(batch)
+
+    return sum_counts_by_code(
+        np.concatenate((codes, batch_codes)),
+        np.concatenate((dfs, np.ones(len(batch_codes), dtype=np.int64))))
+
+def _write_trigrams_as_read(raw_corp, trigrams_file, words_to_compare, method,
+                            encoding, trigram_word_sep):
+    """Yields the texts of raw_corp as they are, writing the row of each
+    text in a trigrams file (see trigrams.make_trigrams_line) as it goes
+    """
+    with codecs.open(trigrams_file, 'w', encoding) as fo:
+        for text_id, text in raw_corp:
+            fo.write(tri.make_trigrams_line(text_id, text, words_to_compare,
+                                            method, trigram_word_sep))
+            yield [text_id, text]
+
+    MOD_LOGGER.info('Saved trigrams to %s', trigrams_file)
+
+def _open_texts(text_file, delimiter, word_sep, has_header, encoding,
+                use_cache):
+    """Returns a corpus object for the texts of text_file: its compiled
+    corpus if use_cache, otherwise a RawCorpus
+    """
+    if use_cache:
+        return core.get_compiled_corpus(text_file, delimiter, word_sep,
+                                        has_header=has_header,
+                                        encoding=encoding)
+
+    return core.RawCorpus(text_file, delimiter, word_sep,
+                          has_header=has_header, encoding=encoding)
+
+def create_trigram_corebody(text_file, words_to_compare, method='keep',
+                            new_filename=None, delimiter='\t', word_sep='|',
+                            min_docnum=0, max_docnum=1.0, tokens_limit=None,
+                            encoding='utf-8', use_cache=False,
+                            has_header=False, trigrams_file=None,
+                            trigram_word_sep='|', table_size=None,
+                            verify=True, use_sketch=False):
+    """Does the work of trigrams.create_trigrams_file followed by
+    corebody.create_corebody on the trigrams file in a single pass over
+    the texts, without re-reading (or, unless asked, writing) the trigrams
+    file: returns core body of uni-, bi-, and trigrams for the texts as
+    gensim dict object, and writes the dfs of all n-grams to file (naming
+    = text_file + '_trigrams_dfs-all.txt')
+
+    Inputs:
+    - text_file = file containing original single word texts
+    - words_to_compare = list of words that you either want to keep or
+      remove from texts
+    - method = "keep" or "remove" - indicates whether or not
+      words_to_compare is for keeping or removing
+    - new_filename = name of file to write dfs of all n-grams to
+    - delimiter = char separating cols ('None' if only one col in data)
+    - word_sep = char separating words in text
+    - min_docnum = min num docs for n-grams to be included in core body
+    - max_docnum = max num docs for n-grams to be included in core body
+    - tokens_limit = max number of n-grams to include in core body
+    - encoding = encoding of text file
+    - use_cache = if True, read the texts from text_file's compiled corpus
+      (see corebody.get_compiled_corpus), compiling it first if needed
+    - has_header = if True, the first line of text_file is a header and
+      isn't counted, as corebody.create_corebody does (it is still
+      written to trigrams_file, as create_trigrams_file copies it);
+      should match how the single word core body of text_file was made
+    - trigrams_file = if given, the trigram'd texts are also written to
+      this file (as trigrams.create_trigrams_file would), in the same pass
+    - trigram_word_sep = how n-grams are separated in trigrams_file
+    - table_size = if given, dfs are only kept for this many n-grams at a
+      time (see count_top_ngram_dfs), so memory use doesn't grow with the
+      number of distinct n-grams; it should be a good deal bigger than
+      tokens_limit, and only the n-grams left in the table are written to
+      the dfs file
+    - verify = if True (and table_size is given), the texts are read a
+      second time to count the exact dfs of the n-grams in the table
+    - use_sketch = if True (and table_size isn't given), the texts are read
+      twice so that only n-grams that may be in min_docnum docs are
+      counted exactly (see count_sketched_ngram_dfs); the core body is the
+      same, but only n-grams in at least min_docnum docs are written to
+      the dfs file
+    """
+    MOD_LOGGER.info('Received call to "create_trigram_corebody"')
+
+    # every text goes in the trigrams file, so the header is then skipped
+    # after it's written
+    skip_header = has_header and trigrams_file is None
+
+    text_generator = _open_texts(text_file, delimiter, word_sep,
+                                 skip_header, encoding, use_cache)
+
+    if trigrams_file is not None:
+        words_to_compare = tri.make_words_lookup(words_to_compare)
+        text_generator = _write_trigrams_as_read(
+            text_generator, trigrams_file, words_to_compare, method,
+            encoding, trigram_word_sep)
+
+        if has_header:
+            text_generator = itertools.islice(text_generator, 1, None)
+
+    MOD_LOGGER.info('Counting n-gram dfs of cleaned texts...')
+    if table_size is None and use_sketch and min_docnum > 1:
+        recount_corp = _open_texts(text_file, delimiter, word_sep,
+                                   has_header, encoding, use_cache)
+        ngram_dfs = count_sketched_ngram_dfs(text_generator, min_docnum,
+                                             recount_corp, words_to_compare,
+                                             method)
+    elif table_size is None:
+        ngram_dfs = count_ngram_dfs(text_generator, words_to_compare, method)
+    else:
+        verify_corp = None
+        if verify:
+            verify_corp = _open_texts(text_file, delimiter, word_sep,
+                                      has_header, encoding, use_cache)
+        ngram_dfs = count_top_ngram_dfs(text_generator, table_size,
+                                        words_to_compare, method,
+                                        verify_corp)
+
+    if new_filename is None:
+        alldfs_file = text_file[:-4] + '_trigrams_dfs-all.txt'
+    else:
+        alldfs_file = new_filename
+
+    core.write_token_dfs(ngram_dfs.token_dfs(), alldfs_file)
+
+    MOD_LOGGER.info('Wrote dfs of all n-grams to %s', alldfs_file)
+
+    if max_docnum == 0 or max_docnum == 1.0:
+        max_bound = 1.0
+    else:
+        max_bound = float(max_docnum) / ngram_dfs.num_docs
+
+    MOD_LOGGER.info('Filtering core body using: %s',
+        {'min docs': min_docnum, 'max perc': max_bound})
+
+    ngram_dfs = ngram_dfs.filter_extremes(min_docnum, max_bound, tokens_limit)
+
+    # n-grams dropped from the table are in at most max_error docs, so
+    # they can only have been missed if they could have made the cut
+    max_error = ngram_dfs.max_error
+    if max_error and max_error >= min_docnum and (
+            tokens_limit is None or len(ngram_dfs) < tokens_limit
+            or ngram_dfs.dfs.min() <= max_error):
+        MOD_LOGGER.warning('N-grams in up to %s docs may have been left out '
+                           'of the core body; use a bigger table_size to '
+                           'be sure of the top n-grams', max_error)
+
+    return ngram_dfs.to_gensim_dict()
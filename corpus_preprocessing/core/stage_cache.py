@@ -0,0 +1,268 @@
+""" This module contains a cache for the steps (stages) of the text
+processing scripts, so that rerunning a script on unchanged inputs with
+unchanged parameters skips the stages whose results are already known:
+  - a stage's key is a hash of the stage, its code (and the code of the
+    core modules), the contents of its input files and its arguments
+    (leaving out those that only change how it runs, EXECUTION_KWARGS)
+  - the files a stage writes (and the value it returns) are copied into
+    the cache under that key, and copied back out on a hit
+  - the cache is kept under a size limit by evicting the least recently
+    used results
+"""
+
+import gensim as gs
+import numpy as np
+import cPickle
+import glob
+import hashlib
+import inspect
+import json
+import logging
+import os
+import shutil
+import time
+
+MOD_LOGGER = logging.getLogger('text_processing.stage_cache')
+
+# keyword arguments of stages that change how they run (processes, indexes,
+# caches, memory use) but not what they output, so they aren't part of keys
+EXECUTION_KWARGS = frozenset(['num_workers', 'use_index', 'use_cache',
+                              'use_snapshot', 'max_tokens_in_memory',
+                              'spill_dir'])
+
+def _update_hash(hasher, value):
+    """Adds a value to a hashlib object, so that equal values (including
+    numpy arrays and gensim Dictionary objects) always hash the same
+    """
+    if isinstance(value, gs.corpora.Dictionary):
+        hasher.update('Dictionary')
+        _update_hash(hasher, (sorted((token, value.dfs.get(token_id, 0))
+                                     for (token, token_id)
+                                     in value.token2id.iteritems()),
+                              value.num_docs))
+    elif isinstance(value, np.ndarray):
+        if value.dtype == object:
+            _update_hash(hasher, value.tolist())
+        else:
+            hasher.update('ndarray %s %s' % (value.dtype, value.shape))
+            hasher.update(np.ascontiguousarray(value).tostring())
+    elif isinstance(value, dict):
+        hasher.update('dict %s' % len(value))
+        for item in sorted(value.iteritems()):
+            _update_hash(hasher, item)
+    elif isinstance(value, (set, frozenset)):
+        hasher.update('set %s' % len(value))
+        for item in sorted(value):
+            _update_hash(hasher, item)
+    elif isinstance(value, (list, tuple)):
+        hasher.update('%s %s' % (type(value).__name__, len(value)))
+        for item in value:
+            _update_hash(hasher, item)
+    elif isinstance(value, unicode):
+        hasher.update('unicode %s ' % len(value))
+        hasher.update(value.encode('utf-8'))
+    else:
+        hasher.update('%s %r' % (type(value).__name__, value))
+
+def hash_value(value):
+    """Returns the hex sha1 hash of a value (see _update_hash)"""
+    hasher = hashlib.sha1()
+    _update_hash(hasher, value)
+
+    return hasher.hexdigest()
+
+class StageCache(object):
+    """Cache of the files written, and values returned, by the stages of
+    the text processing scripts; see run
+
+    Inputs:
+    - cache_dir = directory to keep cached results in (made if needed)
+    - max_bytes = max total size of cached results; least recently used
+      results are deleted to stay under it
+    """
+    def __init__(self, cache_dir, max_bytes=2**32):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_file = os.path.join(cache_dir, 'index.json')
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.index = {'entries': {}, 'file_hashes': {}}
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'rb') as fo:
+                self.index = json.load(fo)
+
+    def _save_index(self):
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'wb') as fo:
+            json.dump(self.index, fo)
+
+        if os.path.exists(self.index_file):
+            os.remove(self.index_file)
+        os.rename(tmp_file, self.index_file)
+
+    def hash_file(self, file_name, chunk_bytes=2**22):
+        """Returns the hex sha1 hash of a file's contents; hashes are
+        remembered along with the file's size and mtime, so a file is only
+        read again once it changes
+        """
+        file_stat = os.stat(file_name)
+        stamp = [file_stat.st_size, int(file_stat.st_mtime * 10**6)]
+        file_key = os.path.abspath(file_name)
+
+        known = self.index['file_hashes'].get(file_key)
+        if known is not None and known['stamp'] == stamp:
+            return str(known['hash'])
+
+        MOD_LOGGER.info('Hashing %s', file_name)
+
+        hasher = hashlib.sha1()
+        with open(file_name, 'rb') as fo:
+            chunk = fo.read(chunk_bytes)
+            while chunk:
+                hasher.update(chunk)
+                chunk = fo.read(chunk_bytes)
+
+        self.index['file_hashes'][file_key] = {'stamp': stamp,
+                                               'hash': hasher.hexdigest()}
+        self._save_index()
+
+        return hasher.hexdigest()
+
+    def make_key(self, stage, input_files, args, kwargs, code_files=()):
+        """Returns the key of one run of a stage: a hash of the stage name,
+        the contents of its code files and input files, and its arguments
+        (but not those in EXECUTION_KWARGS)
+        """
+        kwargs = dict((name, value) for (name, value) in kwargs.iteritems()
+                      if name not in EXECUTION_KWARGS)
+
+        return hash_value([stage,
+                           [self.hash_file(name) for name in code_files],
+                           [self.hash_file(name) for name in input_files],
+                           list(args), kwargs])
+
+    def _restore(self, key, output_files):
+        entry = self.index['entries'][key]
+        entry_dir = os.path.join(self.cache_dir, key)
+
+        for i, output_file in enumerate(output_files):
+            shutil.copyfile(os.path.join(entry_dir, str(i)), output_file)
+
+        entry['last_used'] = time.time()
+        self._save_index()
+
+        with open(os.path.join(entry_dir, 'value.pkl'), 'rb') as fo:
+            return cPickle.load(fo)
+
+    def store(self, key, output_files, value):
+        """Adds the output files and return value of a stage run to the
+        cache under key (from lookup)
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        if os.path.exists(entry_dir):
+            shutil.rmtree(entry_dir)
+        os.makedirs(entry_dir)
+
+        for i, output_file in enumerate(output_files):
+            shutil.copyfile(output_file, os.path.join(entry_dir, str(i)))
+
+        with open(os.path.join(entry_dir, 'value.pkl'), 'wb') as fo:
+            cPickle.dump(value, fo, cPickle.HIGHEST_PROTOCOL)
+
+        size = sum(os.path.getsize(os.path.join(entry_dir, name))
+                   for name in os.listdir(entry_dir))
+        self.index['entries'][key] = {'size': size, 'last_used': time.time(),
+                                      'num_outputs': len(output_files)}
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Deletes least recently used results until the cache is no
+        bigger than max_bytes (the result with key keep is never deleted)
+        """
+        entries = self.index['entries']
+        total_bytes = sum(entry['size'] for entry in entries.itervalues())
+
+        for key in sorted(entries, key=lambda key: entries[key]['last_used']):
+            if total_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+
+            MOD_LOGGER.info('Evicting cached result %s', key)
+            shutil.rmtree(os.path.join(self.cache_dir, key),
+                          ignore_errors=True)
+            total_bytes -= entries.pop(key)['size']
+
+        self._save_index()
+
+    def lookup(self, stage_func, input_files, output_files, args, kwargs):
+        """Looks for the result of running stage_func(*args, **kwargs);
+        returns (key, True, value) after copying its output files back if
+        it's cached, otherwise (key, False, None), and the result can be
+        added with store(key, output_files, value) once stage_func is run
+        """
+        stage = stage_func.__module__ + '.' + stage_func.__name__
+        key = self.make_key(stage, input_files, args, kwargs,
+                            get_code_files(stage_func))
+
+        entry = self.index['entries'].get(key)
+        if (entry is not None and entry['num_outputs'] == len(output_files)
+                and os.path.isdir(os.path.join(self.cache_dir, key))):
+            MOD_LOGGER.info('Using cached result of %s for %s', stage,
+                            output_files)
+            return key, True, self._restore(key, output_files)
+
+        return key, False, None
+
+    def run(self, stage_func, input_files, output_files, *args, **kwargs):
+        """Runs stage_func(*args, **kwargs), unless it has already been
+        run on the same input file contents with the same arguments, in
+        which case its output files are copied back from the cache instead;
+        returns what stage_func returns
+
+        Inputs:
+        - stage_func = function to run
+        - input_files = names of files stage_func reads (their contents
+          are part of the key)
+        - output_files = names of files stage_func writes
+        - args, kwargs = arguments for stage_func (part of the key, but
+          for EXECUTION_KWARGS)
+        """
+        key, found, value = self.lookup(stage_func, input_files,
+                                        output_files, args, kwargs)
+        if not found:
+            value = stage_func(*args, **kwargs)
+            self.store(key, output_files, value)
+
+        return value
+
+def get_code_files(stage_func):
+    """Returns the source files whose code a stage's results depend on:
+    the file stage_func is defined in, and the core modules (which stages
+    are built on), so that changing any of them invalidates its results
+    """
+    core_dir = os.path.dirname(os.path.abspath(__file__))
+    code_files = sorted(glob.glob(os.path.join(core_dir, '*.py')))
+
+    try:
+        stage_file = inspect.getsourcefile(stage_func)
+    except TypeError:
+        stage_file = None
+    if stage_file is not None and os.path.abspath(stage_file) not in [
+            os.path.abspath(name) for name in code_files]:
+        code_files.append(stage_file)
+
+    return code_files
+
+def run_stage(stage_cache, stage_func, input_files, output_files, *args,
+              **kwargs):
+    """Runs stage_func(*args, **kwargs) through stage_cache (see
+    StageCache.run), or just runs it if stage_cache is None
+    """
+    if stage_cache is None:
+        return stage_func(*args, **kwargs)
+
+    return stage_cache.run(stage_func, input_files, output_files, *args,
+                           **kwargs)
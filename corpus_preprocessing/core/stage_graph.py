@@ -0,0 +1,163 @@
+""" This module contains a small runner for the steps (stages) of the text
+processing scripts, written as a graph of stages where some stages take
+the results of others:
+  - every stage whose inputs are ready is started right away, each in its
+    own process, so independent branches (such as counting target and
+    filter texts) run at the same time
+  - a stage starts as soon as the stages it needs have finished
+  - stages can go through a stage_cache.StageCache, which is only ever
+    used from the main process
+"""
+
+import logging
+import multiprocessing
+import traceback
+
+MOD_LOGGER = logging.getLogger('text_processing.stage_graph')
+
+class StageOutput(object):
+    """Stands in for the result of another stage in the args or kwargs
+    of a Stage
+
+    Inputs:
+    - name = name of the stage whose result is wanted
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return 'StageOutput(%r)' % self.name
+
+class Stage(object):
+    """One stage of a stage graph: func(*args, **kwargs)
+
+    Inputs:
+    - func = function to run (must be importable, to run in another
+      process)
+    - args, kwargs = its arguments; any StageOutput among them is replaced
+      with the result of that stage
+    - input_files = names of files func reads, for the stage cache
+    - output_files = names of files func writes, for the stage cache; if
+      None, the stage is never cached
+    - local = if True, func runs in the main process (for quick stages,
+      whose results aren't worth sending between processes)
+    """
+    def __init__(self, func, args=(), kwargs=None, input_files=(),
+                 output_files=None, local=False):
+        self.func = func
+        self.args = tuple(args)
+        self.kwargs = kwargs or {}
+        self.input_files = list(input_files)
+        self.output_files = output_files
+        self.local = local
+
+    def get_needs(self):
+        """Returns the names of the stages whose results this one needs"""
+        return set(value.name for value in
+                   list(self.args) + self.kwargs.values()
+                   if isinstance(value, StageOutput))
+
+    def get_arguments(self, results):
+        """Returns (args, kwargs) with StageOutputs replaced by results"""
+        def _fill(value):
+            if isinstance(value, StageOutput):
+                return results[value.name]
+            return value
+
+        return ([_fill(value) for value in self.args],
+                dict((key, _fill(value))
+                     for (key, value) in self.kwargs.iteritems()))
+
+def _run_stage_process(name, func, args, kwargs, results_queue):
+    """Runs one stage in a child process, and puts (name, True, result) or
+    (name, False, traceback) on results_queue
+    """
+    try:
+        results_queue.put((name, True, func(*args, **kwargs)))
+    except:
+        results_queue.put((name, False, traceback.format_exc()))
+
+def run_stage_graph(stages, stage_cache=None):
+    """Runs a graph of stages, each as soon as the stages it needs are
+    done, and returns a dict of the result of every stage
+
+    Stages other than local ones run in their own (non-daemonic) process,
+    so they can start worker pools of their own
+
+    Inputs:
+    - stages = dict of stage name: Stage
+    - stage_cache = stage_cache.StageCache to look stages up in before
+      running them, and to add their results to (default is None)
+    """
+    needs = dict((name, stage.get_needs()) for (name, stage)
+                 in stages.iteritems())
+    for name, stage_needs in needs.iteritems():
+        unknown = stage_needs - set(stages)
+        if unknown:
+            raise ValueError('Stage %s needs unknown stages %s' %
+                             (name, sorted(unknown)))
+
+    results = {}
+    running = {}
+    results_queue = multiprocessing.Queue()
+
+    def _finish(name, value):
+        stage, key = stages[name], running.pop(name, (None, None))[1]
+        if key is not None:
+            stage_cache.store(key, stage.output_files, value)
+        results[name] = value
+        MOD_LOGGER.info('Finished stage %s', name)
+
+    try:
+        while len(results) < len(stages):
+            ready = sorted(name for name in stages
+                           if name not in results and name not in running
+                           and needs[name] <= set(results))
+
+            if not ready and not running:
+                raise ValueError('Stages %s need each other' %
+                                 sorted(set(stages) - set(results)))
+
+            for name in ready:
+                stage = stages[name]
+                args, kwargs = stage.get_arguments(results)
+
+                key = None
+                if stage_cache is not None and stage.output_files is not None:
+                    key, found, value = stage_cache.lookup(
+                        stage.func, stage.input_files, stage.output_files,
+                        args, kwargs)
+                    if found:
+                        results[name] = value
+                        continue
+
+                if stage.local:
+                    running[name] = (None, key)
+                    _finish(name, stage.func(*args, **kwargs))
+                    continue
+
+                MOD_LOGGER.info('Starting stage %s', name)
+                process = multiprocessing.Process(
+                    target=_run_stage_process,
+                    args=(name, stage.func, args, kwargs, results_queue))
+                process.start()
+                running[name] = (process, key)
+
+            if ready:
+                # cached and local stages may have made others ready
+                continue
+
+            # results are taken off the queue before the process is
+            # joined, since a process can't exit until its result is read
+            name, succeeded, value = results_queue.get()
+            running[name][0].join()
+            if not succeeded:
+                raise RuntimeError('Stage %s failed:\n%s' % (name, value))
+            _finish(name, value)
+    finally:
+        for process, _ in running.itervalues():
+            if process is not None and process.is_alive():
+                process.terminate()
+                process.join()
+
+    return results
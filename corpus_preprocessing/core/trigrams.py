@@ -3,8 +3,11 @@ text into lists of relevant uni-, bi-, and trigrams
 """
 
 import codecs
+import collections
+import itertools
 import math
-import sys
+import multiprocessing
+import os
 import logging
 import corebody as core
 
@@ -36,6 +39,19 @@ def string_to_words_list(string, word_sep=' '):
 
     return words_list
 
+def make_words_lookup(words_list):
+    """ Compiles a list of words into a frozenset, so that checking
+    whether a word is in it costs O(1) instead of O(len(words_list));
+    compile once and reuse the result for every text you clean
+
+    Inputs:
+    - words_list = list (or any iterable) of words
+    """
+    if isinstance(words_list, frozenset):
+        return words_list
+
+    return frozenset(words_list)
+
 def remove_bad_words(words_list, other_words_list, method="keep"):
     """ Takes a list of (word, word position) tuples, and returns
     a new list of (word, word position) tuples where any word that
@@ -45,29 +61,43 @@ def remove_bad_words(words_list, other_words_list, method="keep"):
     Inputs:
     - words_list = list of (word, word position) tuples from a single text
     - other_words_list = list of words to compare your words_list to, to
-      determine which words to keep
+      determine which words to keep; pass the result of make_words_lookup
+      to avoid compiling it again for every text
     - method = how other_words_list is viewed - if "keep", then
       other_words_list are good words, aka the words to keep; if "remove",
       then other_words_list are bad words, aka words to remove
     """
-    def _is_bad_word(word, words_list, method):
-    	""" For a word, compares it to a word list and returns True if
-    	word is a bad word (method = "keep", word not in words_list; method
-    	= "remove", word in words_list), returns False otherwise
-        """
-    	if method == "remove":
-    		return word in words_list
-    	else:
-    		return word not in words_list
-
-    new_words_list = []
-    for (word, pos) in words_list:
-    	if _is_bad_word(word, other_words_list, method):
-    		continue
-    	else:
-    		new_words_list.append((word, pos))
-
-    return new_words_list
+    words_lookup = make_words_lookup(other_words_list)
+
+    if method == "remove":
+        return [(word, pos) for (word, pos) in words_list
+                if word not in words_lookup]
+    else:
+        return [(word, pos) for (word, pos) in words_list
+                if word in words_lookup]
+
+def iter_multigrams(words_list):
+    """ Takes a list of (word, word position) tuples from a single text, and
+    yields the bi- and trigrams that can be made from it, in one pass
+
+    Two words make a bigram when their positions are n and n+1, and a
+    trigram (middle word shown as '-') when their positions are n and n+2.
+    Since word positions only increase, a word can only pair with the next
+    two words in the list, so the window never holds more than 3 words
+
+    Inputs:
+    - words_list = list of (word, word position) tuples from a single text
+    """
+    for i, (word_1, pos_1) in enumerate(words_list):
+        for (word_2, pos_2) in words_list[i + 1:i + 3]:
+            gap = pos_2 - pos_1
+
+            if gap > 2:
+                break
+            elif gap == 1:
+                yield word_1 + ' ' + word_2
+            elif gap == 2:
+                yield word_1 + ' - ' + word_2
 
 def make_trigrams(words_list):
     """ Takes a list of (word, word position) tuples from a single text, and
@@ -77,63 +107,78 @@ def make_trigrams(words_list):
     Inputs:
     - words_list = list of (word, word position) tuples from a single text
     """
-    # increase python's recursion limit for _check_multigrams (recurses
-    # through every word of a text)
-    sys.setrecursionlimit(100000)
-
-    # add unigrams to trigrams_list first
-    trigrams_list = []
-    for (word, _) in words_list:
-    	trigrams_list.append(word)
-
-    # check word positions to see if can make multigrams,
-    # then add all viable multigrams to trigrams_list
-    bigram = None
-    trigram = None
-    index_last = len(words_list) - 1
-
-    def _check_multigrams(index_1, index_2, count=0):
-        """ Compares indices (word position in text) of two
-        adjacent words to see if they are valid bigrams
-        or trigrams (either indexes are n and n+1, or n and
-        n+2). Depending on the indices, recurses to the next
-        valid starting point (iterates the indices) to check
-        the next pair of words
-        """
-    	word_1 = words_list[min(index_1, index_last)]
-    	word_2 = words_list[min(index_2, index_last)]
-
-    	MOD_LOGGER.debug(
-            'Iteration %s. 1st word %s at pos %s, 2nd word %s at pos %s.',
-            count, word_1[0], word_1[1], word_2[0], word_2[1])
-
-    	if word_1 == word_2:
-            None
-    	else:
-    	    if word_2[1] - word_1[1] > 2:
-    	    	_check_multigrams(index_1 + 1, min(index_1 + 2, index_last),
-                                  count + 1)
-    	    else:
-    	    	if word_2[1] - word_1[1] == 1:
-                    bigram = word_1[0] + ' ' + word_2[0]
-                    trigrams_list.append(bigram)
-    	    	elif word_2[1] - word_1[1] == 2:
-                    trigram = word_1[0] + ' - ' + word_2[0]
-                    trigrams_list.append(trigram)
-
-    	    	if index_2 == index_last:
-                    _check_multigrams(index_1 + 1, index_2, count + 1)
-    	    	else:
-    	    	    _check_multigrams(index_1, index_2 + 1, count + 1)
-
-    _check_multigrams(0, 1)
+    # add unigrams to trigrams_list first, then all viable multigrams
+    trigrams_list = [word for (word, _) in words_list]
+    trigrams_list.extend(iter_multigrams(words_list))
 
     return trigrams_list
 
+def make_trigrams_line(text_id, text, words_to_compare, method="keep",
+                       trigram_word_sep='|'):
+    """ Takes a single text, strips out words you want omitted, and
+    returns the row for the text in a trigrams file (ID, tab, then the
+    text's uni-, bi-, and trigrams separated by trigram_word_sep)
+
+    Inputs:
+    - text_id = ID of the text (None if no IDs)
+    - text = list of words in the text
+    - words_to_compare = make_words_lookup set of words that you either
+      want to keep or remove from the text
+    - method = "keep" or "remove" - indicates whether or not
+      words_to_compare is for keeping or removing
+    - trigram_word_sep = how words will be separated in the row
+    """
+    MOD_LOGGER.debug('Current text: %s', {'id': text_id, 'text': text})
+
+    words_list = [(word, pos) for (pos, word) in enumerate(text)]
+
+    MOD_LOGGER.debug('Words list from text: %s', words_list)
+
+    clean_words_list = remove_bad_words(words_list, words_to_compare,
+                                        method=method)
+
+    MOD_LOGGER.debug('Cleaned words list: %s', clean_words_list)
+
+    if not clean_words_list:
+        # if all words in text were bad words, then write an empty line
+        return str(text_id or '') + '\t' + '\n'
+
+    trigrams = make_trigrams(clean_words_list)
+
+    MOD_LOGGER.debug('Trigrams for current text: %s', trigrams)
+
+    return (str(text_id or '') + '\t' +
+            trigram_word_sep.join(trigrams) + '\n')
+
+# settings shared by the worker processes of create_trigrams_file, set
+# once per worker by _init_trigrams_worker
+_WORKER_SETTINGS = {}
+
+def _init_trigrams_worker(settings):
+    _WORKER_SETTINGS.update(settings)
+
+def _make_trigrams_shard(byte_range):
+    """ Makes the rows of a trigrams file for the texts in one byte range
+    of the original file (runs in a worker process)
+    """
+    settings = _WORKER_SETTINGS
+    shard_generator = core.RawCorpus(settings['original_file'],
+                                     settings['delimiter'],
+                                     settings['word_sep'],
+                                     encoding=settings['encoding'],
+                                     has_header=False,
+                                     byte_range=byte_range)
+
+    return u''.join(
+        make_trigrams_line(text_id, text, settings['words_to_compare'],
+                           settings['method'], settings['trigram_word_sep'])
+        for text_id, text in shard_generator)
+
 def create_trigrams_file(original_file, new_file, words_to_compare,
                          method="keep", delimiter='\t', word_sep='|',
                          has_ids=True, trigram_word_sep='|',
-                         encoding='utf-8'):
+                         encoding='utf-8', num_workers=1,
+                         shard_bytes=2**22):
     """ Takes file of single word texts, strips out
     words you want omitted, then transforms remaining words into
     uni-,bi-,and trigrams, and saves them as a new file
@@ -141,36 +186,23 @@ def create_trigrams_file(original_file, new_file, words_to_compare,
     Inputs:
     - original_file = name of file containing original single word texts
     - new_file = name of new file that will contain trigram versions of texts
-    - words_to_compare = list of words that you either want to keep or
-      remove from texts
+    - words_to_compare = list (or make_words_lookup set) of words that you
+      either want to keep or remove from texts
     - method = "keep" or "remove" - indicates whether or not words_to_compare
       is for keeping or removing
     - word_sep = how words are separated in original_file
     - trigram_word_sep = how words will be separated in new_file
+    - num_workers = number of processes to clean texts and make trigrams
+      in; if > 1, original_file is split into byte ranges of about
+      shard_bytes each, and rows are still written in original order
+    - shard_bytes = approx size of each byte range given to a worker; at
+      most 2 ranges per worker are in progress or waiting to be written
     """
     MOD_LOGGER.info('Received call to "create_trigrams_file"')
 
-    def _list_to_chunks(li, chunk_size):
-    	chunked_list = [
-    	    li[i: i + chunk_size]
-    	    for i in range(0, len(li), chunk_size)
-    	]
-
-    	MOD_LOGGER.debug('List of length %s broken into %s chunks',
-                         len(li), len(chunked_list))
-
-    	return chunked_list
-
-	# use original transcript file (single words) to add trigrams onto;
-	# process and write one text at a time to new trigrams file
-    MOD_LOGGER.info('Making text generator on single word texts')
-
-    transcript_generator = core.RawCorpus(original_file,
-                                          delimiter, word_sep,
-                                          encoding=encoding,
-                                          has_header=False)
+    # compile words to compare once, rather than once per text
+    words_to_compare = make_words_lookup(words_to_compare)
 
-    MOD_LOGGER.info('Text generator created on %s', original_file)
     MOD_LOGGER.info('Cleaning texts and making trigrams...')
     MOD_LOGGER.info(
             'Cleaning method = %s words in given word list (%s words)',
@@ -178,38 +210,66 @@ def create_trigrams_file(original_file, new_file, words_to_compare,
 
     open(new_file, 'w').close()
 
-    with codecs.open(new_file, 'a+', encoding) as fo:
-	    for text_id, text in transcript_generator:
-	    	MOD_LOGGER.debug('Current text: %s', {'id': text_id, 'text': text})
+    if num_workers > 1:
+        _write_trigrams_in_parallel(
+            original_file, new_file, num_workers, shard_bytes,
+            {'original_file': original_file,
+             'words_to_compare': words_to_compare, 'method': method,
+             'delimiter': delimiter, 'word_sep': word_sep,
+             'trigram_word_sep': trigram_word_sep, 'encoding': encoding})
 
-	    	text_string = word_sep.join(text)
+        MOD_LOGGER.info('Saved trigrams to %s', new_file)
+        return
 
-	    	words_list = string_to_words_list(text_string, word_sep)
-
-	    	MOD_LOGGER.debug('Words list from text string: %s', words_list)
-
-	    	clean_words_list = remove_bad_words(words_list, words_to_compare,
-                                                    method=method)
-
-	    	MOD_LOGGER.debug('Cleaned words list: %s', clean_words_list)
-
-	    	if not clean_words_list:
-	    	    # if all words in text were bad words, then write an empty line
-	    	    string_to_write = str(text_id or '') + '\t' + '\n'
-	    	else:
-	    	    clean_words_chunks = _list_to_chunks(clean_words_list, 1000)
-
-	    	    trigrams_list = []
-	    	    for chunk in clean_words_chunks:
-	    	    	trigrams_list.append(make_trigrams(chunk))
-	    	    trigrams = sum(trigrams_list, [])
+    # use original transcript file (single words) to add trigrams onto;
+    # process and write one text at a time to new trigrams file
+    MOD_LOGGER.info('Making text generator on single word texts')
 
-	    	    MOD_LOGGER.debug('Trigrams for current text: %s', trigrams)
+    transcript_generator = core.RawCorpus(original_file,
+                                          delimiter, word_sep,
+                                          encoding=encoding,
+                                          has_header=False)
 
-	    	    string_to_write = (str(text_id or '') + '\t' +
-	    	    	trigram_word_sep.join(trigrams) + '\n')
+    MOD_LOGGER.info('Text generator created on %s', original_file)
 
-	    	fo.write(string_to_write)
+    with codecs.open(new_file, 'a+', encoding) as fo:
+        for text_id, text in transcript_generator:
+            fo.write(make_trigrams_line(text_id, text, words_to_compare,
+                                        method, trigram_word_sep))
 
     MOD_LOGGER.info('Saved trigrams to %s', new_file)
 
+def _write_trigrams_in_parallel(original_file, new_file, num_workers,
+                                shard_bytes, settings):
+    """ Makes trigram rows for byte ranges of original_file in a pool of
+    worker processes, and writes each range's rows to new_file in order;
+    only 2 * num_workers ranges are handed out ahead of the one being
+    written, so memory stays bounded even if one range is slow
+    """
+    num_shards = max(num_workers,
+                     os.path.getsize(original_file) // shard_bytes)
+    byte_ranges = iter(core.get_byte_shards(original_file, num_shards))
+
+    MOD_LOGGER.info('Making trigrams in %s processes over %s byte ranges',
+                    num_workers, num_shards)
+
+    pool = multiprocessing.Pool(num_workers, _init_trigrams_worker,
+                                (settings,))
+    try:
+        pending = collections.deque(
+            pool.apply_async(_make_trigrams_shard, (byte_range,))
+            for byte_range in itertools.islice(byte_ranges, 2 * num_workers))
+
+        with codecs.open(new_file, 'a+', settings['encoding']) as fo:
+            while pending:
+                fo.write(pending.popleft().get())
+
+                for byte_range in itertools.islice(byte_ranges, 1):
+                    pending.append(pool.apply_async(_make_trigrams_shard,
+                                                    (byte_range,)))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
@@ -4,6 +4,14 @@ for running the user input scripts and for culling subsets of a body
 of texts (EX: get a corpus of only the last X words in the texts)
 """
 
+import cPickle
+import heapq
+import multiprocessing
+import os
+import shutil
+import tempfile
+import core.corebody as core
+
 def get_user_input(raw_input_string, func_to_try, exception,
     exception_message, return_func_val=False):
     '''Creates 'while True, try... except' loop for given
@@ -33,41 +41,156 @@ def get_user_input(raw_input_string, func_to_try, exception,
 
     return user_input
 
+class _Reversed(object):
+    """Wraps a sort key so that it sorts in descending order inside a
+    tuple of keys
+    """
+    __slots__ = ['value']
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __ne__(self, other):
+        return self.value != other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __getstate__(self):
+        return (self.value,)
+
+    def __setstate__(self, state):
+        self.value = state[0]
+
+def _write_run(records, run_file, batch_size=10000):
+    """Writes a sorted list of (keys..., line number, line) records to a
+    run file, pickled in batches
+    """
+    with open(run_file, 'wb') as fo:
+        for start in xrange(0, len(records), batch_size):
+            cPickle.dump(records[start:start + batch_size], fo,
+                cPickle.HIGHEST_PROTOCOL)
+
+def _read_run(run_file):
+    """Yields the records of a run file"""
+    with open(run_file, 'rb') as fo:
+        while True:
+            try:
+                records = cPickle.load(fo)
+            except EOFError:
+                break
+            for record in records:
+                yield record
+
+def _replace_file(tmp_file, filename):
+    """Moves tmp_file to filename, replacing it in one step where the OS
+    allows it
+    """
+    try:
+        os.rename(tmp_file, filename)
+    except OSError:
+        # Windows won't rename onto an existing file
+        os.remove(filename)
+        os.rename(tmp_file, filename)
+
 def sort_file(filename, keycol_list, reverse_list, col_sep='\t',
-    has_header=False, transform=lambda x: x):
+    has_header=False, transform=lambda x: x, max_lines=500000,
+    tmp_dir=None):
     """Sorts file in order based on given column indices
     (first column = 0, second = 1, etc.) and whether or not each
-    key should be in ascending/descending order
+    key should be in ascending/descending order; rows with equal keys
+    keep their order
+
+    The file is sorted max_lines rows at a time, spilling each sorted
+    run to a temporary file, and the runs are then merged into a new
+    file that replaces the original, so memory use doesn't grow with
+    the size of the file
 
     Inputs:
     - keycol_list = list of col indices
     - reverse_list = list of True if descending and Fales if ascending, for
       each col in keycol_list
     - col_sep = char that delimits file columns
-    - has_header = if True, skip first line
+    - has_header = if True, first line is kept as the first line
     - transform = function to transform data type of col if need to
       (like str -> int)
+    - max_lines = max number of rows to sort in memory at once
+    - tmp_dir = directory for temporary files; default is the file's
+      own directory
     """
-    with open (filename, 'r+') as fo:
-        if has_header:
-            fo.next()
+    ordering = zip(keycol_list, reverse_list)
+
+    def _sorted_records(lines, first_line_num):
+        # each key is parsed once, into (keys..., line number, line)
+        # records; the line number breaks ties
+        split_lines = [line.split(col_sep) for line in lines]
+        columns = []
+        for col, reverse in ordering:
+            keys = [transform(line_cols[col]) for line_cols in split_lines]
+            if reverse:
+                # numbers are negated, which sorts much faster than
+                # wrapping them
+                if all(isinstance(key, (int, long, float)) for key in keys):
+                    keys = [-key for key in keys]
+                else:
+                    keys = [_Reversed(key) for key in keys]
+            columns.append(keys)
+        del split_lines
+        columns.append(xrange(first_line_num, first_line_num + len(lines)))
+        columns.append(lines)
+
+        records = zip(*columns)
+        records.sort()
+        return records
+
+    if tmp_dir is None:
+        tmp_dir = os.path.dirname(os.path.abspath(filename))
+    work_dir = tempfile.mkdtemp(prefix='sort_', dir=tmp_dir)
+
+    try:
+        run_files = []
+        lines = []
+        num_lines = 0
+        header = None
+
+        with open(filename, 'rb') as fo:
+            if has_header:
+                header = fo.readline()
 
-        data = []
-        for line in fo:
-            data.append(line.split(col_sep))
+            for line in fo:
+                if len(lines) >= max_lines:
+                    run_files.append(os.path.join(work_dir,
+                        'run_%s.pkl' % len(run_files)))
+                    _write_run(_sorted_records(lines, num_lines),
+                        run_files[-1])
+                    num_lines += len(lines)
+                    lines = []
 
-        ordering = zip(keycol_list, reverse_list)
+                if not line.endswith('\n'):
+                    line += '\n'
+                lines.append(line)
 
-        # reverse b/c need to start with secondary sorts first
-        ordering.reverse()
+        records = _sorted_records(lines, num_lines)
+        if run_files:
+            run_files.append(os.path.join(work_dir,
+                'run_%s.pkl' % len(run_files)))
+            _write_run(records, run_files[-1])
+            records = heapq.merge(*[_read_run(run_file)
+                for run_file in run_files])
 
-        for sorting in ordering:
-           data.sort(key=lambda line: (transform(line[sorting[0]])),
-            reverse=sorting[1])
+        sorted_file = os.path.join(work_dir, 'sorted.txt')
+        with open(sorted_file, 'wb') as fo:
+            if header is not None:
+                fo.write(header)
+            for record in records:
+                fo.write(record[-1])
 
-        fo.seek(0)
-        for line in data:
-            fo.write(col_sep.join(line))
+        _replace_file(sorted_file, filename)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
 def get_list_subset(mylist, indices=None, min_index=0,
                     max_index=None):
@@ -103,43 +226,113 @@ def get_list_subset(mylist, indices=None, min_index=0,
 
     return subset
 
-def create_subset_texts(text_file, new_file, col_sep='\t', word_sep='|', 
-                        min_index=0, max_index=None, has_ids=True):
+def _write_subset_rows(rows, fo, col_sep, word_sep, min_index, max_index,
+                       has_ids, num_rows_before=0):
+    """Writes the subset of each row of texts to fo (see
+    create_subset_texts); if texts have no IDs, they are numbered from
+    num_rows_before + 1
+    """
+    if has_ids:
+        text_col, offset_col = 1, 2
+    else:
+        text_col, offset_col = 0, 1
+        textid = num_rows_before
+
+    for row in rows:
+        line = row.split(col_sep)
+        start, end = core.get_offset_bounds(line[offset_col], word_sep,
+            min_index, max_index)
+        # words past the subset aren't split off
+        subset = line[text_col].split(word_sep, end)[start:end]
+
+        if has_ids:
+            textid = line[0]
+        else:
+            textid += 1
+
+        fo.write(str(textid) + '\t' + '|'.join(subset) + '\n')
+
+def _iter_range_lines(fo, byte_range):
+    """Yields the lines of an open file that start within byte_range"""
+    start, end = byte_range
+    fo.seek(start)
+
+    position = start
+    for line in fo:
+        if position >= end:
+            break
+        position += len(line)
+        yield line
+
+def _write_subset_shard(shard_args):
+    """Writes the subsets of the texts in one byte range of a texts file
+    to a part file (runs in a worker process)
+    """
+    (text_file, part_file, byte_range, num_rows_before, col_sep, word_sep,
+     min_index, max_index, has_ids) = shard_args
+
+    with open(text_file, 'rb') as f1, open(part_file, 'w') as f2:
+        _write_subset_rows(_iter_range_lines(f1, byte_range), f2, col_sep,
+            word_sep, min_index, max_index, has_ids, num_rows_before)
+
+def create_subset_texts(text_file, new_file, col_sep='\t', word_sep='|',
+                        min_index=0, max_index=None, has_ids=True,
+                        num_workers=1):
     """ Creates new text file that contains the desired subsets of the
     original texts (EX: only the first 200 words of each text)
+
+    The offsets of each text must be sorted (ascending); the bounds of
+    each subset are found by binary search on them (see
+    corebody.get_offset_bounds), so only a few offsets per text are
+    converted to numbers. With num_workers > 1, the file is split into
+    byte ranges (see corebody.get_byte_shards, using the file's line
+    index) that are subset in parallel and then joined in order
     
     Inputs:
     - text_file = file containing original texts, indices to be used for
       subsetting should be in col to the right of col containing texts
     - new_file = name of new file containing only subsets
-    - col_sep = column separator in text_file, will also be used in new_file
-    - word_sep = word delimiter in text_file, will also be used in new_file
-    - min_index = min cutoff point for getting the subset
+    - col_sep = column separator in text_file
+    - word_sep = word delimiter in text_file
+    - min_index = min cutoff point for getting the subset (if negative,
+      the subset is the last -min_index of each text, as in
+      get_list_subset)
     - max_index = max cutoff point for getting the subset
     - has_ids = if True, IDs are in first col of text_file, otherwise
       texts are in first col
+    - num_workers = number of processes to subset texts in
     """
-    with open(text_file, 'r') as f1, open (new_file, 'w') as f2:
-        if has_ids:
-            text_col, offset_col = 1, 2
-        else:
-            text_col, offset_col = 0, 1
-            textid = 0
+    if num_workers <= 1:
+        with open(text_file, 'r') as f1, open(new_file, 'w') as f2:
+            _write_subset_rows(f1, f2, col_sep, word_sep, min_index,
+                max_index, has_ids)
+        return
 
-        for row in f1:
-            line = row.split(col_sep)
-            word_list = line[text_col].split(word_sep)
-            offset_list = line[offset_col].split(word_sep)
-            offset_list = [float(x) for x in offset_list]
+    line_offsets = core.get_line_offsets(text_file)
+    byte_ranges = core.get_byte_shards(text_file, num_workers, line_offsets)
 
-            subset = get_list_subset(word_list, offset_list, min_index,
-                max_index)
+    work_dir = tempfile.mkdtemp(prefix='subset_',
+        dir=os.path.dirname(os.path.abspath(new_file)))
+    try:
+        shards_args = [
+            (text_file, os.path.join(work_dir, 'part_%s.txt' % i),
+             byte_range, int(line_offsets.searchsorted(byte_range[0])),
+             col_sep, word_sep, min_index, max_index, has_ids)
+            for (i, byte_range) in enumerate(byte_ranges)]
 
-            if has_ids:
-                textid = line[0]
-            else:
-                textid += 1
+        pool = multiprocessing.Pool(min(num_workers, len(shards_args)))
+        try:
+            pool.map(_write_subset_shard, shards_args)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
 
-            new_line = str(textid) + '\t' + '|'.join(subset) + '\n'
-            f2.write(new_line)
-			
+        with open(new_file, 'wb') as f2:
+            for shard_args in shards_args:
+                with open(shard_args[1], 'rb') as part:
+                    shutil.copyfileobj(part, f2)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
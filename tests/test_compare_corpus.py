@@ -3,8 +3,10 @@
 import sys, os
 sys.path.insert(0, os.path.abspath(__file__ + "/../../"))
 import unittest
+import StringIO
 import gensim as gs
 import numpy as np
+from scipy.stats import ttest_ind, fisher_exact, chi2_contingency
 from corpus_preprocessing.core import compare_corpus as mod_ut
 
 class TestGetToken2dfFunc(unittest.TestCase):
@@ -67,6 +69,51 @@ class TestMergeTwoCoresFunc(unittest.TestCase):
 		self.assertEqual(obj_ut, self.merged_core_right)
 
 
+class TestMergeCoresFunc(unittest.TestCase):
+	"""Tests that merge_cores function aligns dfs of N cores correctly"""
+	def setUp(self):
+		"""Defines things used for testing"""
+		self.gs_dict1 = gs.corpora.Dictionary([
+			['a', 'black', 'cat'],
+			['three', 'black', 'cats']])
+		self.core2 = (['dog', 'cat', 'a'], [4, 1, 2])
+		self.core3 = (['a', 'cat', 'zebra'], [7, 3, 1])
+
+	def test_merge_three_outer(self):
+		"""Tests that outer join gives sorted tokens of all three cores"""
+		tokens, dfs = mod_ut.merge_cores(
+			[self.gs_dict1, self.core2, self.core3])
+		self.assertEqual(list(tokens), ['a', 'black', 'cat', 'cats', 'dog',
+			'three', 'zebra'])
+		self.assertEqual(dfs.tolist(), [[1, 2, 7], [2, 0, 0], [1, 1, 3],
+			[1, 0, 0], [0, 4, 0], [1, 0, 0], [0, 0, 1]])
+
+	def test_merge_three_inner(self):
+		"""Tests that inner join keeps only tokens in every core"""
+		tokens, dfs = mod_ut.merge_cores(
+			[self.gs_dict1, self.core2, self.core3], 'inner')
+		self.assertEqual(list(tokens), ['a', 'cat'])
+		self.assertEqual(dfs.tolist(), [[1, 2, 7], [1, 1, 3]])
+
+	def test_merge_right_with_empty_core(self):
+		"""Tests that right join on an empty core gives no tokens, and empty
+		cores give 0 dfs
+		"""
+		tokens, dfs = mod_ut.merge_cores([self.core2, ([], [])], 'right')
+		self.assertEqual(len(tokens), 0)
+		tokens, dfs = mod_ut.merge_cores([self.core2, ([], [])], 'left')
+		self.assertEqual(dfs[:, 1].tolist(), [0, 0, 0])
+
+	def test_arrays_in_generator(self):
+		"""Tests that the pval generator takes merged arrays"""
+		merged = (np.array(['apple', 'cat'], dtype=object),
+			np.array([[10, 1], [5, 19]]))
+		obj_ut = dict(mod_ut.df_ttest_pval_generator(merged, 20, 40))
+		expected = dict(mod_ut.df_ttest_pval_generator(
+			{'apple': [10, 1], 'cat': [5, 19]}, 20, 40))
+		self.assertEqual(obj_ut, expected)
+
+
 class TestMakeBinaryArrayFunc(unittest.TestCase):
 	"""Tests make_binary_array func operates correctly"""
 	def setUp(self):
@@ -106,5 +153,109 @@ class TestDfTtestPvalGeneratorFunc(unittest.TestCase):
 		self.assertFalse('bread' in obj_ut)
 
 
+class TestDfTtestArraysFunc(unittest.TestCase):
+	"""Tests df_ttest_arrays func matches per-token ttests"""
+	def setUp(self):
+		"""Defines things used in testing"""
+		self.dfs_1 = np.array([10, 5, 0, 20, 20, 3, 0])
+		self.dfs_2 = np.array([1, 19, 0, 0, 40, 3, 12])
+
+	def test_same_as_ttest_ind(self):
+		"""Tests that pvals and multipliers match scipy's ttest_ind on
+		binary arrays, including NaN pvals
+		"""
+		multipliers, pvals = mod_ut.df_ttest_arrays(self.dfs_1, self.dfs_2,
+			20, 40)
+		for i in range(len(self.dfs_1)):
+			_, expected = ttest_ind(
+				mod_ut.make_binary_array(self.dfs_1[i], 20),
+				mod_ut.make_binary_array(self.dfs_2[i], 40))
+			if np.isnan(expected):
+				self.assertTrue(np.isnan(pvals[i]))
+			else:
+				self.assertAlmostEqual(pvals[i], expected, places=10)
+			self.assertAlmostEqual(multipliers[i],
+				((self.dfs_1[i] + 0.1) / 20) / ((self.dfs_2[i] + 0.1) / 40))
+
+	def test_generator_skips(self):
+		"""Tests that generator skips NaN pvals and tokens on all docs"""
+		merged_core = {'all': [20, 40], 'none': [0, 0], 'cat': [5, 19]}
+		obj_ut = dict(mod_ut.df_ttest_pval_generator(merged_core, 20, 40,
+			min_num=0))
+		self.assertEqual(list(obj_ut), ['cat'])
+
+
+class TestSigTestsFuncs(unittest.TestCase):
+	"""Tests that the vectorized significance tests match scipy's"""
+	def setUp(self):
+		"""Defines things used in testing"""
+		self.dfs_1 = np.array([10, 5, 1, 20, 0, 3, 0, 7])
+		self.dfs_2 = np.array([1, 19, 0, 0, 40, 3, 12, 14])
+
+	def _tables(self):
+		return [[[df_1, 20 - df_1], [df_2, 40 - df_2]]
+			for df_1, df_2 in zip(self.dfs_1, self.dfs_2)]
+
+	def test_fisher_same_as_scipy(self):
+		"""Tests that Fisher exact pvals match scipy's fisher_exact"""
+		pvals = mod_ut.df_fisher_pvals(self.dfs_1, self.dfs_2, 20, 40)
+		for table, pval in zip(self._tables(), pvals):
+			self.assertAlmostEqual(pval, fisher_exact(table)[1], places=10)
+
+	def test_chi2_same_as_scipy(self):
+		"""Tests that chi-square pvals match scipy without correction"""
+		pvals = mod_ut.df_chi2_pvals(self.dfs_1, self.dfs_2, 20, 40)
+		for table, pval in zip(self._tables(), pvals):
+			expected = chi2_contingency(table, correction=False)[1]
+			self.assertAlmostEqual(pval, expected, places=10)
+
+	def test_loglik_same_as_scipy(self):
+		"""Tests that log-likelihood pvals match scipy's G-test"""
+		pvals = mod_ut.df_loglik_pvals(self.dfs_1, self.dfs_2, 20, 40)
+		for table, pval in zip(self._tables(), pvals):
+			expected = chi2_contingency(table, correction=False,
+				lambda_='log-likelihood')[1]
+			self.assertAlmostEqual(pval, expected, places=10)
+
+	def test_unknown_test(self):
+		"""Tests that an unknown test name raises a ValueError"""
+		self.assertRaises(ValueError, mod_ut.df_test_arrays, self.dfs_1,
+			self.dfs_2, 20, 40, 'ztest')
+
+	def test_generator_uses_test(self):
+		"""Tests that the generator yields pvals of the chosen test"""
+		merged_core = {'apple': [10, 1], 'cat': [5, 19]}
+		obj_ut = dict(mod_ut.df_ttest_pval_generator(merged_core, 20, 40,
+			test='fisher'))
+		self.assertAlmostEqual(obj_ut['apple'],
+			fisher_exact([[10, 10], [1, 39]])[1])
+
+
+class TestWriteDfTtestToFileFunc(unittest.TestCase):
+	"""Tests write_df_ttest_to_file writes the top_k rows sorted"""
+	def setUp(self):
+		"""Defines things used in testing"""
+		rand = np.random.RandomState(0)
+		self.merged_core = dict(('token%03i' % i,
+			[rand.randint(0, 30), rand.randint(0, 20)]) for i in range(200))
+
+	def _write(self, **kwargs):
+		handle = StringIO.StringIO()
+		mod_ut.write_df_ttest_to_file(self.merged_core, 30, 20,
+			handle=handle, min_num=5, **kwargs)
+		return handle.getvalue().splitlines(True)
+
+	def test_top_k_same_as_sorted_rows(self):
+		"""Tests that top_k rows are the first rows of all the rows
+		sorted by pval (asc), df in sample 1 (desc), ties in file order
+		"""
+		rows = self._write()
+		rows.sort(key=lambda row: (float(row.split(',')[1]),
+			-float(row.split(',')[2])))
+		self.assertTrue(len(rows) > 20)
+		self.assertEqual(self._write(top_k=20), rows[:20])
+		self.assertEqual(self._write(top_k=len(rows) + 5), rows)
+
+
 if __name__ == '__main__':
 	unittest.main()
@@ -3,11 +3,16 @@
 import sys, os
 sys.path.insert(0, os.path.abspath(__file__ + "/../../"))
 import unittest
-from mockito import when, mock
+from mockito import when, mock, unstub
 import __builtin__
 import codecs
 import StringIO
+import tempfile
+import shutil
+import random
+import gensim as gs
 from corpus_preprocessing.core import corebody as mod_ut
+from corpus_preprocessing import script_utils
 
 def fake_fo(string_of_fo):
     return StringIO.StringIO(string_of_fo)
@@ -44,11 +49,474 @@ class TestRawCorpusClass(unittest.TestCase):
     	set_mock_codecs_open(self.data_noids)
     	set_mock_codecs_open(self.data_withids)
 
+    def tearDown(self):
+        unstub()
+
     def test_instantiate_raw_corpus(self):
     	"""Tests that RawCorpus instantiates correctly"""
     	obj_ut = mod_ut.RawCorpus(self.data_noids)
     	self.assertIsInstance(obj_ut, mod_ut.RawCorpus)
 
 
+class TestGetByteShardsFunc(unittest.TestCase):
+    """Tests get_byte_shards splits files on line starts"""
+    def setUp(self):
+        """Defines things used in testing"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.tmp_dir, 'texts.txt')
+        self.lines = ['%s\tword%s|other|words\n' % (i, i) for i in range(50)]
+        with open(self.file_name, 'wb') as fo:
+            fo.write(''.join(self.lines))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_ranges_cover_file(self):
+        """Tests that ranges are contiguous and cover the whole file"""
+        obj_ut = mod_ut.get_byte_shards(self.file_name, 7)
+        self.assertEqual(len(obj_ut), 7)
+        self.assertEqual(obj_ut[0][0], 0)
+        self.assertEqual(obj_ut[-1][1], os.path.getsize(self.file_name))
+        for (_, end), (start, _) in zip(obj_ut[:-1], obj_ut[1:]):
+            self.assertEqual(end, start)
+
+    def test_more_shards_than_lines(self):
+        """Tests that no empty ranges are made for tiny files"""
+        obj_ut = mod_ut.get_byte_shards(self.file_name, 500)
+        self.assertEqual(len(obj_ut), 50)
+
+    def test_shards_yield_every_text_once(self):
+        """Tests that RawCorpus over all ranges yields every text once,
+        in order
+        """
+        texts = []
+        for byte_range in mod_ut.get_byte_shards(self.file_name, 7):
+            shard = mod_ut.RawCorpus(self.file_name, has_header=False,
+                                     byte_range=byte_range)
+            shard_texts = list(shard)
+            self.assertEqual(shard.num_docs, len(shard_texts))
+            texts.extend(shard_texts)
+        self.assertEqual(texts, list(mod_ut.RawCorpus(self.file_name,
+                                                      has_header=False)))
+        self.assertEqual(len(texts), 50)
+
+
+class TestLineIndex(unittest.TestCase):
+    """Tests RawCorpus works the same with a sidecar line index"""
+    def setUp(self):
+        """Defines things used in testing"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.tmp_dir, 'texts.txt')
+        self.lines = ['%s\tword%s|other|words\n' % (i, i) for i in range(40)]
+        with open(self.file_name, 'wb') as fo:
+            fo.write('id\ttext\n' + ''.join(self.lines).rstrip('\n'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_index_saved_and_reused(self):
+        """Tests that offsets are saved, reused, and rebuilt once the file
+        changes
+        """
+        offsets = mod_ut.build_line_index(self.file_name, chunk_bytes=16)
+        self.assertEqual(len(offsets), 42)
+        self.assertEqual(offsets[-1], os.path.getsize(self.file_name))
+        self.assertEqual(list(mod_ut.load_line_index(self.file_name)),
+                         list(offsets))
+
+        with open(self.file_name, 'ab') as fo:
+            fo.write('\n40\tmore|words\n')
+        self.assertIsNone(mod_ut.load_line_index(self.file_name))
+        self.assertEqual(len(mod_ut.get_line_offsets(self.file_name)), 43)
+
+    def test_same_as_without_index(self):
+        """Tests that num_docs, texts and shards match the unindexed
+        corpus
+        """
+        plain = mod_ut.RawCorpus(self.file_name)
+        obj_ut = mod_ut.RawCorpus(self.file_name, use_index=True)
+        self.assertEqual(obj_ut.num_docs, plain.num_docs)
+        self.assertEqual(list(obj_ut), list(plain))
+        self.assertEqual(obj_ut.get_shards(6),
+                         mod_ut.get_byte_shards(self.file_name, 6))
+
+        for byte_range in obj_ut.get_shards(6):
+            self.assertEqual(
+                mod_ut.RawCorpus(self.file_name, byte_range=byte_range,
+                                 use_index=True).num_docs,
+                mod_ut.RawCorpus(self.file_name,
+                                 byte_range=byte_range).num_docs)
+
+    def test_get_text(self):
+        """Tests that texts can be read by number"""
+        obj_ut = mod_ut.RawCorpus(self.file_name, use_index=True)
+        self.assertEqual(obj_ut.get_text(0), [u'0', [u'word0', u'other',
+                                                     u'words']])
+        self.assertEqual(obj_ut.get_text(39), list(obj_ut)[-1])
+        self.assertRaises(IndexError, obj_ut.get_text, 40)
+
+
+class TestByteTexts(unittest.TestCase):
+    """Tests RawCorpus splits lines on raw bytes the same as on unicode"""
+    def setUp(self):
+        """Defines things used in testing"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.tmp_dir, 'texts.txt')
+        with open(self.file_name, 'wb') as fo:
+            fo.write(u'id text\r\n1 caf\xe9|au|lait\r\n2 the|caf\xe9\r\n'
+                     u'3 lait\xe9'.encode('cp1252'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_byte_texts_decode_to_texts(self):
+        """Tests that decoded byte texts are the unicode texts"""
+        obj_ut = mod_ut.RawCorpus(self.file_name, ' ', encoding='cp1252')
+        self.assertEqual(
+            [[text_id.decode('cp1252'),
+              [word.decode('cp1252') for word in text]]
+             for (text_id, text) in obj_ut.iter_byte_texts()],
+            list(obj_ut))
+        self.assertEqual(list(obj_ut)[0], [u'1', [u'caf\xe9', u'au',
+                                                  u'lait']])
+
+    def test_count_same_as_gensim(self):
+        """Tests that counting on bytes gives gensim's dfs"""
+        raw_corp = mod_ut.RawCorpus(self.file_name, ' ', encoding='cp1252')
+        expected = gs.corpora.Dictionary(text for (_, text) in raw_corp)
+        token2df, num_docs, _, _ = mod_ut.count_dfs(raw_corp)
+        self.assertEqual(token2df,
+                         dict((token, expected.dfs[token_id]) for
+                              (token, token_id) in expected.token2id.items()))
+        self.assertEqual(num_docs, expected.num_docs)
+
+
+class TestRawCorpusWindow(unittest.TestCase):
+    """Tests RawCorpus yields the same windows of texts as get_list_subset
+    """
+    def setUp(self):
+        """Defines things used in testing"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.tmp_dir, 'texts.txt')
+        self.texts = []
+        for i in range(12):
+            self.texts.append((str(i),
+                               ['w%s' % ((i * j) % 5) for j in range(i + 1)],
+                               [j * 1.5 for j in range(i + 1)]))
+        self._write_texts(True)
+        self.windows = [(0, 4), (-4, None), (2, 7), (3, 3), (0, None),
+                        (20, None)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_texts(self, with_offsets):
+        with open(self.file_name, 'wb') as fo:
+            fo.write('id\ttext\toffsets\n' if with_offsets else 'id\ttext\n')
+            for (text_id, words, offsets) in self.texts:
+                row = [text_id, '|'.join(words)]
+                if with_offsets:
+                    row.append('|'.join('%.1f' % offset
+                                        for offset in offsets))
+                fo.write('\t'.join(row) + '\n')
+
+    def _expected_texts(self, window, window_offsets):
+        return [[unicode(text_id), list(script_utils.get_list_subset(
+                    [unicode(word) for word in words],
+                    offsets if window_offsets else None, *window))]
+                for (text_id, words, offsets) in self.texts]
+
+    def test_same_as_list_subset(self):
+        """Tests that windows of word positions and of offsets are the
+        ones get_list_subset gives, as unicode and as bytes
+        """
+        for window_offsets in [False, True]:
+            self._write_texts(window_offsets)
+
+            for window in self.windows:
+                obj_ut = mod_ut.RawCorpus(self.file_name, window=window,
+                                          window_offsets=window_offsets)
+                expected = self._expected_texts(window, window_offsets)
+                self.assertEqual(list(obj_ut), expected)
+                self.assertEqual(
+                    [[text_id.decode('utf-8'),
+                      [word.decode('utf-8') for word in text]]
+                     for (text_id, text) in obj_ut.iter_byte_texts()],
+                    expected)
+
+    def test_create_corebody_with_window(self):
+        """Tests that create_corebody on a window counts the dfs of the
+        windowed texts, in parallel and spilled to disk too
+        """
+        alldfs_file = os.path.join(self.tmp_dir, 'texts_dfs-all.txt')
+        window = (-6, None)
+        expected = gs.corpora.Dictionary(
+            text for (_, text) in self._expected_texts(window, True))
+
+        for kwargs in [{}, {'num_workers': 3}, {'max_tokens_in_memory': 2}]:
+            obj_ut = mod_ut.create_corebody(self.file_name, alldfs_file,
+                                            window=window,
+                                            window_offsets=True, **kwargs)
+            self.assertEqual(
+                dict((token, obj_ut.dfs[token_id])
+                     for (token, token_id) in obj_ut.token2id.items()),
+                dict((token, expected.dfs[token_id])
+                     for (token, token_id) in expected.token2id.items()))
+            self.assertEqual(obj_ut.num_pos, expected.num_pos)
+
+    def test_window_without_delimiter(self):
+        """Tests that windows are applied to texts without an id column,
+        when counting them too
+        """
+        with open(self.file_name, 'wb') as fo:
+            fo.write('text\n')
+            for (_, words, _) in self.texts:
+                fo.write('|'.join(words) + '\n')
+        alldfs_file = os.path.join(self.tmp_dir, 'texts_dfs-all.txt')
+
+        for window in self.windows:
+            expected = [[None, text] for (_, text) in
+                        self._expected_texts(window, False)]
+            obj_ut = mod_ut.RawCorpus(self.file_name, None, window=window)
+            self.assertEqual(list(obj_ut), expected)
+            self.assertEqual(
+                [[text_id, [word.decode('utf-8') for word in text]]
+                 for (text_id, text) in obj_ut.iter_byte_texts()],
+                expected)
+
+            obj_ut = mod_ut.create_corebody(self.file_name, alldfs_file,
+                                            None, window=window)
+            self.assertEqual(obj_ut.num_pos,
+                             sum(len(text) for (_, text) in expected))
+
+    def test_offsets_window_needs_delimiter(self):
+        """Tests that an offsets window without a delimiter raises a
+        ValueError
+        """
+        self.assertRaises(ValueError, mod_ut.RawCorpus, self.file_name,
+                          None, window=(0, 4), window_offsets=True)
+
+
+class TestCompiledCorpus(unittest.TestCase):
+    """Tests a compiled corpus reads the same as the texts file"""
+    def setUp(self):
+        """Defines things used in testing"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.tmp_dir, 'texts.txt')
+        with open(self.file_name, 'wb') as fo:
+            fo.write('id\ttext\n')
+            for i in range(30):
+                fo.write('%s\tthe|cat|%s|sat|on|the|mat|%s\n' % (i, i % 4,
+                                                               i % 7))
+            fo.write('30\t\n31\tthe|end')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_same_texts_and_dfs(self):
+        """Tests that texts, num_docs and dfs match RawCorpus, with and
+        without a header
+        """
+        for has_header in [True, False]:
+            raw_corp = mod_ut.RawCorpus(self.file_name, has_header=has_header)
+            obj_ut = mod_ut.get_compiled_corpus(self.file_name,
+                                                has_header=has_header)
+            self.assertEqual(list(obj_ut), list(raw_corp))
+            self.assertEqual(obj_ut.num_docs, raw_corp.num_docs)
+            self.assertEqual(obj_ut.count_dfs(chunk_tokens=7),
+                             mod_ut.count_dfs(raw_corp))
+
+    def test_dfs_counted_in_parallel(self):
+        """Tests that counting in several processes gives the same dfs,
+        and the same core body through make_simple_core
+        """
+        for has_header in [True, False]:
+            obj_ut = mod_ut.get_compiled_corpus(self.file_name,
+                                                has_header=has_header)
+            expected = obj_ut.count_dfs()
+            for num_workers in [2, 3, 40]:
+                self.assertEqual(obj_ut.count_dfs(chunk_tokens=7,
+                                                  num_workers=num_workers),
+                                 expected)
+
+            core_body = mod_ut.make_simple_core(obj_ut, num_workers=3)
+            self.assertEqual(
+                dict((token, core_body.dfs[token_id])
+                     for (token, token_id) in core_body.token2id.items()),
+                expected[0])
+
+    def test_recompiled_when_file_changes(self):
+        """Tests that the compiled corpus is reused until the file
+        changes
+        """
+        cache_dir = mod_ut.get_compiled_corpus(self.file_name).cache_dir
+        os.utime(os.path.join(cache_dir, 'meta.json'), (0, 0))
+        mod_ut.get_compiled_corpus(self.file_name, has_header=False)
+        self.assertEqual(
+            os.path.getmtime(os.path.join(cache_dir, 'meta.json')), 0)
+
+        with open(self.file_name, 'ab') as fo:
+            fo.write('\n32\tnew|words')
+        obj_ut = mod_ut.get_compiled_corpus(self.file_name)
+        self.assertNotEqual(
+            os.path.getmtime(os.path.join(cache_dir, 'meta.json')), 0)
+        self.assertEqual(list(obj_ut)[-1], [u'32', [u'new', u'words']])
+
+    def test_create_corebody_same_with_cache(self):
+        """Tests that create_corebody gives the same core body from the
+        compiled corpus
+        """
+        expected = mod_ut.create_corebody(self.file_name, min_docnum=2,
+                                          tokens_limit=8)
+        obj_ut = mod_ut.create_corebody(self.file_name, min_docnum=2,
+                                        tokens_limit=8, use_cache=True)
+        self.assertEqual(
+            dict((token, obj_ut.dfs[token_id])
+                 for (token, token_id) in obj_ut.token2id.items()),
+            dict((token, expected.dfs[token_id])
+                 for (token, token_id) in expected.token2id.items()))
+
+
+class TestMakeSimpleCoreFunc(unittest.TestCase):
+    """Tests make_simple_core counts dfs the same in parallel"""
+    def setUp(self):
+        """Defines things used in testing"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.tmp_dir, 'texts.txt')
+        with open(self.file_name, 'wb') as fo:
+            fo.write('id\ttext\n')
+            for i in range(30):
+                fo.write('%s\tthe|cat|%s|sat|on|the|mat|%s\n' % (i, i % 4,
+                                                               i % 7))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parallel_same_as_serial(self):
+        """Tests that sharded counting gives the same Dictionary as gensim,
+        before and after thresholding
+        """
+        for bounds in [(0, 1.0, None), (5, 0.5, None), (2, 1.0, 5)]:
+            serial = mod_ut.make_simple_core(
+                mod_ut.RawCorpus(self.file_name), *bounds)
+            obj_ut = mod_ut.make_simple_core(
+                mod_ut.RawCorpus(self.file_name), *bounds, num_workers=3)
+            self.assertEqual(
+                dict((token, obj_ut.dfs[token_id])
+                     for (token, token_id) in obj_ut.token2id.items()),
+                dict((token, serial.dfs[token_id])
+                     for (token, token_id) in serial.token2id.items()))
+            self.assertEqual(obj_ut.num_docs, serial.num_docs)
+            self.assertEqual(obj_ut.num_pos, serial.num_pos)
+            self.assertEqual(obj_ut.num_nnz, serial.num_nnz)
+
+
+class TestCreateCorebodySpilled(unittest.TestCase):
+    """Tests create_corebody gives the same results when spilling dfs to
+    disk
+    """
+    def setUp(self):
+        """Defines things used in testing"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.tmp_dir, 'texts.txt')
+        with open(self.file_name, 'wb') as fo:
+            fo.write('id\ttext\n')
+            for i in range(30):
+                fo.write('%s\tthe|cat|%s|sat|on|the|mat|x%s\n' % (i, i % 4,
+                                                                 i % 7))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_same_as_in_memory(self):
+        """Tests that the core body and dfs file match counting in memory,
+        and that nothing is left in the spill directory
+        """
+        expected_file = os.path.join(self.tmp_dir, 'expected_dfs-all.txt')
+        alldfs_file = os.path.join(self.tmp_dir, 'texts_dfs-all.txt')
+
+        for thresholds in [(0, 1.0, None), (5, 20, None), (2, 0, 5)]:
+            expected = mod_ut.create_corebody(self.file_name, expected_file,
+                                              '\t', '|', *thresholds)
+            obj_ut = mod_ut.create_corebody(self.file_name, alldfs_file,
+                                            '\t', '|', *thresholds,
+                                            max_tokens_in_memory=4)
+            self.assertEqual(
+                dict((token, obj_ut.dfs[token_id])
+                     for (token, token_id) in obj_ut.token2id.items()),
+                dict((token, expected.dfs[token_id])
+                     for (token, token_id) in expected.token2id.items()))
+            self.assertEqual(obj_ut.num_docs, expected.num_docs)
+            self.assertEqual(obj_ut.num_pos, expected.num_pos)
+            self.assertEqual(obj_ut.num_nnz, expected.num_nnz)
+            with open(alldfs_file, 'rb') as fo, \
+                    open(expected_file, 'rb') as expected_fo:
+                self.assertEqual(fo.read(), expected_fo.read())
+
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+                         ['expected_dfs-all.txt', 'texts.txt',
+                          'texts_dfs-all.txt'])
+
+    def test_same_with_ties_at_tokens_limit(self):
+        """Tests that the same tokens are kept when tokens_limit cuts
+        through tied dfs
+        """
+        rand = random.Random(0)
+        with open(self.file_name, 'wb') as fo:
+            fo.write('id\ttext\n')
+            for i in range(300):
+                fo.write('%s\t%s\n' % (i, '|'.join(
+                    'w%s' % rand.randint(0, 2999) for _ in range(20))))
+        alldfs_file = os.path.join(self.tmp_dir, 'texts_dfs-all.txt')
+
+        for tokens_limit in [5, 20, 50, 100, 200, 400]:
+            expected = mod_ut.create_corebody(self.file_name, alldfs_file,
+                                              tokens_limit=tokens_limit)
+            obj_ut = mod_ut.create_corebody(self.file_name, alldfs_file,
+                                            tokens_limit=tokens_limit,
+                                            max_tokens_in_memory=100)
+            self.assertEqual(len(obj_ut), tokens_limit)
+            self.assertEqual(obj_ut.token2id, expected.token2id)
+
+
+class TestWriteDfsToFileFunc(unittest.TestCase):
+    """Tests write_dfs_to_file writes dfs in one pass"""
+    def setUp(self):
+        """Defines things used in testing"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.tmp_dir, 'dfs.txt')
+        self.gs_dict = gs.corpora.Dictionary([
+            ['a', 'black', 'cat'],
+            ['three', 'black', 'cats'],
+            ['a', 'black', 'dog']])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _read_file(self):
+        with open(self.file_name) as fo:
+            return fo.read()
+
+    def test_write_sorted_by_token(self):
+        """Tests that header and rows sorted by token are written"""
+        mod_ut.write_dfs_to_file(self.gs_dict, self.file_name)
+        self.assertEqual(self._read_file(),
+                         'token doc_freq\na 2\nblack 3\ncat 1\ncats 1\n'
+                         'dog 1\nthree 1\n')
+
+    def test_write_sorted_by_df_without_changing_dict(self):
+        """Tests that rows can be sorted by df, and that removing ids
+        doesn't change the dictionary
+        """
+        token2id = dict(self.gs_dict.token2id)
+        mod_ut.write_dfs_to_file(self.gs_dict, self.file_name,
+                                 ids_remove=[token2id['three']],
+                                 sort_by_df=True)
+        self.assertEqual(self._read_file(),
+                         'token doc_freq\nblack 3\na 2\ncat 1\ncats 1\n'
+                         'dog 1\n')
+        self.assertEqual(self.gs_dict.token2id, token2id)
+
+
 if __name__ == "__main__":
     unittest.main()
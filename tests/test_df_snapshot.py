@@ -0,0 +1,172 @@
+"""Tests for the df_snapshot module"""
+
+import sys, os
+sys.path.insert(0, os.path.abspath(__file__ + "/../../"))
+import unittest
+import tempfile
+import shutil
+from corpus_preprocessing.core import df_snapshot as mod_ut
+from corpus_preprocessing.core import corebody
+from corpus_preprocessing.core import compare_corpus
+
+class TestDfSnapshotClass(unittest.TestCase):
+    """Tests DfSnapshot merges, saves and loads dfs"""
+    def setUp(self):
+        """Defines things used in testing"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.snapshot_1 = mod_ut.make_snapshot({u'cat': 2, u'dog': 1}, 3, 9,
+                                               3)
+        self.snapshot_2 = mod_ut.make_snapshot({u'cat': 1, u'eel': 4}, 4, 8,
+                                               5)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_merge(self):
+        """Tests that merging adds up dfs and totals"""
+        obj_ut = self.snapshot_1.merge(self.snapshot_2)
+        self.assertEqual(obj_ut.token_dfs(),
+                         [(u'cat', 3), (u'dog', 1), (u'eel', 4)])
+        self.assertEqual((obj_ut.num_docs, obj_ut.num_pos, obj_ut.num_nnz),
+                         (7, 17, 8))
+
+    def test_save_and_load(self):
+        """Tests that a loaded snapshot is the same as the one saved"""
+        snapshot_dir = os.path.join(self.tmp_dir, 'snapshot')
+        self.snapshot_1.save(snapshot_dir)
+        obj_ut = mod_ut.load_snapshot(snapshot_dir)
+        self.assertEqual(obj_ut.token_dfs(), self.snapshot_1.token_dfs())
+        self.assertEqual(obj_ut.num_docs, 3)
+
+    def test_merge_cores(self):
+        """Tests that snapshots can be merged like core bodies"""
+        tokens, dfs = compare_corpus.merge_cores([self.snapshot_1,
+                                                  self.snapshot_2])
+        self.assertEqual(tokens.tolist(), [u'cat', u'dog', u'eel'])
+        self.assertEqual(dfs.tolist(), [[2, 1], [1, 0], [0, 4]])
+
+
+class TestUpdateSnapshotFunc(unittest.TestCase):
+    """Tests update_snapshot only counts texts added to a file"""
+    def setUp(self):
+        """Defines things used in testing"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.text_file = os.path.join(self.tmp_dir, 'texts.txt')
+        with open(self.text_file, 'wb') as fo:
+            fo.write('id\ttext\n1\ta|black|cat\n2\ta|black|dog\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _expected_token2df(self, **kwargs):
+        return compare_corpus.get_token2df(corebody.create_corebody(
+            self.text_file, os.path.join(self.tmp_dir, 'expected.txt'),
+            **kwargs))
+
+    def _num_texts(self):
+        with open(self.text_file, 'rb') as fo:
+            return len(fo.readlines()) - 1
+
+    def test_appended_texts_counted(self):
+        """Tests that updating after texts are appended gives the same
+        dfs as counting the whole file, and counts only the new texts
+        """
+        mod_ut.update_snapshot(self.text_file)
+        with open(self.text_file, 'ab') as fo:
+            fo.write('3\tthree|black|cats\n')
+
+        obj_ut = mod_ut.update_snapshot(self.text_file)
+        self.assertEqual(dict(obj_ut.token_dfs()), self._expected_token2df())
+        self.assertEqual(obj_ut.num_docs, 3)
+        self.assertEqual(obj_ut.num_pos, 9)
+
+        saved = mod_ut.load_snapshot(mod_ut.get_snapshot_name(self.text_file))
+        self.assertEqual(saved.token_dfs(), obj_ut.token_dfs())
+
+    def test_recounted_when_counted_texts_edited(self):
+        """Tests that a file whose counted texts were edited is counted
+        again, even if it got bigger
+        """
+        mod_ut.update_snapshot(self.text_file)
+        with open(self.text_file, 'r+b') as fo:
+            fo.seek(len('id\ttext\n1\ta|'))
+            fo.write('brown')
+            fo.seek(0, 2)
+            fo.write('4\ta|cat\n')
+
+        obj_ut = mod_ut.update_snapshot(self.text_file)
+        self.assertEqual(dict(obj_ut.token_dfs()), self._expected_token2df())
+
+        with open(self.text_file, 'wb') as fo:
+            fo.write('id\ttext\n' + '1\tzzzz|b\n' * 5)
+        mod_ut.update_snapshot(self.text_file)
+        with open(self.text_file, 'wb') as fo:
+            fo.write('id\ttext\n' + '1\tzzzzzz|b\n' * 5)
+
+        obj_ut = mod_ut.update_snapshot(self.text_file)
+        self.assertEqual(dict(obj_ut.token_dfs()), {u'zzzzzz': 5, u'b': 5})
+
+    def test_counted_in_other_ways(self):
+        """Tests that counting in parallel or from the compiled corpus
+        gives the same snapshot, for the whole file and for appended texts
+        """
+        for count_kwargs in [{'num_workers': 2}, {'use_cache': True}]:
+            snapshot_dir = os.path.join(self.tmp_dir, 'snapshot')
+            obj_ut = mod_ut.update_snapshot(self.text_file,
+                                            snapshot_dir=snapshot_dir,
+                                            **count_kwargs)
+            self.assertEqual(dict(obj_ut.token_dfs()),
+                             self._expected_token2df())
+            with open(self.text_file, 'ab') as fo:
+                fo.write('3\tthree|black|cats\n4\ta|dog\n')
+
+            obj_ut = mod_ut.update_snapshot(self.text_file,
+                                            snapshot_dir=snapshot_dir,
+                                            **count_kwargs)
+            self.assertEqual(dict(obj_ut.token_dfs()),
+                             self._expected_token2df())
+            self.assertEqual(obj_ut.num_docs, self._num_texts())
+
+    def test_recounted_when_file_replaced(self):
+        """Tests that a file that got smaller is counted again"""
+        mod_ut.update_snapshot(self.text_file)
+        with open(self.text_file, 'wb') as fo:
+            fo.write('id\ttext\n1\ta|cat\n')
+
+        obj_ut = mod_ut.update_snapshot(self.text_file)
+        self.assertEqual(dict(obj_ut.token_dfs()), {u'a': 1, u'cat': 1})
+        self.assertEqual(obj_ut.num_docs, 1)
+
+    def test_create_snapshot_corebody(self):
+        """Tests that the core body and dfs file are the same as
+        create_corebody's
+        """
+        alldfs_file = os.path.join(self.tmp_dir, 'texts_dfs-all.txt')
+        obj_ut = mod_ut.create_snapshot_corebody(self.text_file,
+                                                 min_docnum=2)
+        self.assertEqual(dict(obj_ut.token_dfs()),
+                         self._expected_token2df(min_docnum=2))
+        with open(alldfs_file, 'rb') as fo, \
+                open(os.path.join(self.tmp_dir, 'expected.txt'),
+                     'rb') as expected_fo:
+            self.assertEqual(fo.read(), expected_fo.read())
+
+    def test_max_tokens_in_memory_refused(self):
+        """Tests that a memory budget raises a ValueError, as snapshots
+        are held in memory
+        """
+        self.assertRaises(ValueError, mod_ut.create_snapshot_corebody,
+                          self.text_file, max_tokens_in_memory=2)
+
+    def test_window_refused(self):
+        """Tests that a window raises a ValueError, as snapshots are of
+        whole texts
+        """
+        self.assertRaises(ValueError, mod_ut.create_snapshot_corebody,
+                          self.text_file, window=(0, 2))
+        self.assertFalse(os.path.exists(
+            mod_ut.get_snapshot_name(self.text_file)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+"""Tests for the df_table module"""
+
+import sys, os
+sys.path.insert(0, os.path.abspath(__file__ + "/../../"))
+import unittest
+import tempfile
+import shutil
+import numpy as np
+from corpus_preprocessing.core import df_table as mod_ut
+from corpus_preprocessing.core import compare_corpus
+from corpus_preprocessing import script_utils
+
+class TestDfTableClass(unittest.TestCase):
+    """Tests that querying a DfTable gives the same rows as writing and
+    sorting the df-ttest file
+    """
+    def setUp(self):
+        """Defines things used in testing"""
+        self.tmp_dir = tempfile.mkdtemp()
+        rand = np.random.RandomState(0)
+        tokens = np.array([u'token%03i' % i for i in range(300)],
+                          dtype=object)
+        dfs = np.column_stack((rand.randint(0, 60, 300),
+                               rand.randint(0, 40, 300)))
+        dfs[0] = [60, 40]
+        self.merged_core = (tokens, dfs)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _expected_rows(self, *thresholds):
+        ttest_file = os.path.join(self.tmp_dir, 'expected.txt')
+        compare_corpus.write_df_ttest_to_file(self.merged_core, 60, 40,
+                                              ttest_file, *thresholds)
+        script_utils.sort_file(ttest_file, [1, 2], [False, True],
+                               col_sep=',', transform=lambda x: float(x))
+        with open(ttest_file, 'rb') as fo:
+            return fo.read()
+
+    def test_same_as_sorted_file(self):
+        """Tests that queries of a saved and loaded table match the sorted
+        df-ttest file, whichever index they use
+        """
+        table_dir = os.path.join(self.tmp_dir, 'table')
+        mod_ut.make_df_table(self.merged_core, 60, 40, table_dir)
+        obj_ut = mod_ut.load_df_table(table_dir)
+        query_file = os.path.join(self.tmp_dir, 'query.txt')
+
+        for thresholds in [(10, 0, 1), (0, 1.5, 0.25), (90, 0, 1),
+                           (20, 2, 0.01)]:
+            obj_ut.write_query(query_file, *thresholds)
+            with open(query_file, 'rb') as fo:
+                self.assertEqual(fo.read(), self._expected_rows(*thresholds))
+
+    def test_max_num_and_rows(self):
+        """Tests that max_num and max_rows cut down the rows returned"""
+        obj_ut = mod_ut.make_df_table(self.merged_core, 60, 40)
+        rows = obj_ut.query(10, max_num=50)
+        self.assertTrue(rows)
+        self.assertTrue(all(df_1 + df_2 <= 50 for (_, _, df_1, df_2) in rows))
+        self.assertEqual(obj_ut.query(10, max_num=50, max_rows=3), rows[:3])
+
+
+if __name__ == '__main__':
+    unittest.main()
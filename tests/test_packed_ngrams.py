@@ -0,0 +1,281 @@
+"""Tests for the packed_ngrams module"""
+
+import sys, os
+sys.path.insert(0, os.path.abspath(__file__ + "/../../"))
+import unittest
+import tempfile
+import shutil
+import numpy as np
+from corpus_preprocessing.core import packed_ngrams as mod_ut
+from corpus_preprocessing.core import trigrams
+from corpus_preprocessing.core import corebody
+from corpus_preprocessing.core import compare_corpus
+
+class TestPackNgramsFunc(unittest.TestCase):
+    """Tests that pack_ngrams and unpack_ngrams round trip correctly"""
+    def test_round_trip(self):
+        """Tests that unpacking packed n-grams gives back kinds and ids"""
+        codes = np.concatenate([
+            mod_ut.pack_ngrams(mod_ut.UNIGRAM, [0, 5]),
+            mod_ut.pack_ngrams(mod_ut.TRIGRAM, [7], [mod_ut.ID_MASK])])
+        kinds, ids_1, ids_2 = mod_ut.unpack_ngrams(codes)
+        self.assertEqual(list(kinds), [0, 0, 2])
+        self.assertEqual(list(ids_1), [0, 5, 7])
+        self.assertEqual(list(ids_2), [0, 0, mod_ut.ID_MASK])
+
+
+class TestMakeNgramCodesFunc(unittest.TestCase):
+    """Tests that make_ngram_codes makes the same n-grams as make_trigrams"""
+    def test_same_as_make_trigrams(self):
+        """Tests that decoded n-grams match make_trigrams for spaced words"""
+        words_list = [('most', 0), ('sleep', 3), ('during', 4), ('next', 6),
+                      ('day', 7), ('long', 8)]
+        word_ids = np.arange(len(words_list))
+        positions = np.array([pos for (_, pos) in words_list])
+        codes = mod_ut.make_ngram_codes(word_ids, positions)
+        ngram_dfs = mod_ut.NgramDfs(codes, np.ones(len(codes)),
+                                    [word for (word, _) in words_list], 1)
+        self.assertEqual(sorted(ngram_dfs.tokens()),
+                         sorted(trigrams.make_trigrams(words_list)))
+
+
+class TestCountNgramDfsFunc(unittest.TestCase):
+    """Tests that count_ngram_dfs counts the same dfs as the trigrams file
+    route
+    """
+    def setUp(self):
+        """Defines things used in testing"""
+        self.texts = [
+            [u'1', u'most cats sleep during the day'.split()],
+            [u'2', u'the cats sleep in the day'.split()],
+            [u'3', u'most dogs never sleep'.split()],
+            [u'4', u'the the the'.split()]]
+        self.bad_words = [u'the', u'in']
+
+    def test_same_dfs_as_trigrams_route(self):
+        """Tests that dfs match making trigrams then counting them"""
+        expected = {}
+        for _, text in self.texts:
+            words_list = trigrams.remove_bad_words(
+                trigrams.string_to_words_list(u' '.join(text)),
+                self.bad_words, 'remove')
+            for token in set(trigrams.make_trigrams(words_list)):
+                expected[token] = expected.get(token, 0) + 1
+
+        obj_ut = mod_ut.count_ngram_dfs(self.texts, self.bad_words, 'remove',
+                                        batch_size=3)
+        self.assertEqual(dict(obj_ut.token_dfs()), expected)
+        self.assertEqual(obj_ut.num_docs, 4)
+
+    def test_filter_extremes(self):
+        """Tests that thresholding keeps only n-grams within bounds"""
+        obj_ut = mod_ut.count_ngram_dfs(self.texts, self.bad_words, 'remove')
+        obj_ut = obj_ut.filter_extremes(2, 0.5)
+        self.assertEqual(dict(obj_ut.token_dfs()),
+                         {u'cats': 2, u'cats sleep': 2, u'day': 2,
+                          u'most': 2})
+
+    def test_restrict_to_words(self):
+        """Tests that counting with more words then restricting to fewer
+        gives the same dfs as counting with fewer words
+        """
+        all_words = [u'most', u'cats', u'sleep', u'day', u'dogs']
+        some_words = [u'cats', u'sleep', u'day']
+        expected = mod_ut.count_ngram_dfs(self.texts, some_words)
+        obj_ut = mod_ut.count_ngram_dfs(self.texts, all_words)
+        obj_ut = obj_ut.restrict_to_words(some_words)
+        self.assertEqual(dict(obj_ut.token_dfs()),
+                         dict(expected.token_dfs()))
+        self.assertEqual(obj_ut.num_docs, expected.num_docs)
+
+
+class TestCountTopNgramDfsFunc(unittest.TestCase):
+    """Tests that count_top_ngram_dfs finds the n-grams in the most docs
+    with a small table
+    """
+    def setUp(self):
+        """Defines things used in testing"""
+        rand = np.random.RandomState(0)
+        words = [u'w%s' % i for i in range(40)]
+        # word i is picked about twice as often as word i + 1
+        probs = 0.5 ** np.arange(len(words))
+        probs /= probs.sum()
+        self.texts = [[unicode(i), [words[j] for j in
+                                    rand.choice(len(words), 6, p=probs)]]
+                      for i in range(200)]
+        self.expected = mod_ut.count_ngram_dfs(self.texts)
+
+    def test_dfs_within_max_error(self):
+        """Tests that dfs are undercounted by no more than max_error, and
+        that n-grams left out are in no more than max_error docs
+        """
+        expected = dict(self.expected.token_dfs())
+        obj_ut = mod_ut.count_top_ngram_dfs(self.texts, 20, batch_size=50)
+        self.assertTrue(len(obj_ut) <= 20)
+        self.assertTrue(obj_ut.max_error > 0)
+        self.assertEqual(obj_ut.num_docs, 200)
+
+        token_dfs = dict(obj_ut.token_dfs())
+        for token, df in expected.iteritems():
+            if token in token_dfs:
+                self.assertTrue(df - obj_ut.max_error <= token_dfs[token]
+                                <= df)
+            else:
+                self.assertTrue(df <= obj_ut.max_error)
+
+    def test_verified_top_ngrams(self):
+        """Tests that the verified top n-grams match exact counting"""
+        obj_ut = mod_ut.count_top_ngram_dfs(self.texts, 50, batch_size=50,
+                                            verify_corp=self.texts)
+        expected = dict(self.expected.filter_extremes(keep_n=5).token_dfs())
+        obj_ut = obj_ut.filter_extremes(keep_n=5)
+        self.assertTrue(obj_ut.dfs.min() > obj_ut.max_error)
+        self.assertEqual(dict(obj_ut.token_dfs()), expected)
+
+
+class TestCountSketchedNgramDfsFunc(unittest.TestCase):
+    """Tests that count_sketched_ngram_dfs keeps the same n-grams as
+    exact counting
+    """
+    def test_same_as_exact(self):
+        """Tests that a sketch small enough to have collisions still keeps
+        exactly the n-grams in at least min_df docs
+        """
+        rand = np.random.RandomState(0)
+        words = [u'w%s' % i for i in range(30)]
+        texts = [[unicode(i), [words[j] for j in rand.randint(0, 30, 5)]]
+                 for i in range(100)]
+        expected = mod_ut.count_ngram_dfs(texts).filter_extremes(3)
+
+        obj_ut = mod_ut.count_sketched_ngram_dfs(texts, 3, texts,
+                                                 sketch_bits=6,
+                                                 batch_size=40)
+        self.assertEqual(dict(obj_ut.token_dfs()),
+                         dict(expected.token_dfs()))
+        self.assertEqual(obj_ut.num_docs, expected.num_docs)
+        self.assertEqual(obj_ut.num_pos, expected.num_pos)
+
+    def test_estimates_not_below_dfs(self):
+        """Tests that DfSketch never estimates a df below its true df"""
+        codes = np.array([5, 7, 5, 2**61 + 3, 5, 7], dtype=np.int64)
+        obj_ut = mod_ut.DfSketch(bits=1, depth=2)
+        obj_ut.add(codes)
+        estimates = obj_ut.estimate(np.array([5, 7, 2**61 + 3]))
+        self.assertTrue(all(estimates >= [3, 2, 1]))
+        self.assertTrue(all(estimates <= len(codes)))
+
+
+class TestCreateTrigramCorebodyFunc(unittest.TestCase):
+    """Tests that create_trigram_corebody matches create_trigrams_file
+    followed by counting the trigrams file
+    """
+    def setUp(self):
+        """Defines things used in testing"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.text_file = os.path.join(self.tmp_dir, 'texts.txt')
+        with open(self.text_file, 'w') as fo:
+            fo.write('1\tmost|cats|sleep|during|the|day\n'
+                     '2\tthe|cats|sleep|in|the|day\n'
+                     '3\tmost|dogs|never|sleep\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_same_as_trigrams_file(self):
+        """Tests that the core body and dfs-all file match the file route"""
+        trigrams_file = os.path.join(self.tmp_dir, 'texts_trigrams.txt')
+        trigrams.create_trigrams_file(self.text_file, trigrams_file,
+                                      [u'the', u'in'], method='remove')
+        expected = corebody.make_simple_core(corebody.RawCorpus(
+            trigrams_file, has_header=False))
+
+        obj_ut = mod_ut.create_trigram_corebody(
+            self.text_file, [u'the', u'in'], method='remove')
+        self.assertEqual(compare_corpus.get_token2df(obj_ut),
+                         compare_corpus.get_token2df(expected))
+        self.assertEqual(obj_ut.num_docs, expected.num_docs)
+
+        alldfs_file = os.path.join(self.tmp_dir,
+                                   'texts_trigrams_dfs-all.txt')
+        self.assertTrue(os.path.exists(alldfs_file))
+        with open(alldfs_file) as fo:
+            self.assertEqual(fo.readline(), 'token doc_freq\n')
+            self.assertTrue('cats sleep 2\n' in fo.readlines())
+
+    def test_fused_same_as_file_route(self):
+        """Tests that counting with has_header and writing the trigrams
+        file in the same pass matches create_trigrams_file followed by
+        create_corebody
+        """
+        expected_file = os.path.join(self.tmp_dir, 'expected_trigrams.txt')
+        trigrams.create_trigrams_file(self.text_file, expected_file,
+                                      [u'the', u'in'], method='remove')
+        expected = corebody.create_corebody(expected_file, tokens_limit=1)
+
+        trigrams_file = os.path.join(self.tmp_dir, 'texts_trigrams.txt')
+        obj_ut = mod_ut.create_trigram_corebody(
+            self.text_file, [u'the', u'in'], method='remove',
+            tokens_limit=1, has_header=True, trigrams_file=trigrams_file)
+        self.assertEqual(compare_corpus.get_token2df(obj_ut),
+                         compare_corpus.get_token2df(expected))
+        with open(trigrams_file) as fo, open(expected_file) as expected_fo:
+            self.assertEqual(fo.read(), expected_fo.read())
+
+    def test_header_skipped_like_words(self):
+        """Tests that with has_header, the trigram core body is counted over
+        the same texts as the single word core body of a file with a header
+        """
+        header_file = os.path.join(self.tmp_dir, 'header.txt')
+        with open(self.text_file) as fi, open(header_file, 'w') as fo:
+            fo.write('id\ttext\n' + fi.read())
+        words = corebody.create_corebody(header_file)
+
+        for use_cache in [False, True]:
+            obj_ut = mod_ut.create_trigram_corebody(
+                header_file, [u'the', u'in'], method='remove',
+                has_header=True, use_cache=use_cache)
+            self.assertEqual(obj_ut.num_docs, words.num_docs)
+            self.assertEqual(obj_ut.num_docs, 3)
+            self.assertFalse(u'text' in obj_ut.token2id)
+
+    def test_same_with_cache(self):
+        """Tests that counting from the compiled corpus gives the same
+        core body
+        """
+        expected = mod_ut.create_trigram_corebody(
+            self.text_file, [u'the', u'in'], method='remove')
+        obj_ut = mod_ut.create_trigram_corebody(
+            self.text_file, [u'the', u'in'], method='remove', use_cache=True)
+        self.assertEqual(compare_corpus.get_token2df(obj_ut),
+                         compare_corpus.get_token2df(expected))
+        self.assertEqual(obj_ut.num_docs, expected.num_docs)
+
+    def test_same_with_table(self):
+        """Tests that counting the top n-grams in a table gives the same
+        core body
+        """
+        expected = mod_ut.create_trigram_corebody(
+            self.text_file, [u'the', u'in'], method='remove',
+            tokens_limit=1)
+        obj_ut = mod_ut.create_trigram_corebody(
+            self.text_file, [u'the', u'in'], method='remove',
+            tokens_limit=1, table_size=4)
+        self.assertEqual(compare_corpus.get_token2df(obj_ut),
+                         compare_corpus.get_token2df(expected))
+
+    def test_same_with_sketch(self):
+        """Tests that pruning rare n-grams with a sketch gives the same
+        core body
+        """
+        expected = mod_ut.create_trigram_corebody(
+            self.text_file, [u'the', u'in'], method='remove', min_docnum=2)
+        obj_ut = mod_ut.create_trigram_corebody(
+            self.text_file, [u'the', u'in'], method='remove', min_docnum=2,
+            use_sketch=True)
+        self.assertEqual(compare_corpus.get_token2df(obj_ut),
+                         compare_corpus.get_token2df(expected))
+        self.assertEqual(obj_ut.num_pos, expected.num_pos)
+
+
+if __name__ == '__main__':
+    unittest.main()
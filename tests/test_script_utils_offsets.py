@@ -3,7 +3,10 @@
 import sys, os
 sys.path.insert(0, os.path.abspath(__file__ + "/../../"))
 import unittest
+import tempfile
+import shutil
 from corpus_preprocessing import script_utils as off
+from corpus_preprocessing.core import corebody
 
 class TestGetSubsetFunc(unittest.TestCase):
     """Tests that get_subset func works properly"""
@@ -41,5 +44,88 @@ class TestGetSubsetFunc(unittest.TestCase):
             min_index=-4)
         self.assertEqual(list(obj_ut), self.wordlist1[3:])
 
+class TestGetSubsetBoundsFunc(unittest.TestCase):
+    """Tests that get_subset_bounds finds the same subsets as
+    get_list_subset
+    """
+    def test_same_as_list_subset(self):
+        """Tests bounds of first, last and middle subsets, with and without
+        indices
+        """
+        wordlist = ['the', 'apple', 'was', 'large', 'and', 'juicy']
+        for indices in [range(6), [0, 1, 2, 6, 7, 8], [0.5, 0.5, 2, 3.5,
+                                                       3.5, 9]]:
+            for min_index, max_index in [(0, None), (0, 4), (2, None),
+                                         (-4, None), (-2, 3), (1, 7),
+                                         (10, 12)]:
+                start, end = corebody.get_subset_bounds(indices, min_index,
+                                                   max_index)
+                self.assertEqual(wordlist[start:end],
+                    list(off.get_list_subset(wordlist, indices, min_index,
+                                             max_index)))
+
+    def test_empty(self):
+        """Tests that an empty list has an empty subset"""
+        self.assertEqual(corebody.get_subset_bounds([], -4), (0, 0))
+
+
+class TestCreateSubsetTextsFunc(unittest.TestCase):
+    """Tests create_subset_texts writes the subset of each text"""
+    def setUp(self):
+        """Defines things used in testing"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.text_file = os.path.join(self.tmp_dir, 'texts.txt')
+        self.new_file = os.path.join(self.tmp_dir, 'subset.txt')
+        with open(self.text_file, 'w') as fo:
+            for i in range(20):
+                fo.write('%s\t%s\t%s\n' % (
+                    i, '|'.join('w%s_%s' % (i, j) for j in range(i + 1)),
+                    '|'.join('%.1f' % (j * 1.5) for j in range(i + 1))))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _expected(self, min_index, max_index, has_ids=True):
+        lines = []
+        for i in range(20):
+            words = ['w%s_%s' % (i, j) for j in range(i + 1)]
+            subset = off.get_list_subset(words, [j * 1.5 for j in
+                range(i + 1)], min_index, max_index)
+            lines.append('%s\t%s\n' % (i if has_ids else i + 1,
+                                        '|'.join(subset)))
+        return ''.join(lines)
+
+    def _read_subset(self):
+        with open(self.new_file) as fo:
+            return fo.read()
+
+    def test_first_and_last_subsets(self):
+        """Tests first and last 'seconds' of texts, in one process and in
+        several
+        """
+        for num_workers in [1, 3]:
+            for min_index, max_index in [(0, 6), (-6, None), (3, 9)]:
+                off.create_subset_texts(self.text_file, self.new_file,
+                    min_index=min_index, max_index=max_index,
+                    num_workers=num_workers)
+                self.assertEqual(self._read_subset(),
+                                 self._expected(min_index, max_index))
+
+    def test_numbered_without_ids(self):
+        """Tests that texts without IDs are numbered in order across
+        workers
+        """
+        with open(self.text_file) as fo:
+            rows = [row.split('\t', 1)[1] for row in fo]
+        with open(self.text_file, 'w') as fo:
+            fo.writelines(rows)
+
+        off.create_subset_texts(self.text_file, self.new_file, max_index=6,
+                                has_ids=False, num_workers=3)
+        self.assertEqual(self._read_subset(),
+                         self._expected(0, 6, has_ids=False))
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+            ['subset.txt', 'texts.txt', 'texts.txt.offsets.npy'])
+
 if __name__ == '__main__':
     unittest.main()
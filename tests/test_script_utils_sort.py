@@ -0,0 +1,63 @@
+"""Tests for the sort_file function in the script_utils module"""
+
+import sys, os
+sys.path.insert(0, os.path.abspath(__file__ + "/../../"))
+import unittest
+import tempfile
+import shutil
+from corpus_preprocessing import script_utils as mod_ut
+
+class TestSortFileFunc(unittest.TestCase):
+    """Tests that sort_file sorts by several keys, in memory or in runs"""
+    def setUp(self):
+        """Defines things used in testing"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.tmp_dir, 'top_trigrams.txt')
+        self.rows = ['cat,0.500,3,1\n', 'dog,0.010,2,0\n', 'eel,0.500,9,2\n',
+                     'fox,0.010,2,5\n', 'gnu,0.250,2,1\n', 'hen,0.500,3,0\n']
+        self.expected = ['dog,0.010,2,0\n', 'fox,0.010,2,5\n',
+                         'gnu,0.250,2,1\n', 'eel,0.500,9,2\n',
+                         'cat,0.500,3,1\n', 'hen,0.500,3,0\n']
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _sort(self, lines, **kwargs):
+        with open(self.file_name, 'wb') as fo:
+            fo.write(''.join(lines))
+        mod_ut.sort_file(self.file_name, [1, 2], [False, True], col_sep=',',
+                         transform=lambda x: float(x), **kwargs)
+        with open(self.file_name, 'rb') as fo:
+            return fo.readlines()
+
+    def test_sorted_by_keys_keeping_order_of_ties(self):
+        """Tests that rows are sorted by pval (asc) then df (desc), and
+        rows with equal keys keep their order
+        """
+        self.assertEqual(self._sort(self.rows), self.expected)
+
+    def test_same_with_runs(self):
+        """Tests that merging sorted runs gives the same order, and that
+        no temporary files are left
+        """
+        self.assertEqual(self._sort(self.rows, max_lines=2), self.expected)
+        self.assertEqual(os.listdir(self.tmp_dir), ['top_trigrams.txt'])
+
+    def test_header_and_last_line(self):
+        """Tests that the header stays first and a last row without a
+        newline doesn't run into the next
+        """
+        lines = ['token,pval,df1,df2\n'] + self.rows
+        lines[-1] = lines[-1][:-1]
+        with open(self.file_name, 'wb') as fo:
+            fo.write(''.join(lines))
+        mod_ut.sort_file(self.file_name, [1, 2], [False, True], col_sep=',',
+                         has_header=True, transform=lambda x: float(x),
+                         max_lines=4)
+        with open(self.file_name, 'rb') as fo:
+            self.assertEqual(fo.readlines(),
+                             ['token,pval,df1,df2\n'] + self.expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
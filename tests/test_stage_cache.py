@@ -0,0 +1,113 @@
+"""Tests for the stage_cache module"""
+
+import sys, os
+sys.path.insert(0, os.path.abspath(__file__ + "/../../"))
+import unittest
+import tempfile
+import shutil
+import numpy as np
+from corpus_preprocessing.core import stage_cache as mod_ut
+from corpus_preprocessing.core import corebody
+
+class TestHashValueFunc(unittest.TestCase):
+    """Tests hash_value hashes equal values the same"""
+    def test_equal_values(self):
+        """Tests that equal values hash the same, and others don't"""
+        self.assertEqual(
+            mod_ut.hash_value([np.arange(3), {'b': 1, 'a': frozenset('xy')}]),
+            mod_ut.hash_value([np.arange(3), {'a': frozenset('yx'), 'b': 1}]))
+        self.assertNotEqual(mod_ut.hash_value(np.arange(3)),
+                            mod_ut.hash_value(np.arange(3.0)))
+        self.assertNotEqual(mod_ut.hash_value([1, 2]),
+                            mod_ut.hash_value((1, 2)))
+
+
+class TestStageCacheClass(unittest.TestCase):
+    """Tests StageCache skips stages whose results it already has"""
+    def setUp(self):
+        """Defines things used in testing"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.text_file = os.path.join(self.tmp_dir, 'texts.txt')
+        self.alldfs_file = os.path.join(self.tmp_dir, 'texts_dfs-all.txt')
+        with open(self.text_file, 'wb') as fo:
+            fo.write('id\ttext\n1\ta|black|cat\n2\ta|black|dog\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _run_corebody(self, obj_ut):
+        return obj_ut.run(corebody.create_corebody, [self.text_file],
+                          [self.alldfs_file], self.text_file, min_docnum=2)
+
+    def _read_alldfs(self):
+        with open(self.alldfs_file, 'rb') as fo:
+            return fo.read()
+
+    def test_rerun_restores_outputs(self):
+        """Tests that a rerun restores the output file and return value
+        without running the stage, and that changing the input reruns it
+        """
+        expected = self._run_corebody(mod_ut.StageCache(self.cache_dir))
+        expected_alldfs = self._read_alldfs()
+        os.remove(self.alldfs_file)
+
+        obj_ut = mod_ut.StageCache(self.cache_dir)
+        self.assertEqual(dict(self._run_corebody(obj_ut).token2id),
+                         dict(expected.token2id))
+        self.assertEqual(self._read_alldfs(), expected_alldfs)
+        self.assertEqual(len(obj_ut.index['entries']), 1)
+
+        with open(self.text_file, 'ab') as fo:
+            fo.write('3\tthree|black|cats\n')
+        self.assertEqual(dict(self._run_corebody(obj_ut).token2id),
+                         {u'a': 0, u'black': 1})
+        self.assertEqual(len(obj_ut.index['entries']), 2)
+
+    def test_execution_kwargs_not_in_key(self):
+        """Tests that arguments that only change how a stage runs don't
+        change its key, and others do
+        """
+        obj_ut = mod_ut.StageCache(self.cache_dir)
+        expected = obj_ut.make_key('stage', [self.text_file], [],
+                                   {'min_docnum': 2})
+        self.assertEqual(
+            obj_ut.make_key('stage', [self.text_file], [],
+                            {'min_docnum': 2, 'num_workers': 8,
+                             'use_cache': True}),
+            expected)
+        self.assertNotEqual(
+            obj_ut.make_key('stage', [self.text_file], [],
+                            {'min_docnum': 3}),
+            expected)
+
+    def test_code_change_changes_key(self):
+        """Tests that changing a code file changes the key"""
+        code_file = os.path.join(self.tmp_dir, 'stage.py')
+        with open(code_file, 'wb') as fo:
+            fo.write('def stage():\n    return 1\n')
+        obj_ut = mod_ut.StageCache(self.cache_dir)
+        expected = obj_ut.make_key('stage', [self.text_file], [], {},
+                                   [code_file])
+
+        with open(code_file, 'ab') as fo:
+            fo.write('# changed\n')
+        self.assertNotEqual(obj_ut.make_key('stage', [self.text_file], [],
+                                            {}, [code_file]),
+                            expected)
+        self.assertTrue(os.path.abspath(corebody.__file__).rstrip('c') in
+                        mod_ut.get_code_files(corebody.create_corebody))
+
+    def test_least_recently_used_evicted(self):
+        """Tests that old results are evicted past max_bytes"""
+        obj_ut = mod_ut.StageCache(self.cache_dir, max_bytes=1)
+        for min_docnum in [1, 2]:
+            obj_ut.run(corebody.create_corebody, [self.text_file],
+                       [self.alldfs_file], self.text_file,
+                       min_docnum=min_docnum)
+        self.assertEqual(len(obj_ut.index['entries']), 1)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
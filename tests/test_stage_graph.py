@@ -0,0 +1,76 @@
+"""Tests for the stage_graph module"""
+
+import sys, os
+sys.path.insert(0, os.path.abspath(__file__ + "/../../"))
+import unittest
+import tempfile
+import shutil
+from corpus_preprocessing.core import stage_graph as mod_ut
+from corpus_preprocessing.core import stage_cache
+
+def add(x, y):
+    return x + y
+
+def get_pid(_):
+    return os.getpid()
+
+def fail():
+    raise ValueError('bad stage')
+
+def write_sum(file_name, x, y):
+    with open(file_name, 'wb') as fo:
+        fo.write(str(x + y))
+    return x + y
+
+class TestRunStageGraphFunc(unittest.TestCase):
+    """Tests run_stage_graph runs stages in order of what they need"""
+    def setUp(self):
+        """Defines things used in testing"""
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_results_passed_along(self):
+        """Tests that stages get the results of the stages they need, and
+        that branches run in their own processes
+        """
+        obj_ut = mod_ut.run_stage_graph({
+            'a': mod_ut.Stage(add, [1, 2]),
+            'b': mod_ut.Stage(add, [10], {'y': 20}),
+            'c': mod_ut.Stage(add, [mod_ut.StageOutput('a'),
+                                    mod_ut.StageOutput('b')], local=True),
+            'd': mod_ut.Stage(add, [mod_ut.StageOutput('c'), 100]),
+            'pid': mod_ut.Stage(get_pid, [mod_ut.StageOutput('a')])})
+        self.assertEqual(obj_ut['c'], 33)
+        self.assertEqual(obj_ut['d'], 133)
+        self.assertNotEqual(obj_ut['pid'], os.getpid())
+
+    def test_bad_graphs(self):
+        """Tests that failed stages, unknown stages and cycles raise"""
+        self.assertRaises(RuntimeError, mod_ut.run_stage_graph,
+                          {'a': mod_ut.Stage(fail)})
+        self.assertRaises(ValueError, mod_ut.run_stage_graph,
+                          {'a': mod_ut.Stage(add, [mod_ut.StageOutput('x'),
+                                                   1])})
+        self.assertRaises(ValueError, mod_ut.run_stage_graph, {
+            'a': mod_ut.Stage(add, [mod_ut.StageOutput('b'), 1]),
+            'b': mod_ut.Stage(add, [mod_ut.StageOutput('a'), 1])})
+
+    def test_cached_stages(self):
+        """Tests that stages are added to and restored from the cache"""
+        cache = stage_cache.StageCache(os.path.join(self.tmp_dir, 'cache'))
+        out_file = os.path.join(self.tmp_dir, 'sum.txt')
+        stages = {'a': mod_ut.Stage(write_sum, [out_file, 1, 2],
+                                    output_files=[out_file])}
+
+        self.assertEqual(mod_ut.run_stage_graph(stages, cache)['a'], 3)
+        os.remove(out_file)
+        self.assertEqual(mod_ut.run_stage_graph(stages, cache)['a'], 3)
+        with open(out_file, 'rb') as fo:
+            self.assertEqual(fo.read(), '3')
+        self.assertEqual(len(cache.index['entries']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
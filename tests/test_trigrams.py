@@ -3,6 +3,8 @@
 import sys, os
 sys.path.insert(0, os.path.abspath(__file__ + "/../../"))
 import unittest
+import tempfile
+import shutil
 from corpus_preprocessing.core import trigrams as mod_ut
 
 class TestStringToWordListFunction(unittest.TestCase):
@@ -81,6 +83,27 @@ class TestRemoveBadWordsFunction(unittest.TestCase):
     		"remove")
     	self.assertEqual(obj_ut, self.new_words_allbad)
 
+    def test_keeps_good_words_with_lookup(self):
+    	"""Tests that func keeps only good words when given a compiled
+    	lookup of words"""
+    	good_words = mod_ut.make_words_lookup(self.bad_simple)
+    	obj_ut = mod_ut.remove_bad_words(self.words_allbad, good_words, "keep")
+    	self.assertEqual(obj_ut, self.words_allbad)
+    	obj_ut = mod_ut.remove_bad_words(self.words_simple, good_words, "keep")
+    	self.assertEqual(obj_ut, [('the', 4), ('in', 6), ('and', 8)])
+
+class TestMakeWordsLookupFunction(unittest.TestCase):
+    """Tests make_words_lookup function compiles word lists properly"""
+    def test_lookup_from_list(self):
+    	"""Tests that func turns a word list into a frozenset"""
+    	obj_ut = mod_ut.make_words_lookup(['the', 'in', 'the'])
+    	self.assertEqual(obj_ut, frozenset(['the', 'in']))
+
+    def test_lookup_reused(self):
+    	"""Tests that func hands back an already compiled lookup as is"""
+    	lookup = frozenset(['the', 'in'])
+    	self.assertTrue(mod_ut.make_words_lookup(lookup) is lookup)
+
 class TestMakeTrigramsFunction(unittest.TestCase):
     """Tests make_trigrams function makes trigrams properly"""
     def setUp(self):
@@ -142,6 +165,65 @@ class TestMakeTrigramsFunction(unittest.TestCase):
     	obj_ut2 = mod_ut.make_trigrams(self.words_space_2)
     	self.assertEqual(obj_ut2, self.trigrams_space_2)
 
+    def test_trigrams_long_text(self):
+        """Tests that func handles texts far longer than python's recursion
+        limit, including multigrams around word 1000
+        """
+        words_long = [('word%s' % i, i) for i in range(20000)]
+        obj_ut = mod_ut.make_trigrams(words_long)
+        self.assertEqual(len(obj_ut), 20000 + 19999 + 19998)
+        self.assertTrue('word999 word1000' in obj_ut)
+        self.assertTrue('word999 - word1001' in obj_ut)
+
+class TestIterMultigramsFunction(unittest.TestCase):
+    """Tests iter_multigrams function yields multigrams properly"""
+    def test_multigrams_only(self):
+        """Tests that func yields only bi- and trigrams, in order"""
+        words_list = [('most', 0), ('sleep', 2), ('during', 3), ('day', 5)]
+        obj_ut = list(mod_ut.iter_multigrams(words_list))
+        self.assertEqual(obj_ut, ['most - sleep', 'sleep during',
+            'during - day'])
+
+    def test_empty_words_list(self):
+        """Tests that func yields nothing for an empty word list"""
+        self.assertEqual(list(mod_ut.iter_multigrams([])), [])
+
+
+class TestCreateTrigramsFileFunction(unittest.TestCase):
+    """Tests create_trigrams_file writes trigram'd texts properly"""
+    def setUp(self):
+        """Define things used in testing"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.text_file = os.path.join(self.tmp_dir, 'texts.txt')
+        with open(self.text_file, 'w') as fo:
+            for i in range(40):
+                fo.write('%s\tmost|cats|sleep|during|the|day|%s\n' % (i, i))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parallel_same_as_serial(self):
+        """Tests that making trigrams in worker processes writes the same
+        file as making them in one process
+        """
+        serial_file = os.path.join(self.tmp_dir, 'serial.txt')
+        parallel_file = os.path.join(self.tmp_dir, 'parallel.txt')
+        mod_ut.create_trigrams_file(self.text_file, serial_file,
+                                    [u'the'], method='remove')
+        mod_ut.create_trigrams_file(self.text_file, parallel_file,
+                                    [u'the'], method='remove', num_workers=3,
+                                    shard_bytes=100)
+        with open(serial_file) as fo:
+            serial_lines = fo.readlines()
+        with open(parallel_file) as fo:
+            parallel_lines = fo.readlines()
+        self.assertEqual(len(serial_lines), 40)
+        self.assertEqual(serial_lines[0],
+                         '0\tmost|cats|sleep|during|day|0|most cats|'
+                         'most - sleep|cats sleep|cats - during|'
+                         'sleep during|during - day|day 0\n')
+        self.assertEqual(parallel_lines, serial_lines)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -7,9 +7,15 @@
 
 import corpus_preprocessing.core.corebody as core
 import corpus_preprocessing.core.trigrams as edit
+import corpus_preprocessing.core.packed_ngrams as ngrams
 import corpus_preprocessing.core.compare_corpus as compare
+import corpus_preprocessing.core.df_snapshot as snap
+import corpus_preprocessing.core.df_table as table
+import corpus_preprocessing.core.stage_cache as cache
+import corpus_preprocessing.core.stage_graph as graph
 from distutils import util
 import logging
+import multiprocessing
 import corpus_preprocessing.script_utils as script
 
 format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -26,9 +32,11 @@ def get_filenames():
     """
     prompts = {
         'target': 'Name of file containing target texts (.csv or .txt):',
-        'filter': 'Name of file containing texts to filter on (.csv or .txt):'
+        'filter': 'Name of file containing texts to filter on (.csv or .txt)\n \
+            (to compare against several, separate file names with commas):'
     }
     try_func = lambda x: open(x).close()
+    try_func_filters = lambda x: [try_func(name.strip()) for name in x.split(',')]
     error = IOError
     error_message = ("Unable to open file - "
         "please check spelling and enter again")
@@ -37,11 +45,12 @@ def get_filenames():
     target_file = script.get_user_input(prompts['target'], try_func, error,
         error_message)
 
-    # Teset that filter file given can be opened
-    filter_file = script.get_user_input(prompts['filter'], try_func, error,
-        error_message)
+    # Teset that filter file(s) given can be opened
+    filter_files = script.get_user_input(prompts['filter'], try_func_filters,
+        error, error_message)
+    filter_files = [name.strip() for name in filter_files.split(',')]
 
-    return target_file, filter_file
+    return target_file, filter_files
 
 def get_file_parameters():
     """Get file parameters (column delimiter, word separater) from user input
@@ -90,13 +99,207 @@ def user_input_corebody_params():
     args = []
     kwargs = {}
 
-    target_file, filter_file = get_filenames()
+    target_file, filter_files = get_filenames()
     has_ids, kwargs['delimiter'], kwargs['word_sep'] = get_file_parameters()
     min_docnum = get_corebody_thresholds()
 
     args.append(target_file)
 
-    return (args, kwargs, filter_file, has_ids, min_docnum)
+    return (args, kwargs, filter_files, has_ids, min_docnum)
+
+def get_sample_name(file_name):
+    """Name of file without its directory or extension
+    """
+    # Look for back and fwd slash in case there's a directory in the file path
+    directory_index = max(file_name.rfind('/'), file_name.rfind('\\')) + 1
+
+    return file_name[directory_index:-4]
+
+def get_pair_filename(target_file, filter_file, suffix):
+    """Name of file for the results of comparing target texts to filter
+    texts (target file name + filter sample name + suffix)
+    """
+    return target_file[:-4] + '_' + get_sample_name(filter_file) + '_' + suffix
+
+def create_corebody(text_file, use_snapshot=False, **corebody_kwargs):
+    """Creates corebody of single words from one sample of texts, saving
+    single word dfs to file (see core.create_corebody); if use_snapshot,
+    it's made from the sample's df snapshot instead, which only counts
+    texts added to the file since the last run (see
+    snap.create_snapshot_corebody); snapshots are held in memory and are
+    of whole texts, so they aren't used when max_tokens_in_memory or a
+    window is set
+    """
+    if (not use_snapshot or
+            corebody_kwargs.get('max_tokens_in_memory') is not None or
+            corebody_kwargs.get('window') is not None):
+        return core.create_corebody(text_file, **corebody_kwargs)
+
+    return snap.create_snapshot_corebody(text_file, **corebody_kwargs)
+
+def _create_filter_corebody(args):
+    """Creates corebody of single words from one filter sample (runs in a
+    worker process)
+    """
+    filter_file, corebody_kwargs = args
+    return create_corebody(filter_file, **corebody_kwargs)
+
+def _create_filter_trigram_corebody(args):
+    """Creates corebody of trigrams from one filter sample cleaned of its
+    non-sig words (runs in a worker process)
+    """
+    filter_file, sig_words, ngram_kwargs = args
+    return ngrams.create_trigram_corebody(filter_file, sig_words,
+        **ngram_kwargs)
+
+def compare_single_words(corebody, filterbody, ttest_file, min_docnum,
+                         pval_threshold, sig_test, encoding,
+                         stage_cache=None, save_table=False):
+    """Merges single word core bodies of target and filter texts, writes
+    the df-ttest of their words to ttest_file, and returns the words with
+    pvals below pval_threshold, as a make_words_lookup set; if save_table,
+    the merged dfs are also saved as a df table next to ttest_file (see
+    table.make_df_table)
+    """
+    LOGGER.info('Merging corebody and filterbody for df comparison...')
+    mergedbody = compare.merge_cores([corebody, filterbody])
+
+    if save_table:
+        table.make_df_table(mergedbody, corebody.num_docs,
+            filterbody.num_docs, table.get_table_name(ttest_file), sig_test)
+
+    cache.run_stage(stage_cache, compare.write_df_ttest_to_file, [],
+        [ttest_file], mergedbody, corebody.num_docs, filterbody.num_docs,
+        ttest_file, min_docnum, test=sig_test)
+
+    LOGGER.info(
+        'Creating generator obj returning words from %s with pval < %s',
+        ttest_file, pval_threshold)
+    sig_words = edit.make_words_lookup(compare.words_below_pval_generator(
+        ttest_file, pval_threshold, encoding=encoding))
+
+    LOGGER.info('List of %s sig words created', len(sig_words))
+
+    return sig_words
+
+def compare_target_to_filters(target_file, filter_files, corebody_kwargs,
+                              min_docnum, pval_threshold, min_multiplier,
+                              sig_test, num_workers, stage_cache=None,
+                              save_tables=False, top_k=None):
+    """Runs the filtered procedure for one sample of target texts against
+    several samples of filter texts in one go: the target texts are only
+    counted once, the filter samples are counted in parallel, and every
+    target/filter pair gets its own df-ttest file and top trigrams file
+    (top_trigrams_ + filter file name)
+
+    Sig words differ from pair to pair, so target trigrams are counted
+    once with the sig words of all pairs, then narrowed down to each
+    pair's sig words (see packed_ngrams.NgramDfs.restrict_to_words)
+
+    Stages run in this process go through stage_cache, if given (see
+    stage_cache.StageCache), and if save_tables, the merged dfs of every
+    pair are saved as df tables next to their results (see
+    table.make_df_table); if top_k is given, only the top_k trigrams of
+    each pair are written (see compare.write_df_ttest_to_file)
+    """
+    encoding = corebody_kwargs['encoding']
+    delimiter = corebody_kwargs['delimiter']
+    word_sep = corebody_kwargs['word_sep']
+    use_cache = corebody_kwargs.get('use_cache', False)
+    ngram_kwargs = {'delimiter': delimiter, 'word_sep': word_sep,
+        'encoding': encoding, 'use_cache': use_cache, 'has_header': True}
+
+    # worker processes can't start pools of their own
+    worker_kwargs = dict(corebody_kwargs, num_workers=1)
+
+    pool = multiprocessing.Pool(min(num_workers, len(filter_files)))
+    try:
+        LOGGER.info('Creating corebodies of single words from %s filter '
+            'samples...', len(filter_files))
+        filterbodies = pool.map_async(_create_filter_corebody,
+            [(filter_file, worker_kwargs) for filter_file in filter_files])
+
+        LOGGER.info('Creating corebody of single words from target texts...')
+        corebody = cache.run_stage(stage_cache, create_corebody,
+            [target_file], [target_file[:-4] + '_dfs-all.txt'], target_file,
+            **corebody_kwargs)
+        filterbodies = filterbodies.get()
+
+        # t-test single words of each pair to get each pair's sig words
+        sig_words_list = []
+        for filter_file, filterbody in zip(filter_files, filterbodies):
+            mergedbody = compare.merge_cores([corebody, filterbody])
+            ttest_file = get_pair_filename(target_file, filter_file,
+                'df-ttest.txt')
+            if save_tables:
+                table.make_df_table(mergedbody, corebody.num_docs,
+                    filterbody.num_docs, table.get_table_name(ttest_file),
+                    sig_test)
+            cache.run_stage(stage_cache, compare.write_df_ttest_to_file, [],
+                [ttest_file], mergedbody, corebody.num_docs,
+                filterbody.num_docs, ttest_file, min_docnum, test=sig_test)
+
+            sig_words = edit.make_words_lookup(
+                compare.words_below_pval_generator(ttest_file,
+                    pval_threshold, encoding=encoding))
+            sig_words_list.append(sig_words)
+
+            LOGGER.info('List of %s sig words created for %s',
+                len(sig_words), filter_file)
+
+        LOGGER.info('Creating corebodies of trigrams from filter samples...')
+        filterbodies_trigrams = pool.map_async(
+            _create_filter_trigram_corebody,
+            [(filter_file, sig_words, ngram_kwargs)
+             for filter_file, sig_words in zip(filter_files, sig_words_list)])
+
+        LOGGER.info('Counting trigrams of target texts...')
+        if use_cache:
+            target_texts = core.get_compiled_corpus(target_file, delimiter,
+                word_sep, has_header=True, encoding=encoding)
+        else:
+            target_texts = core.RawCorpus(target_file, delimiter, word_sep,
+                has_header=True, encoding=encoding)
+        target_trigrams = ngrams.count_ngram_dfs(target_texts,
+            frozenset().union(*sig_words_list))
+        core.write_token_dfs(target_trigrams.token_dfs(),
+            target_file[:-4] + '_trigrams_dfs-all.txt')
+
+        filterbodies_trigrams = filterbodies_trigrams.get()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    # conduct ttests on token dfs between target and each filter's trigrams
+    for filter_file, sig_words, filterbody_trigrams in zip(
+        filter_files, sig_words_list, filterbodies_trigrams):
+        pair_trigrams = target_trigrams.restrict_to_words(sig_words)
+        mergedbody_trigrams = compare.merge_cores([
+            (pair_trigrams.tokens(), pair_trigrams.dfs),
+            filterbody_trigrams])
+
+        ttest_file_trigrams = ('top_trigrams_' + get_sample_name(filter_file) +
+            '.txt')
+        if save_tables:
+            table.make_df_table(mergedbody_trigrams, pair_trigrams.num_docs,
+                filterbody_trigrams.num_docs,
+                table.get_table_name(ttest_file_trigrams), sig_test)
+
+        LOGGER.info("Finding 'significant tokens' against %s, written to %s",
+            filter_file, ttest_file_trigrams)
+        cache.run_stage(stage_cache, compare.write_df_ttest_to_file, [],
+            [ttest_file_trigrams], mergedbody_trigrams,
+            pair_trigrams.num_docs, filterbody_trigrams.num_docs,
+            ttest_file_trigrams, min_docnum, min_multiplier, pval_threshold,
+            test=sig_test, top_k=top_k)
+
+        # top_k rows are written already sorted
+        if top_k is None:
+            script.sort_file(ttest_file_trigrams, [1, 2], [False, True],
+                col_sep=',', transform=lambda x: float(x))
 
 def main():
     """Prompts for user inputs and runs text processing procedure on user
@@ -104,6 +307,16 @@ def main():
     """
     PVAL_THRESHOLD = 0.25 #POTENTIALLY ASK FOR USR INPUT ABOVE (currently 0.25)
     MIN_MULTIPLIER = 2 #POTENTIALLY ASK FOR USR INPUT ABOVE (currently 2)
+    SIG_TEST = 'ttest' #POTENTIALLY ASK FOR USR INPUT ABOVE (ttest, chi2, fisher, loglik)
+    NUM_WORKERS = multiprocessing.cpu_count() # processes for counting dfs
+    USE_INDEX = True # keep line offsets of input files in sidecar .npy files
+    USE_CACHE = True # compile input files to word id arrays, reused by reruns
+    USE_SNAPSHOTS = True # keep word dfs of input files, only count new texts
+    SAVE_DF_TABLES = True # save merged dfs, for text_processing_query.py
+    STAGE_CACHE_DIR = '.stage_cache' # results of stages, reused by reruns
+    STAGE_CACHE_MAX_BYTES = 2**32 # least recently used results past this go
+    MAX_TOKENS_IN_MEMORY = None # if set, spill word dfs to disk past this
+    TOP_K_TRIGRAMS = None # if set, only write this many top trigrams
 
     LOGGER.info('Starting.......................................')
 
@@ -111,29 +324,32 @@ def main():
     # save single word dfs to file
     corebody_params = user_input_corebody_params()
     corebody_params[1]['encoding'] = 'cp1252'
+    corebody_params[1]['num_workers'] = NUM_WORKERS
+    corebody_params[1]['use_index'] = USE_INDEX
+    corebody_params[1]['use_cache'] = USE_CACHE
+    corebody_params[1]['max_tokens_in_memory'] = MAX_TOKENS_IN_MEMORY
+    corebody_params[1]['use_snapshot'] = USE_SNAPSHOTS
 
     target_file = corebody_params[0][0]
     delimiter = corebody_params[1]['delimiter']
     word_sep = corebody_params[1]['word_sep']
     encoding = corebody_params[1]['encoding']
-    filter_file = corebody_params[2]
+    filter_files = corebody_params[2]
     has_ids = corebody_params[3]
     min_docnum = corebody_params[4]
 
-    LOGGER.info('Creating corebody of single words from target texts...')
-    corebody = core.create_corebody(*corebody_params[0],
-        **corebody_params[1])
+    stage_cache = cache.StageCache(STAGE_CACHE_DIR, STAGE_CACHE_MAX_BYTES)
 
-    # do same for filter texts - create core body of single words,
-    # save to file
-    LOGGER.info('Creating corebody of single words from filter texts...')
-    filterbody = core.create_corebody(filter_file,
-        **corebody_params[1])
+    if len(filter_files) > 1:
+        compare_target_to_filters(target_file, filter_files,
+            corebody_params[1], min_docnum, PVAL_THRESHOLD, MIN_MULTIPLIER,
+            SIG_TEST, NUM_WORKERS, stage_cache, SAVE_DF_TABLES,
+            TOP_K_TRIGRAMS)
 
-    # merge corebody and filterbody, conduct t-tests on token dfs between
-    # two, save tokens and pvals of t-tests to file
-    LOGGER.info('Merging corebody and filterbody for df comparison...')
-    mergedbody = compare.merge_two_cores(corebody, filterbody)
+        LOGGER.info('Finished.......................................')
+        return
+
+    filter_file = filter_files[0]
 
     # Look for back and fwd slash in case there's a directory in the file path
     directory_index = max(target_file.rfind('/'),
@@ -142,51 +358,48 @@ def main():
     ttest_file = (target_file[:-4] + '_' +
         filter_file[directory_index:-4] +
         '_' + 'df-ttest.txt')
-    compare.write_df_ttest_to_file(mergedbody, corebody.num_docs,
-        filterbody.num_docs, ttest_file, min_docnum)
 
-    # use list of 'significant' (below pval threshhold) single words
-    # from df ttest between corebody and filterbody to edit out 'meaningless'
-    # single words from texts, break filtered texts down into trigrams,
-    # save corebody and filterbody trigram'd texts to file
-    LOGGER.info(
-        'Creating generator obj returning words from %s with pval < %s',
-        ttest_file, PVAL_THRESHOLD)
-    sig_words_generator = compare.words_below_pval_generator(ttest_file,
-        PVAL_THRESHOLD, encoding=encoding)
-    sig_words = list(sig_words_generator)
+    # target and filter texts are two independent branches until they're
+    # merged, so each branch runs in its own process, with half the
+    # workers for counting dfs
+    branch_kwargs = dict(corebody_params[1],
+        num_workers=max(1, NUM_WORKERS // 2))
+    ngram_kwargs = {'delimiter': delimiter, 'word_sep': word_sep,
+        'encoding': encoding, 'use_cache': USE_CACHE, 'has_header': True}
+
+    stages = {}
+    for name, text_file in [('corebody', target_file),
+                            ('filterbody', filter_file)]:
+        # create core body of single words, save single word dfs to file
+        stages[name] = graph.Stage(create_corebody, [text_file],
+            branch_kwargs, [text_file], [text_file[:-4] + '_dfs-all.txt'])
+
+        # clean texts of non-sig words and count the dfs of their uni-,
+        # bi-, and trigrams straight from the texts (no trigram'd texts
+        # are written)
+        stages[name + '_trigrams'] = graph.Stage(
+            ngrams.create_trigram_corebody,
+            [text_file, graph.StageOutput('sig_words')], ngram_kwargs,
+            [text_file], [text_file[:-4] + '_trigrams_dfs-all.txt'])
 
-    LOGGER.info('List of %s sig words created', len(sig_words))
-
-    corebody_trigrams_file = target_file[:-4] + '_trigrams.txt'
-    filterbody_trigrams_file = filter_file[:-4] + '_trigrams.txt'
-
-    LOGGER.info("Creating trigram'd target texts at %s",
-        corebody_trigrams_file)
-    edit.create_trigrams_file(target_file, corebody_trigrams_file,
-        sig_words, has_ids=has_ids, delimiter=delimiter,
-        word_sep=word_sep, encoding=encoding)
-
-    LOGGER.info("Creating trigram'd filter texts at %s",
-        filterbody_trigrams_file)
-    edit.create_trigrams_file(filter_file, filterbody_trigrams_file,
-        sig_words, has_ids=has_ids, delimiter=delimiter,
-        word_sep=word_sep, encoding=encoding)
-
-    # create cores for corebody and filterbody trigrams, then merge together
-    # for df comparison
-    LOGGER.info('Creating corebody of trigrams from target texts...')
-    corebody_trigrams = core.create_corebody(corebody_trigrams_file,
-        encoding=encoding)
-
-    LOGGER.info('Creating corebody of trigrams from filter texts...')
-    filterbody_trigrams = core.create_corebody(filterbody_trigrams_file,
-        encoding=encoding)
+    # merge corebody and filterbody, conduct t-tests on token dfs between
+    # two, and use list of 'significant' (below pval threshhold) single
+    # words to edit out 'meaningless' single words from texts
+    stages['sig_words'] = graph.Stage(compare_single_words,
+        [graph.StageOutput('corebody'), graph.StageOutput('filterbody'),
+         ttest_file, min_docnum, PVAL_THRESHOLD, SIG_TEST, encoding,
+         stage_cache, SAVE_DF_TABLES],
+        local=True)
+
+    LOGGER.info('Running target and filter branches...')
+    results = graph.run_stage_graph(stages, stage_cache)
+    corebody_trigrams = results['corebody_trigrams']
+    filterbody_trigrams = results['filterbody_trigrams']
 
     LOGGER.info(
         "Merging trigram'd corebody and filterbody for df comparison...")
-    mergedbody_trigrams = compare.merge_two_cores(corebody_trigrams,
-        filterbody_trigrams)
+    mergedbody_trigrams = compare.merge_cores([corebody_trigrams,
+        filterbody_trigrams])
 
     # conduct ttests on token dfs between corebody and filterbody trigrams
     # ignoring tokens with total df below min_docnum and multiplier
@@ -194,16 +407,25 @@ def main():
     # 'significant trigrams'
     ttest_file_trigrams = 'top_trigrams.txt'
 
+    if SAVE_DF_TABLES:
+        table.make_df_table(mergedbody_trigrams, corebody_trigrams.num_docs,
+            filterbody_trigrams.num_docs,
+            table.get_table_name(ttest_file_trigrams), SIG_TEST)
+
     LOGGER.info(
         "Finding 'significant tokens' for target texts using mult of %s",
         MIN_MULTIPLIER)
-    compare.write_df_ttest_to_file(mergedbody_trigrams,
+    stage_cache.run(compare.write_df_ttest_to_file, [],
+        [ttest_file_trigrams], mergedbody_trigrams,
         corebody_trigrams.num_docs, filterbody_trigrams.num_docs,
-        ttest_file_trigrams, min_docnum, MIN_MULTIPLIER, PVAL_THRESHOLD)
-
-    LOGGER.info("Sorting sig tokens file by pval (asc), scope (desc)")
-    script.sort_file(ttest_file_trigrams, [1, 2], [False, True], col_sep=',',
-        transform=lambda x: float(x))
+        ttest_file_trigrams, min_docnum, MIN_MULTIPLIER, PVAL_THRESHOLD,
+        test=SIG_TEST, top_k=TOP_K_TRIGRAMS)
+
+    # top k trigrams are written already sorted
+    if TOP_K_TRIGRAMS is None:
+        LOGGER.info("Sorting sig tokens file by pval (asc), scope (desc)")
+        script.sort_file(ttest_file_trigrams, [1, 2], [False, True],
+            col_sep=',', transform=lambda x: float(x))
 
     LOGGER.info('Finished.......................................')
 
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+#
+# Script to try out thresholds (min num of docs, min multiplier, max
+# pval, max num of docs) on the df table saved by
+# text_processing_filtered.py, without running it again; writes the
+# tokens that pass each set of thresholds, sorted by pval, to a file
+#------------------------------------------------------------------
+import corpus_preprocessing.core.df_table as table
+import corpus_preprocessing.script_utils as script
+import logging
+import os
+import time
+
+format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+logging.basicConfig(level=logging.INFO, format=format,
+    datefmt='%m-%d %H:%M', filename='query.log')
+
+LOGGER = logging.getLogger('text_processing')
+LOGGER.setLevel(logging.INFO)
+
+def get_table_dir():
+    """Get name of df table directory from user input
+    """
+    prompt = ('Name of df table directory (EX: top_trigrams_df-table):')
+    try_func = lambda x: open(os.path.join(x, 'meta.json')).close()
+    error = IOError
+    error_message = ("Unable to open df table - "
+        "please check spelling and enter again")
+
+    return script.get_user_input(prompt, try_func, error, error_message)
+
+def get_thresholds():
+    """Get thresholds (min doc num, min multiplier, pval threshold, max doc
+    num or None) from user input; returns None if the user is done
+    """
+    prompts = [
+        ('Min num of texts (in both samples) that a token must appear in\n \
+                (or enter q to quit):', int),
+        ('Min multiplier (times more often in target texts):', float),
+        ('Max pval:', float),
+        ('Max num of texts (in both samples) that a token can appear in\n \
+                (or press enter for no max):',
+         lambda x: int(x) if x.strip() else None)]
+    error = ValueError
+    error_message = "Error: please enter a valid number"
+
+    thresholds = []
+    for prompt, try_func in prompts:
+        if not thresholds:
+            # Let user quit before first threshold
+            try_func = lambda x, func=try_func: x if x == 'q' else func(x)
+        value = script.get_user_input(prompt, try_func, error,
+            error_message, True)
+        if value == 'q':
+            return None
+        thresholds.append(value)
+
+    return thresholds
+
+def main():
+    """Prompts for df table and thresholds, and writes the tokens passing
+    each set of thresholds to a file, until the user quits
+    """
+    LOGGER.info('Starting.......................................')
+
+    table_dir = get_table_dir()
+    df_table = table.load_df_table(table_dir)
+
+    while True:
+        thresholds = get_thresholds()
+        if thresholds is None:
+            break
+
+        query_file = raw_input('Name of file to write tokens to:\n')
+
+        start_time = time.time()
+        num_rows = df_table.write_query(query_file, *thresholds)
+
+        print '%s tokens written to %s (%.3f secs)' % (num_rows, query_file,
+            time.time() - start_time)
+        LOGGER.info('Wrote %s tokens passing %s to %s', num_rows,
+            thresholds, query_file)
+
+    LOGGER.info('Finished.......................................')
+
+if __name__ == '__main__':
+    main()
@@ -6,9 +6,12 @@
 #------------------------------------------------------------------
 import corpus_preprocessing.core.corebody as core
 import corpus_preprocessing.core.trigrams as trigrams
+import corpus_preprocessing.core.packed_ngrams as ngrams
+import corpus_preprocessing.core.stage_cache as cache
 from distutils import util
 import corpus_preprocessing.script_utils as script
 import logging
+import multiprocessing
 
 format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 
@@ -101,12 +104,24 @@ def main():
     inputs
     """
     NUM_TRIGRAM_TOKENS = 200 #POTENTIALLY GET USR INPUT ABOVE (currently 200)
+    NUM_WORKERS = multiprocessing.cpu_count() # processes for counting dfs
+    USE_INDEX = True # keep line offsets of input files in sidecar .npy files
+    USE_CACHE = True # compile input files to word id arrays, reused by reruns
+    STAGE_CACHE_DIR = '.stage_cache' # results of stages, reused by reruns
+    STAGE_CACHE_MAX_BYTES = 2**32 # least recently used results past this go
+    MAX_TOKENS_IN_MEMORY = None # if set, spill word dfs to disk past this
+    WRITE_TRIGRAMS_FILE = False # also save trigram'd texts to _trigrams.txt
+    TRIGRAM_TABLE_SIZE = None # if set, keep trigram dfs in a table this big
 
     LOGGER.info('Starting.......................................')
 
     # create core body of single words, save single word dfs to file
     corebody_params = user_input_corebody_params()
     corebody_params[1]['encoding'] = 'cp1252'
+    corebody_params[1]['num_workers'] = NUM_WORKERS
+    corebody_params[1]['use_index'] = USE_INDEX
+    corebody_params[1]['use_cache'] = USE_CACHE
+    corebody_params[1]['max_tokens_in_memory'] = MAX_TOKENS_IN_MEMORY
 
     target_file = corebody_params[0][0]
     delimiter = corebody_params[1]['delimiter']
@@ -114,21 +129,33 @@ def main():
     min_docnum = corebody_params[1]['min_docnum']
     max_docnum = corebody_params[1]['max_docnum']
     encoding = corebody_params[1]['encoding']
-    has_ids = corebody_params[2]
 
-    corebody = core.create_corebody(*corebody_params[0], **corebody_params[1])
-    core_words = [word.decode(encoding) for (id, word) in corebody.items()]
+    stage_cache = cache.StageCache(STAGE_CACHE_DIR, STAGE_CACHE_MAX_BYTES)
+
+    corebody = stage_cache.run(core.create_corebody, [target_file],
+        [target_file[:-4] + '_dfs-all.txt'], *corebody_params[0],
+        **corebody_params[1])
+    core_words = trigrams.make_words_lookup(
+        word.decode(encoding) for (id, word) in corebody.items())
 
     # using core body of single words to edit out too rare or too common
-    # words, break texts down into trigrams, save trigram'd texts to file
+    # words, break texts down into trigrams and count their dfs in the same
+    # pass, save trigram dfs to file (and trigram'd texts, if asked for);
+    # the first text is skipped when counting, like create_corebody does
+    # when re-reading a trigrams file
     trigrams_file = target_file[:-4] + '_trigrams.txt'
-    trigrams.create_trigrams_file(target_file, trigrams_file, core_words,
-        has_ids=has_ids, delimiter=delimiter, word_sep=word_sep,
-        encoding=encoding)
-
-    # create core body of trigrams, save trigram dfs to file
-    corebody_trigrams = core.create_corebody(trigrams_file,
-        tokens_limit=NUM_TRIGRAM_TOKENS, encoding=encoding)
+    output_files = [trigrams_file[:-4] + '_dfs-all.txt']
+    if WRITE_TRIGRAMS_FILE:
+        output_files.append(trigrams_file)
+    else:
+        trigrams_file = None
+
+    corebody_trigrams = stage_cache.run(ngrams.create_trigram_corebody,
+        [target_file], output_files, target_file, core_words,
+        delimiter=delimiter, word_sep=word_sep,
+        tokens_limit=NUM_TRIGRAM_TOKENS, encoding=encoding,
+        use_cache=USE_CACHE, has_header=True, trigrams_file=trigrams_file,
+        table_size=TRIGRAM_TABLE_SIZE)
 
     top_trigrams_file = ('top' + str(NUM_TRIGRAM_TOKENS) + '_trigrams.txt')
 